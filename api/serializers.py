@@ -0,0 +1,104 @@
+"""
+JSON representations of the v1 API resources.
+
+Each resource is a mapping of field name to a function that builds the
+field, so a sparse fieldset (``?fields=id,text,like_count``) only computes
+the fields it asks for. ``Context`` carries the viewer-specific data a
+response needs: which of the posts the viewer liked and which of the users
+they follow.
+"""
+from collections import namedtuple
+
+from django.urls import reverse
+
+Context = namedtuple('Context', ['liked_post_ids', 'following_ids'], defaults=[frozenset(), frozenset()])
+
+
+def _url(field):
+    return field.url if field else None
+
+
+def _avatar(user):
+    profile = getattr(user, 'profile', None)
+    return _url(profile.avatar) if profile else None
+
+
+def user_summary(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'avatar': _avatar(user),
+        'url': reverse('api_profile', args=[user.username]),
+    }
+
+
+POST_FIELDS = {
+    'id': lambda post, ctx: post.id,
+    'url': lambda post, ctx: reverse('api_post', args=[post.id]),
+    'author': lambda post, ctx: user_summary(post.user),
+    'text': lambda post, ctx: post.text,
+    'image': lambda post, ctx: _url(post.image),
+    'timestamp': lambda post, ctx: post.timestamp,
+    'updated_at': lambda post, ctx: post.updated_at,
+    'category': lambda post, ctx: post.category and {'id': post.category.id, 'name': post.category.name},
+    'tags': lambda post, ctx: [{'name': tag.name, 'slug': tag.slug} for tag in post.tags.all()],
+    'shared_from': lambda post, ctx: post.shared_from_id,
+    'like_count': lambda post, ctx: post.like_count,
+    'comment_count': lambda post, ctx: post.comment_count,
+    'share_count': lambda post, ctx: post.share_count,
+    'liked': lambda post, ctx: post.id in ctx.liked_post_ids,
+    'comments_url': lambda post, ctx: reverse('api_post_comments', args=[post.id]),
+}
+
+COMMENT_FIELDS = {
+    'id': lambda comment, ctx: comment.id,
+    'parent_id': lambda comment, ctx: comment.parent_id,
+    'depth': lambda comment, ctx: comment.depth,
+    'author': lambda comment, ctx: user_summary(comment.user),
+    'text': lambda comment, ctx: comment.text,
+    'timestamp': lambda comment, ctx: comment.timestamp,
+    'updated_at': lambda comment, ctx: comment.updated_at,
+    'reply_count': lambda comment, ctx: comment.reply_count,
+}
+
+PROFILE_FIELDS = {
+    'id': lambda profile, ctx: profile.user.id,
+    'username': lambda profile, ctx: profile.user.username,
+    'bio': lambda profile, ctx: profile.bio,
+    'avatar': lambda profile, ctx: _url(profile.avatar),
+    'date_joined': lambda profile, ctx: profile.user.date_joined,
+    'updated_at': lambda profile, ctx: profile.updated_at,
+    'post_count': lambda profile, ctx: profile.post_count,
+    'follower_count': lambda profile, ctx: profile.follower_count,
+    'following_count': lambda profile, ctx: profile.following_count,
+    'is_following': lambda profile, ctx: profile.user.id in ctx.following_ids,
+    'posts_url': lambda profile, ctx: reverse('api_profile_posts', args=[profile.user.username]),
+    'followers_url': lambda profile, ctx: reverse('api_followers', args=[profile.user.username]),
+    'following_url': lambda profile, ctx: reverse('api_following', args=[profile.user.username]),
+}
+
+# Entries of a follower/following list: the other user of the Follow row
+# (``follow.user``, set by the view) and when the follow started
+FOLLOW_FIELDS = {
+    'id': lambda follow, ctx: follow.user.id,
+    'username': lambda follow, ctx: follow.user.username,
+    'avatar': lambda follow, ctx: _avatar(follow.user),
+    'url': lambda follow, ctx: reverse('api_profile', args=[follow.user.username]),
+    'followed_at': lambda follow, ctx: follow.created_at,
+    'is_following': lambda follow, ctx: follow.user.id in ctx.following_ids,
+}
+
+
+def parse_fields(request, spec):
+    """The field names requested with ``?fields=`` (all of them by default); ValueError on unknown names"""
+    requested = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+    if not requested:
+        return tuple(spec)
+    unknown = [name for name in requested if name not in spec]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(spec)}")
+    return tuple(dict.fromkeys(requested))
+
+
+def serialize(obj, spec, fields, ctx=Context()):
+    return {name: spec[name](obj, ctx) for name in fields}
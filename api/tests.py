@@ -0,0 +1,78 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Like, Post
+from users.models import Follow, Profile
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.viewer = User.objects.create_user('viewer', password='pw')
+        Profile.objects.create(user=cls.author)
+        Profile.objects.create(user=cls.viewer)
+        cls.posts = [Post.objects.create(user=cls.author, text=f'post {i}') for i in range(3)]
+        Follow.objects.create(follower=cls.viewer, following=cls.author)
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+
+    def test_feed_paginates_with_cursor(self):
+        response = self.client.get(reverse('api_feed'), {'limit': 2})
+        data = response.json()
+        self.assertEqual([post['id'] for post in data['results']], [self.posts[2].id, self.posts[1].id])
+        response = self.client.get(reverse('api_feed'), {'limit': 2, 'cursor': data['next_cursor']})
+        self.assertEqual([post['id'] for post in response.json()['results']], [self.posts[0].id])
+        self.assertIsNone(response.json()['next_cursor'])
+
+    def test_sparse_fieldset(self):
+        response = self.client.get(reverse('api_post', args=[self.posts[0].id]), {'fields': 'id,like_count'})
+        self.assertEqual(response.json(), {'id': self.posts[0].id, 'like_count': 0})
+        response = self.client.get(reverse('api_post', args=[self.posts[0].id]), {'fields': 'id,nope'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_post_is_304_without_loading_it(self):
+        url = reverse('api_post', args=[self.posts[0].id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(2):  # validators, liked (session and user are cached)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_counter_change_changes_validators(self):
+        url = reverse('api_post', args=[self.posts[0].id])
+        etag = self.client.get(url)['ETag']
+        Like.objects.like(self.posts[0].id, self.author.id)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['like_count'], 1)
+
+    def test_comment_edit_changes_list_etag(self):
+        comment = Comment.objects.create(post=self.posts[0], user=self.author, text='first')
+        url = reverse('api_post_comments', args=[self.posts[0].id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        comment.text = 'edited'
+        comment.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['results'][0]['text'], 'edited')
+
+    def test_profile_last_modified(self):
+        url = reverse('api_profile', args=['author'])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['follower_count'], 1)
+        self.assertTrue(response.json()['is_following'])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_follow_lists(self):
+        response = self.client.get(reverse('api_followers', args=['author']))
+        self.assertEqual([entry['username'] for entry in response.json()['results']], ['viewer'])
+        response = self.client.get(reverse('api_following', args=['viewer']))
+        self.assertEqual([entry['username'] for entry in response.json()['results']], ['author'])
+
+    def test_profile_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_profile', args=['author'])).status_code, 401)
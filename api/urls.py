@@ -0,0 +1,12 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('feed/', views.feed, name='api_feed'),
+    path('posts/<int:post_id>/', views.post_detail, name='api_post'),
+    path('posts/<int:post_id>/comments/', views.post_comments, name='api_post_comments'),
+    path('users/<str:username>/', views.profile_detail, name='api_profile'),
+    path('users/<str:username>/posts/', views.profile_posts, name='api_profile_posts'),
+    path('users/<str:username>/followers/', views.followers, name='api_followers'),
+    path('users/<str:username>/following/', views.following, name='api_following'),
+]
@@ -0,0 +1,278 @@
+"""
+Version 1 of the JSON API (``/api/v1/``).
+
+Lists use the same opaque cursors as the HTML pages (``?cursor=``, with
+``next_cursor`` and ``next`` in the response) and accept ``?limit=`` up to
+API_MAX_PAGE_SIZE. Every resource takes a sparse fieldset (``?fields=``,
+see api.serializers).
+
+Responses carry a strong ETag, and single resources also a Last-Modified
+date. Both are derived from the ``updated_at`` versions of the posts,
+comments and profiles a response shows; counter updates bump those too.
+The validators are computed first, from the narrowest query that yields
+them. A request whose If-None-Match (or If-Modified-Since) still matches
+gets a 304 before anything is loaded in full or serialized. Responses are
+private to the viewer and must be revalidated (``Cache-Control: private,
+no-cache``).
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import F
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+
+from core.pagination import paginate_keyset
+from posts import cards, visibility
+from posts.models import Comment, Post, slugify_tag
+from users.context import user_contexts
+from users.models import Follow
+from . import serializers
+from .serializers import Context, serialize
+
+API_VERSION = 'v1'
+
+
+def _error(status, message):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _etag(*parts):
+    """Strong ETag over everything a response body is built from"""
+    digest = hashlib.blake2b(repr((API_VERSION,) + parts).encode(), digest_size=16).hexdigest()
+    return quote_etag(digest)
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _respond(request, etag, build, last_modified=None):
+    """304 if the client's copy is current, else the JSON from ``build()``"""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is None:
+        response = JsonResponse(build())
+    return _set_validators(response, etag, last_modified)
+
+
+def _page_size(request):
+    try:
+        return min(max(int(request.GET.get('limit', settings.FEED_PAGE_SIZE)), 1), settings.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return settings.FEED_PAGE_SIZE
+
+
+def _next_url(request, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+
+def _following_ids(viewer, user_ids):
+    if not viewer.is_authenticated or not user_ids:
+        return []
+    return sorted(Follow.objects.filter(follower=viewer.id, following__in=user_ids).values_list('following_id', flat=True))
+
+
+def _profile_version(user):
+    profile = getattr(user, 'profile', None)
+    return profile.updated_at if profile else None
+
+
+def _visible_profile(request, username):
+    """The Profile at ``username`` if the viewer may see it, else None"""
+    ctx = user_contexts(request).get_by_username(username)
+    if ctx is None or ctx.profile is None or not visibility.can_view_profile(request.user, ctx.user.id):
+        return None
+    return ctx.profile
+
+
+# Posts
+
+def _post_list(request, posts):
+    try:
+        fields = serializers.parse_fields(request, serializers.POST_FIELDS)
+    except ValueError as error:
+        return _error(400, str(error))
+    # Validators from a narrow page query; the posts are only loaded in full on a miss
+    page = paginate_keyset(
+        posts.only('id', 'timestamp', 'updated_at', 'user_id').annotate(author_updated_at=F('user__profile__updated_at')),
+        request.GET.get('cursor'), page_size=_page_size(request),
+    )
+    liked_post_ids = sorted(cards.liked_post_ids(request.user, page)) if 'liked' in fields else []
+    etag = _etag(
+        'posts', fields, page.next_cursor, liked_post_ids,
+        [(post.id, post.updated_at, post.author_updated_at) for post in page],
+    )
+
+    def build():
+        full = Post.objects.for_feed()
+        if 'tags' not in fields:
+            full = full.prefetch_related(None)
+        posts_by_id = full.in_bulk([post.id for post in page])
+        ctx = Context(liked_post_ids=frozenset(liked_post_ids))
+        return {
+            'results': [
+                serialize(posts_by_id[post.id], serializers.POST_FIELDS, fields, ctx)
+                for post in page if post.id in posts_by_id
+            ],
+            'next_cursor': page.next_cursor,
+            'next': _next_url(request, page.next_cursor),
+        }
+    return _respond(request, etag, build)
+
+
+@require_GET
+def feed(request):
+    posts = Post.objects.visible_to(request.user)
+    if request.GET.get('category', '').isdigit():
+        posts = posts.filter(category_id=request.GET['category'])
+    tag_slug = slugify_tag(request.GET.get('tag', ''))
+    if tag_slug:
+        posts = posts.filter(tags__slug=tag_slug)
+    return _post_list(request, posts)
+
+
+@require_GET
+def post_detail(request, post_id):
+    try:
+        fields = serializers.parse_fields(request, serializers.POST_FIELDS)
+    except ValueError as error:
+        return _error(400, str(error))
+    row = Post.objects.filter(id=post_id).values_list(
+        'user_id', 'is_hidden', 'updated_at', 'user__profile__updated_at',
+    ).first()
+    if row is None or not visibility.can_view_post(request.user, row[0], row[1]):
+        return _error(404, 'Post not found')
+    author_id, is_hidden, updated_at, author_updated_at = row
+    liked = 'liked' in fields and bool(cards.liked_post_ids(request.user, [Post(id=post_id)]))
+    etag = _etag('post', fields, post_id, updated_at, author_updated_at, liked)
+    last_modified = max(filter(None, [updated_at, author_updated_at]))
+
+    def build():
+        post = Post.objects.for_feed().get(id=post_id)
+        return serialize(post, serializers.POST_FIELDS, fields, Context(liked_post_ids=frozenset([post_id] if liked else [])))
+    return _respond(request, etag, build, last_modified)
+
+
+@require_GET
+def post_comments(request, post_id):
+    """Top-level comments, oldest first, or a whole reply thread with ``?thread=<comment id>``"""
+    try:
+        fields = serializers.parse_fields(request, serializers.COMMENT_FIELDS)
+    except ValueError as error:
+        return _error(400, str(error))
+    row = Post.objects.filter(id=post_id).values_list('user_id', 'is_hidden').first()
+    if row is None or not visibility.can_view_post(request.user, *row):
+        return _error(404, 'Post not found')
+    comments = Comment.objects.visible_to(request.user).select_related('user__profile').with_reply_counts()
+
+    thread_id = request.GET.get('thread', '')
+    if thread_id:
+        parent = thread_id.isdigit() and Comment.objects.filter(id=thread_id, post_id=post_id).first()
+        if not parent:
+            return _error(404, 'Comment not found')
+        limit = settings.COMMENT_THREAD_LIMIT
+        rows = list(comments.subtree(parent)[:limit + 1])
+        page, next_cursor, truncated = rows[:limit], None, len(rows) > limit
+    else:
+        page = paginate_keyset(
+            comments.filter(post_id=post_id).roots(), request.GET.get('cursor'),
+            page_size=_page_size(request), descending=False,
+        )
+        next_cursor, truncated = page.next_cursor, False
+    etag = _etag(
+        'comments', fields, next_cursor, truncated,
+        [(comment.id, comment.updated_at, comment.reply_count, _profile_version(comment.user)) for comment in page],
+    )
+
+    def build():
+        data = {'results': [serialize(comment, serializers.COMMENT_FIELDS, fields) for comment in page]}
+        if thread_id:
+            data['truncated'] = truncated
+        else:
+            data.update(next_cursor=next_cursor, next=_next_url(request, next_cursor))
+        return data
+    return _respond(request, etag, build)
+
+
+# Profiles
+
+@require_GET
+def profile_detail(request, username):
+    if not request.user.is_authenticated:
+        return _error(401, 'Authentication required')
+    try:
+        fields = serializers.parse_fields(request, serializers.PROFILE_FIELDS)
+    except ValueError as error:
+        return _error(400, str(error))
+    profile = _visible_profile(request, username)
+    if profile is None:
+        return _error(404, 'Profile not found')
+    following_ids = _following_ids(request.user, [profile.user_id]) if 'is_following' in fields else []
+    etag = _etag('profile', fields, profile.pk, profile.updated_at, following_ids)
+    ctx = Context(following_ids=frozenset(following_ids))
+    return _respond(request, etag, lambda: serialize(profile, serializers.PROFILE_FIELDS, fields, ctx), profile.updated_at)
+
+
+@require_GET
+def profile_posts(request, username):
+    if not request.user.is_authenticated:
+        return _error(401, 'Authentication required')
+    profile = _visible_profile(request, username)
+    if profile is None:
+        return _error(404, 'Profile not found')
+    return _post_list(request, Post.objects.filter(user=profile.user_id).visible_to(request.user))
+
+
+def _follow_list(request, username, user_field, other_field):
+    if not request.user.is_authenticated:
+        return _error(401, 'Authentication required')
+    try:
+        fields = serializers.parse_fields(request, serializers.FOLLOW_FIELDS)
+    except ValueError as error:
+        return _error(400, str(error))
+    profile = _visible_profile(request, username)
+    if profile is None:
+        return _error(404, 'Profile not found')
+    follows = visibility.visible_users(
+        Follow.objects.filter(**{user_field: profile.user_id}).select_related(f'{other_field}__profile'),
+        request.user, field=other_field,
+    )
+    page = paginate_keyset(follows, request.GET.get('cursor'), field='created_at', page_size=_page_size(request))
+    for follow in page:
+        follow.user = getattr(follow, other_field)
+    following_ids = _following_ids(request.user, [follow.user.id for follow in page]) if 'is_following' in fields else []
+    etag = _etag(
+        'follows', fields, page.next_cursor, following_ids,
+        [(follow.id, _profile_version(follow.user)) for follow in page],
+    )
+
+    def build():
+        ctx = Context(following_ids=frozenset(following_ids))
+        return {
+            'results': [serialize(follow, serializers.FOLLOW_FIELDS, fields, ctx) for follow in page],
+            'next_cursor': page.next_cursor,
+            'next': _next_url(request, page.next_cursor),
+        }
+    return _respond(request, etag, build)
+
+
+@require_GET
+def followers(request, username):
+    return _follow_list(request, username, 'following', 'follower')
+
+
+@require_GET
+def following(request, username):
+    return _follow_list(request, username, 'follower', 'following')
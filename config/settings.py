@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Choices, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'users',
     'posts',
     'core',
+    'api',
 ]
 
 MIDDLEWARE = [
@@ -53,11 +54,24 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request query/latency instrumentation (core.metrics), served as JSON
+# at /metrics/ and as a Server-Timing header
+REQUEST_METRICS_ENABLED = config('REQUEST_METRICS_ENABLED', default=False, cast=bool)
+REQUEST_METRICS_SLOW_MS = config('REQUEST_METRICS_SLOW_MS', default=500, cast=int)
+REQUEST_METRICS_WINDOW = 1000
+REQUEST_METRICS_DUPLICATE_THRESHOLD = 3
+
+if REQUEST_METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'core.middleware.RequestMetricsMiddleware')
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': (
+            'core.metrics.TimedDjangoTemplates' if REQUEST_METRICS_ENABLED
+            else 'django.template.backends.django.DjangoTemplates'
+        ),
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -76,13 +90,106 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_ENGINE picks the profile: 'sqlite' (default) or 'postgresql'.
+# DATABASE_CONN_MAX_AGE keeps connections open for that many seconds (checked
+# before reuse) so requests don't pay for a reconnect. That only helps under
+# WSGI: under ASGI the async views run their queries on sync_to_async worker
+# threads, whose persistent connections are neither reliably reused nor
+# closed, so it defaults to 0 (use DATABASE_POOL on PostgreSQL instead).
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='sqlite')
+DATABASE_CONN_MAX_AGE = config('DATABASE_CONN_MAX_AGE', default=0, cast=int)
+# Seconds a writer waits for a lock before failing with "database is locked"
+DATABASE_TIMEOUT = config('DATABASE_TIMEOUT', default=20, cast=int)
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DATABASE_NAME', default='socialhub'),
+            'USER': config('DATABASE_USER', default='socialhub'),
+            'PASSWORD': config('DATABASE_PASSWORD', default=''),
+            'HOST': config('DATABASE_HOST', default='localhost'),
+            'PORT': config('DATABASE_PORT', default='5432'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'options': f'-c statement_timeout={DATABASE_TIMEOUT * 1000}',
+            },
+        }
+    }
+    # psycopg's connection pool (requires psycopg[pool]); Django manages
+    # pooled connections itself, so persistent connections must be off
+    if config('DATABASE_POOL', default=False, cast=bool):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': config('DATABASE_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DATABASE_POOL_MAX_SIZE', default=20, cast=int),
+            'timeout': DATABASE_TIMEOUT,
+        }
+else:
+    # WAL lets readers run alongside the single writer, and IMMEDIATE
+    # transactions take the write lock up front, so concurrent likes and
+    # comments queue on busy_timeout instead of failing mid-transaction
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': DATABASE_TIMEOUT * 1000,
+        'cache_size': -config('SQLITE_CACHE_SIZE_KB', default=64000, cast=int),
+        'mmap_size': config('SQLITE_MMAP_SIZE', default=128 * 1024 * 1024, cast=int),
+        'temp_store': 'MEMORY',
+    }
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DATABASE_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': DATABASE_TIMEOUT,
+            },
+            # A file-backed test database lets concurrency tests use separate
+            # connections (shared-cache in-memory SQLite fails them with SQLITE_LOCKED)
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Any backend works, e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# with CACHE_LOCATION=redis://127.0.0.1:6379 (needs the redis package)
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='socialhub'),
     }
 }
 
+# Rendered post cards (posts.cards)
+POST_CARD_CACHE = 'default'
+POST_CARD_CACHE_TIMEOUT = config('POST_CARD_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Sessions: SESSION_PROFILE picks where they live. 'cached_db' reads them
+# from the cache and writes through to the database; 'cache' keeps them only
+# in the cache (lost on eviction or restart, so it needs a shared persistent
+# cache such as Redis); 'signed_cookies' keeps them in the browser (no
+# server-side storage, so logging out cannot revoke a copied cookie); 'db'
+# queries django_session on every authenticated request
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_PROFILE = config('SESSION_PROFILE', default='cached_db', cast=Choices(list(SESSION_ENGINES)))
+SESSION_ENGINE = SESSION_ENGINES[SESSION_PROFILE]
+SESSION_CACHE_ALIAS = config('SESSION_CACHE_ALIAS', default='default')
+# Sessions are only written when they change, never just to renew the cookie
+SESSION_SAVE_EVERY_REQUEST = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -102,6 +209,18 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# The signed-in user is loaded with their Profile and Settings from the
+# user context cache (users.context). ModelBackend stays listed so sessions
+# created before the switch, which name it, are still valid.
+AUTHENTICATION_BACKENDS = [
+    'users.backends.UserContextBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# How long a user's User/Profile/Settings rows are cached (invalidated on
+# change; the TTL bounds staleness across processes with a per-process cache)
+USER_CONTEXT_CACHE_SECONDS = config('USER_CONTEXT_CACHE_SECONDS', default=30, cast=int)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -125,6 +244,12 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Upload pipeline (core.images): 'thread' processes uploads on a background
+# thread after commit, 'sync' does it inline (useful for tests and scripts)
+IMAGE_PIPELINE_MODE = config('IMAGE_PIPELINE_MODE', default='thread')
+IMAGE_MAX_DIMENSION = 2048
+IMAGE_QUALITY = 80
+
 # Email configuration using Gmail SMTP and python-decouple
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
@@ -134,6 +259,68 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Base URL used for links in notification emails
+SITE_URL = config('SITE_URL', default='http://127.0.0.1:8000')
+
+# Notification outbox (drained by `python manage.py send_outbox`)
+OUTBOX_COALESCE_SECONDS = config('OUTBOX_COALESCE_SECONDS', default=60, cast=int)
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE_SECONDS = 60
+OUTBOX_RETRY_MAX_SECONDS = 3600
+# How long a worker may hold emails it is sending; after that (e.g. it
+# crashed) they are pending again
+OUTBOX_CLAIM_SECONDS = 300
+
+# Number of posts rendered per feed page (keyset pagination)
+FEED_PAGE_SIZE = config('FEED_PAGE_SIZE', default=20, cast=int)
+
+# Largest ?limit= the JSON API accepts for a page
+API_MAX_PAGE_SIZE = 100
+
+# How long per-viewer block sets and per-user privacy settings are cached
+# (both are invalidated on change)
+VISIBILITY_CACHE_SECONDS = 3600
+
+# Follow suggestions (precomputed by `python manage.py compute_suggestions`):
+# how many are stored per user and shown on their profile, and the most
+# accounts someone may follow and still count as a mutual connection
+SUGGESTIONS_PER_USER = 20
+SUGGESTIONS_SHOWN = 5
+SUGGESTIONS_MAX_FOLLOWING = config('SUGGESTIONS_MAX_FOLLOWING', default=1000, cast=int)
+
+# Open reports that hide a post until a moderator reviews it (0 disables
+# auto-hiding; see posts.moderation)
+MODERATION_AUTO_HIDE_REPORTS = config('MODERATION_AUTO_HIDE_REPORTS', default=5, cast=int)
+
+# Top-level comments per page on post detail, and the most replies one
+# thread request returns
+COMMENT_PAGE_SIZE = config('COMMENT_PAGE_SIZE', default=50, cast=int)
+COMMENT_THREAD_LIMIT = 500
+
+# Following timeline: authors above the fan-out limit are merged at read time
+TIMELINE_FANOUT_LIMIT = config('TIMELINE_FANOUT_LIMIT', default=5000, cast=int)
+TIMELINE_MAX_ENTRIES = config('TIMELINE_MAX_ENTRIES', default=800, cast=int)
+TIMELINE_BACKFILL_POSTS = 50
+TIMELINE_HIGH_FANOUT_CACHE_SECONDS = 300
+
+# Hot feed and trending tags (precomputed by `python manage.py compute_rankings`):
+# engagement of posts from the last RANKING_WINDOW_HOURS, divided by
+# (age in hours + 2) ** RANKING_GRAVITY
+RANKING_WINDOW_HOURS = config('RANKING_WINDOW_HOURS', default=72, cast=int)
+RANKING_GRAVITY = config('RANKING_GRAVITY', default=1.8, cast=float)
+RANKING_SIZE = config('RANKING_SIZE', default=500, cast=int)
+TRENDING_TAGS_SIZE = 10
+
+# Live updates (posts.live): Server-Sent Events fed by core.pubsub. Use
+# core.pubsub.RedisBroker when running more than one worker process
+PUBSUB_BACKEND = config('PUBSUB_BACKEND', default='core.pubsub.InProcessBroker')
+PUBSUB_URL = config('PUBSUB_URL', default='redis://localhost:6379/0')
+PUBSUB_QUEUE_SIZE = 100
+LIVE_UPDATES_MAX_POSTS = 100
+LIVE_UPDATES_KEEPALIVE_SECONDS = 15
+LIVE_UPDATES_MAX_SECONDS = 300
+LIVE_UPDATES_RETRY_MS = 3000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -142,3 +329,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom error handlers
 HANDLER404 = 'core.views.custom_404'
 HANDLER500 = 'core.views.custom_error'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.metrics': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
@@ -23,6 +23,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('posts/', include('posts.urls')),
+    path('api/v1/', include('api.urls')),
     path('', include('core.urls')),
 ]
 
@@ -0,0 +1,284 @@
+"""
+Benchmarks for the hot views.
+
+Each scenario requests one view through the Django test client and records
+its latency and the number of SQL statements it ran. Query budgets are
+fixed per view: they must not grow with the amount of data, so a budget
+failure usually means a new N+1 loop or an unbounded query. Run them with
+``python manage.py benchmark`` against a database filled by
+``python manage.py seed_data``; core.tests checks the budgets on a small
+data set.
+
+``run_throughput`` compares the two deployment paths under concurrency. It
+drives the real handlers in process, with no network in between: the WSGI
+application from a pool of threads (like a threaded gunicorn worker), and
+the ASGI application from concurrent tasks on one event loop (like
+uvicorn).
+
+``run_session_profiles`` repeats the like and feed scenarios under each
+session backend of SESSION_ENGINES and counts the ``django_session``
+queries among the rest.
+"""
+import asyncio
+import io
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+from .metrics import PERCENTILES, percentile
+
+
+# ``url`` builds the URL from the Fixtures; ``teardown(client, fixtures)`` runs
+# after each request, e.g. to undo a like so every iteration starts alike
+Scenario = namedtuple('Scenario', ['name', 'budget', 'url', 'method', 'teardown'], defaults=['get', None])
+Fixtures = namedtuple('Fixtures', ['viewer', 'author', 'post', 'word'])
+
+
+SCENARIOS = [
+    Scenario('home_feed', 8, lambda f: reverse('home_feed')),
+    Scenario('hot_feed', 8, lambda f: reverse('home_feed') + '?sort=hot'),
+    Scenario('following_feed', 8, lambda f: reverse('following_feed')),
+    Scenario('post_detail', 8, lambda f: reverse('post_detail', args=[f.post.id])),
+    Scenario('profile', 10, lambda f: reverse('profile', args=[f.author.username])),
+    Scenario(
+        'like_post', 6, lambda f: reverse('like_post', args=[f.post.id]), method='post',
+        teardown=lambda client, f: client.post(reverse('unlike_post', args=[f.post.id])),
+    ),
+    Scenario('followers', 5, lambda f: reverse('followers', args=[f.author.username])),
+    Scenario('search_users', 6, lambda f: reverse('search_users') + f'?q={f.author.username[:4]}'),
+    Scenario('search_posts', 8, lambda f: reverse('home_feed') + f'?q={f.word}'),
+]
+
+
+def load_fixtures():
+    """Pick a representative viewer, the most followed author and the most liked post"""
+    author = User.objects.annotate(total=Count('followers')).order_by('-total', 'id').first()
+    viewer = User.objects.annotate(total=Count('following')).order_by('-total', 'id').first()
+    post = Post.objects.order_by('-like_count', '-id').first()
+    if not (author and viewer and post):
+        return None
+    word = post.text.split()[0] if post.text.split() else 'post'
+    return Fixtures(viewer=viewer, author=author, post=post, word=word)
+
+
+def run_scenario(client, scenario, fixtures, iterations):
+    url = scenario.url(fixtures)
+    timings = []
+    queries = []
+    session_queries = []
+    status = None
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = getattr(client, scenario.method)(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(ctx.captured_queries))
+        session_queries.append(sum('django_session' in query['sql'] for query in ctx.captured_queries))
+        status = response.status_code
+        if scenario.teardown:
+            scenario.teardown(client, fixtures)
+    # The first request warms caches; percentiles describe the warm ones
+    warm = sorted(timings[1:] or timings)
+    return {
+        'url': url,
+        'status': status,
+        'budget': scenario.budget,
+        'queries': max(queries),
+        'session_queries': max(session_queries),
+        'cold_ms': round(timings[0], 2),
+        'latency_ms': {f'p{pct}': round(percentile(warm, pct), 2) for pct in PERCENTILES},
+    }
+
+
+def run_benchmarks(iterations=20, names=None, fixtures=None):
+    """Run the selected scenarios and return ``{name: result}``"""
+    fixtures = fixtures or load_fixtures()
+    if fixtures is None:
+        raise ValueError('No data to benchmark; run seed_data first')
+    client = Client()
+    client.force_login(fixtures.viewer)
+    results = {}
+    for scenario in SCENARIOS:
+        if names and scenario.name not in names:
+            continue
+        results[scenario.name] = run_scenario(client, scenario, fixtures, iterations)
+    return results
+
+
+def run_session_profiles(iterations=20, names=('home_feed', 'like_post'), fixtures=None):
+    """Run the selected scenarios once per session profile and return ``{profile: {name: result}}``"""
+    fixtures = fixtures or load_fixtures()
+    if fixtures is None:
+        raise ValueError('No data to benchmark; run seed_data first')
+    results = {}
+    for profile, engine in settings.SESSION_ENGINES.items():
+        with override_settings(SESSION_ENGINE=engine):
+            # A new client loads the session middleware, and logs in, with this engine
+            client = Client()
+            client.force_login(fixtures.viewer)
+            results[profile] = {
+                scenario.name: run_scenario(client, scenario, fixtures, iterations)
+                for scenario in SCENARIOS if scenario.name in names
+            }
+    return results
+
+
+def over_budget(results):
+    """Names of the scenarios that ran more queries than their budget"""
+    return [name for name, result in results.items() if result['queries'] > result['budget']]
+
+
+def _session_cookie(user):
+    client = Client()
+    client.force_login(user)
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+
+def _wsgi_request(application, url, cookie):
+    parts = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'HTTP_COOKIE': cookie,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(int(status[:3])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return statuses[0]
+
+
+async def _asgi_request(application, url, cookie):
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': parts.path,
+        'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    body = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    statuses = []
+
+    async def receive():
+        if body:
+            return body.pop()
+        # The client never disconnects; the handler cancels this once it has responded
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    return statuses[0]
+
+
+def _throughput(timings, statuses, elapsed, concurrency):
+    warm = sorted(timings)
+    return {
+        'requests': len(timings),
+        'concurrency': concurrency,
+        'errors': sum(1 for status in statuses if status != 200),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'latency_ms': {f'p{pct}': round(percentile(warm, pct), 2) for pct in PERCENTILES},
+    }
+
+
+def _run_wsgi(url, cookie, concurrency, total):
+    application = get_wsgi_application()
+    timings, statuses = [], []
+
+    def worker(count):
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                statuses.append(_wsgi_request(application, url, cookie))
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, _shares(total, concurrency)))
+    return _throughput(timings, statuses, time.perf_counter() - started, concurrency)
+
+
+async def _run_asgi(url, cookie, concurrency, total):
+    application = get_asgi_application()
+    timings, statuses = [], []
+
+    async def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            statuses.append(await _asgi_request(application, url, cookie))
+            timings.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(count) for count in _shares(total, concurrency)))
+    return _throughput(timings, statuses, time.perf_counter() - started, concurrency)
+
+
+def _shares(total, workers):
+    return [total // workers + (1 if i < total % workers else 0) for i in range(workers)]
+
+
+def run_throughput(concurrency=20, total=200, names=None, fixtures=None):
+    """
+    Requests per second of the GET scenarios through WSGI and ASGI.
+
+    Needs data committed to the database (the worker threads open their own
+    connections), so it cannot run inside a test transaction.
+    """
+    fixtures = fixtures or load_fixtures()
+    if fixtures is None:
+        raise ValueError('No data to benchmark; run seed_data first')
+    cookie = _session_cookie(fixtures.viewer)
+    results = {}
+    for scenario in SCENARIOS:
+        if scenario.method != 'get' or (names and scenario.name not in names):
+            continue
+        url = scenario.url(fixtures)
+        # One untimed request warms the caches for both runs
+        _wsgi_request(get_wsgi_application(), url, cookie)
+        results[scenario.name] = {
+            'url': url,
+            'wsgi': _run_wsgi(url, cookie, concurrency, total),
+            'asgi': asyncio.run(_run_asgi(url, cookie, concurrency, total)),
+        }
+    return results
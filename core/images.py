@@ -0,0 +1,154 @@
+"""
+Image upload pipeline for post images and avatars.
+
+After an upload is committed, ``schedule()`` hands the file to a background
+thread that:
+
+* applies and then strips EXIF data (orientation is baked into the pixels)
+* caps the original at IMAGE_MAX_DIMENSION pixels
+* re-encodes it as WebP (or JPEG when Pillow lacks WebP) at IMAGE_QUALITY
+* writes the resized renditions listed in RENDITIONS next to it
+
+The rendition names and sizes are stored in a JSON field on the model, and
+the ``responsive_img`` template tag turns them into a ``srcset`` so the
+browser downloads the smallest file that fits.
+"""
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# name: (width, height, crop to exactly that size)
+RENDITIONS = {
+    'post': {
+        'thumb': (320, 320, False),
+        'card': (640, 640, False),
+        'detail': (1280, 1280, False),
+    },
+    'avatar': {
+        'sm': (48, 48, True),
+        'md': (96, 96, True),
+        'lg': (180, 180, True),
+        'xl': (360, 360, True),
+    },
+}
+
+# Sent with ``pk`` after processed renditions are saved (via a bulk UPDATE,
+# so post_save does not fire)
+image_processed = Signal()
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='images')
+
+
+def output_format():
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def _encode(image, image_format):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    buffer = io.BytesIO()
+    options = {'quality': settings.IMAGE_QUALITY}
+    options.update({'method': 6} if image_format == 'WEBP' else {'optimize': True, 'progressive': True})
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def process_image(field_file, kind):
+    """
+    Normalize ``field_file`` in place and write its renditions.
+
+    Returns ``(new_name, renditions)`` where ``renditions`` maps a rendition
+    name to ``{'name', 'width', 'height'}``.
+    """
+    storage = field_file.storage
+    image_format, extension = output_format()
+    with field_file.open('rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    max_dimension = settings.IMAGE_MAX_DIMENSION
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    path = PurePosixPath(field_file.name)
+    new_name = storage.save(str(path.with_suffix(f'.{extension}')), ContentFile(_encode(image, image_format)))
+    stem = PurePosixPath(new_name).stem
+
+    renditions = {}
+    for name, (width, height, crop) in RENDITIONS[kind].items():
+        if crop:
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.LANCZOS)
+        rendition_name = storage.save(
+            str(path.parent / 'renditions' / f'{stem}_{name}.{extension}'),
+            ContentFile(_encode(resized, image_format)),
+        )
+        renditions[name] = {'name': rendition_name, 'width': resized.width, 'height': resized.height}
+
+    if new_name != field_file.name:
+        storage.delete(field_file.name)
+    return new_name, renditions
+
+
+def process_instance(model_label, pk, field_name, renditions_field, kind):
+    """Process the stored image of one row and publish the result"""
+    try:
+        model = apps.get_model(model_label)
+        instance = model.objects.filter(pk=pk).only(field_name, renditions_field).first()
+        field_file = getattr(instance, field_name, None) if instance else None
+        if not field_file:
+            return
+        original_name = field_file.name
+        old_renditions = getattr(instance, renditions_field) or {}
+        new_name, renditions = process_image(field_file, kind)
+        # Only publish if the field was not replaced by a newer upload meanwhile
+        updated = model.objects.filter(pk=pk, **{field_name: original_name}).update(
+            **{field_name: new_name, renditions_field: renditions}
+        )
+        if updated:
+            image_processed.send(sender=model, pk=pk)
+            stale = [rendition['name'] for rendition in old_renditions.values()]
+        else:
+            stale = [new_name] + [rendition['name'] for rendition in renditions.values()]
+        for name in stale:
+            field_file.storage.delete(name)
+    except Exception:
+        logger.exception('Image processing failed for %s %s', model_label, pk)
+
+
+def _run_in_thread(*args):
+    try:
+        process_instance(*args)
+    finally:
+        connections.close_all()
+
+
+def discard_renditions(instance, field_name, renditions_field):
+    """Delete the renditions of an image that is about to be replaced"""
+    field_file = getattr(instance, field_name)
+    for rendition in (getattr(instance, renditions_field) or {}).values():
+        field_file.storage.delete(rendition['name'])
+    setattr(instance, renditions_field, {})
+
+
+def schedule(instance, field_name, renditions_field, kind):
+    """Process ``instance.<field_name>`` once the current transaction commits"""
+    args = (instance._meta.label, instance.pk, field_name, renditions_field, kind)
+    if settings.IMAGE_PIPELINE_MODE == 'sync':
+        transaction.on_commit(lambda: process_instance(*args))
+    else:
+        transaction.on_commit(lambda: _executor.submit(_run_in_thread, *args))
@@ -0,0 +1,116 @@
+import json
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.benchmarks import SCENARIOS, over_budget, run_benchmarks, run_session_profiles, run_throughput
+from posts.models import Like, Post
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Time the hot views, check their query budgets and save the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per scenario')
+        parser.add_argument(
+            '--scenario', action='append', choices=[scenario.name for scenario in SCENARIOS],
+            help='Only run this scenario (repeatable)',
+        )
+        parser.add_argument('--output', help='JSON file to write (default: benchmarks/<timestamp>-<commit>.json)')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+        parser.add_argument('--no-budgets', action='store_true', help='Do not fail when a query budget is exceeded')
+        parser.add_argument(
+            '--concurrency', type=int, default=0,
+            help='Also compare WSGI and ASGI throughput with this many concurrent requests',
+        )
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and server with --concurrency')
+        parser.add_argument(
+            '--sessions', action='store_true',
+            help='Also compare the queries of the like and feed views under each SESSION_PROFILE',
+        )
+
+    def handle(self, *args, **options):
+        # The test client talks to "testserver", which ALLOWED_HOSTS may not list
+        with override_settings(ALLOWED_HOSTS=['*']):
+            try:
+                results = run_benchmarks(options['iterations'], options['scenario'])
+                throughput = run_throughput(
+                    options['concurrency'], options['requests'], options['scenario'],
+                ) if options['concurrency'] else {}
+                sessions = run_session_profiles(options['iterations']) if options['sessions'] else {}
+            except ValueError as error:
+                raise CommandError(str(error))
+
+        commit = git_commit()
+        report = {
+            'commit': commit,
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'data': {
+                'users': User.objects.count(),
+                'posts': Post.objects.count(),
+                'likes': Like.objects.count(),
+            },
+            'scenarios': results,
+            'throughput': throughput,
+            'session_profiles': sessions,
+        }
+        output = Path(options['output'] or settings.BASE_DIR / 'benchmarks' / (
+            f"{timezone.now():%Y%m%d-%H%M%S}-{commit or 'nogit'}.json"
+        ))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+
+        previous = self.load(options['compare']) if options['compare'] else {}
+        for name, result in results.items():
+            line = (
+                f"{name:<16} {result['status']} queries {result['queries']:>3}/{result['budget']:<3} "
+                f"p50 {result['latency_ms']['p50']:>8.2f} ms  p95 {result['latency_ms']['p95']:>8.2f} ms"
+            )
+            before = previous.get(name)
+            if before:
+                change = result['latency_ms']['p50'] - before['latency_ms']['p50']
+                line += f"  (p50 {change:+.2f} ms, queries {result['queries'] - before['queries']:+d})"
+            self.stdout.write(line)
+        for name, result in throughput.items():
+            wsgi, asgi = result['wsgi'], result['asgi']
+            self.stdout.write(
+                f"{name:<16} wsgi {wsgi['requests_per_second']:>7.1f} req/s  asgi {asgi['requests_per_second']:>7.1f} req/s "
+                f"(x{asgi['requests_per_second'] / wsgi['requests_per_second']:.2f}, "
+                f"p95 {wsgi['latency_ms']['p95']:.1f} / {asgi['latency_ms']['p95']:.1f} ms, "
+                f"errors {wsgi['errors']} / {asgi['errors']})"
+            )
+        for profile, profile_results in sessions.items():
+            for name, result in profile_results.items():
+                self.stdout.write(
+                    f"{profile:<14} {name:<16} queries {result['queries']:>3} "
+                    f"(django_session {result['session_queries']})  p50 {result['latency_ms']['p50']:>8.2f} ms"
+                )
+        self.stdout.write(f'Results written to {output}')
+
+        failed = over_budget(results)
+        if failed and not options['no_budgets']:
+            raise CommandError(f"Query budget exceeded: {', '.join(failed)}")
+
+    def load(self, path):
+        try:
+            return json.loads(Path(path).read_text())['scenarios']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Could not read {path}: {error}')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core.images import process_instance
+from posts.models import Post
+from users.models import Profile
+
+TARGETS = [
+    (Post, 'image', 'image_renditions', 'post'),
+    (Profile, 'avatar', 'avatar_renditions', 'avatar'),
+]
+
+
+class Command(BaseCommand):
+    help = "Process uploaded post images and avatars that have no renditions yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Reprocess images that already have renditions')
+
+    def handle(self, *args, **options):
+        for model, field_name, renditions_field, kind in TARGETS:
+            rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            if not options['all']:
+                rows = rows.filter(**{renditions_field: {}})
+            processed = 0
+            for pk in rows.values_list('pk', flat=True).iterator():
+                process_instance(model._meta.label, pk, field_name, renditions_field, kind)
+                processed += 1
+            self.stdout.write(f'{model._meta.verbose_name_plural}: processed {processed} images')
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,174 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts import search
+from posts.models import Category, Comment, Like, Post, Tag
+from users.models import Follow, Profile, Settings
+
+WORDS = (
+    'python django coffee travel music sunset weekend morning code release '
+    'football recipe garden coffee photo movie running mountains city friends '
+    'launch update design books rain summer winter holiday concert startup'
+).split()
+CATEGORIES = ['News', 'Tech', 'Sports', 'Music', 'Travel', 'Food']
+TAGS = [f'{word}{suffix}' for word in WORDS[:25] for suffix in ('', 'life')]
+
+
+def zipf_weights(count, exponent):
+    """Cumulative Zipf weights: rank 1 is ``2 ** exponent`` times as popular as rank 2"""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the given auto_now_add values instead of overwriting them"""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Generate users, posts, likes, comments and follows with skewed popularity for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--likes', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--days', type=int, default=90, help='Spread post timestamps over this many days')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of author/post popularity')
+        parser.add_argument('--prefix', default='seed', help='Username prefix of generated users')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, for repeatable data sets')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-timelines', action='store_true', help='Do not backfill following timelines')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        now = timezone.now()
+
+        user_ids = self.create_users(options['users'], options['prefix'])
+        # Popularity rank of each user; the same users are the most followed and the most active
+        self.random.shuffle(user_ids)
+        user_weights = zipf_weights(len(user_ids), options['skew'])
+
+        post_ids = self.create_posts(options['posts'], user_ids, user_weights, now, options['days'])
+        post_ranking = list(post_ids)
+        self.random.shuffle(post_ranking)
+        post_weights = zipf_weights(len(post_ranking), options['skew'])
+
+        self.create_pairs(
+            Follow, 'follower_id', 'following_id', options['follows'],
+            lambda k: self.random.choices(user_ids, k=k),
+            lambda k: self.random.choices(user_ids, cum_weights=user_weights, k=k),
+            skip_self=True,
+        )
+        self.create_pairs(
+            Like, 'user_id', 'post_id', options['likes'],
+            lambda k: self.random.choices(user_ids, k=k),
+            lambda k: self.random.choices(post_ranking, cum_weights=post_weights, k=k),
+        )
+        self.create_comments(options['comments'], user_ids, post_ranking, post_weights, now)
+
+        self.stdout.write('Reconciling counters...')
+        call_command('reconcile_counters', stdout=self.stdout)
+        if search.is_available():
+            self.stdout.write('Rebuilding search index...')
+            search.rebuild()
+        self.stdout.write('Computing rankings...')
+        call_command('compute_rankings', stdout=self.stdout)
+        self.stdout.write('Computing follow suggestions...')
+        call_command('compute_suggestions', stdout=self.stdout)
+        if not options['skip_timelines']:
+            self.stdout.write('Backfilling timelines...')
+            call_command('backfill_timelines', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Seed data created.'))
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield min(self.batch_size, total - start)
+
+    def create_users(self, total, prefix):
+        password = make_password('password')
+        start = User.objects.filter(username__startswith=prefix).count()
+        for size in self.batches(total):
+            users = User.objects.bulk_create([
+                User(username=f'{prefix}{start + i}', email=f'{prefix}{start + i}@example.com', password=password)
+                for i in range(size)
+            ])
+            start += size
+            Profile.objects.bulk_create([Profile(user=user) for user in users])
+            Settings.objects.bulk_create([Settings(user=user, email_notifications=False) for user in users])
+        self.stdout.write(f'Created {total} users')
+        return list(
+            User.objects.filter(username__startswith=prefix).order_by('-id').values_list('id', flat=True)[:total]
+        )
+
+    def create_posts(self, total, user_ids, user_weights, now, days):
+        categories = [Category.objects.get_or_create(name=name)[0] for name in CATEGORIES]
+        tags = Tag.objects.resolve(TAGS)
+        Through = Post.tags.through
+        span = timedelta(days=days).total_seconds()
+        created = []
+        with explicit_timestamps(Post._meta.get_field('timestamp')):
+            for size in self.batches(total):
+                offsets = sorted((self.random.random() * span for _ in range(size)), reverse=True)
+                authors = self.random.choices(user_ids, cum_weights=user_weights, k=size)
+                posts = Post.objects.bulk_create([
+                    Post(
+                        user_id=author_id,
+                        text=' '.join(self.random.choices(WORDS, k=self.random.randint(4, 30))),
+                        category=self.random.choice(categories + [None]),
+                        timestamp=now - timedelta(seconds=offset),
+                    )
+                    for author_id, offset in zip(authors, offsets)
+                ])
+                Through.objects.bulk_create(
+                    [
+                        Through(post_id=post.id, tag_id=tag.id)
+                        for post in posts
+                        for tag in self.random.sample(tags, self.random.randint(0, 3))
+                    ],
+                    ignore_conflicts=True,
+                )
+                created += [post.id for post in posts]
+        self.stdout.write(f'Created {total} posts')
+        return created
+
+    def create_pairs(self, model, left, right, total, pick_left, pick_right, skip_self=False):
+        for size in self.batches(total):
+            pairs = zip(pick_left(size), pick_right(size))
+            model.objects.bulk_create(
+                [model(**{left: a, right: b}) for a, b in pairs if not (skip_self and a == b)],
+                ignore_conflicts=True,
+            )
+        self.stdout.write(f'Created up to {total} {model._meta.verbose_name_plural} (duplicates skipped)')
+
+    def create_comments(self, total, user_ids, post_ranking, post_weights, now):
+        with explicit_timestamps(Comment._meta.get_field('timestamp')):
+            for size in self.batches(total):
+                posts = self.random.choices(post_ranking, cum_weights=post_weights, k=size)
+                Comment.objects.bulk_create([
+                    Comment(
+                        post_id=post_id,
+                        user_id=self.random.choice(user_ids),
+                        text=' '.join(self.random.choices(WORDS, k=self.random.randint(2, 12))),
+                        timestamp=now - timedelta(seconds=self.random.random() * 3600),
+                    )
+                    for post_id in posts
+                ])
+        Comment.objects.fill_root_paths()
+        self.stdout.write(f'Created {total} comments')
@@ -0,0 +1,206 @@
+"""
+Per-request cost instrumentation.
+
+``RequestMetricsMiddleware`` (core.middleware) opens a ``RequestCollector``
+for every request. While it is active:
+
+* every SQL statement on every database alias passes through
+  ``RequestCollector.execute``, which times it and records its fingerprint.
+  The collector lives in a context variable and ``instrument`` installs a
+  permanent ``execute_wrapper`` that forwards to it, on each connection as
+  it is opened. That also catches the queries that async views run on
+  ``sync_to_async`` threads, whose connections are thread-local
+* templates rendered through ``TimedDjangoTemplates`` add their render time
+
+When the response is ready the sample is added to the in-process
+``recorder`` under the URL name of the view (``home_feed``, ``profile``...),
+and ``recorder.snapshot()`` turns the recent samples into percentiles for
+the ``/metrics/`` endpoint. Each worker process keeps its own window.
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+PERCENTILES = (50, 90, 95, 99)
+
+_current = ContextVar('request_metrics', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """SQL with literals and IN lists collapsed, so N+1 repeats look alike"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql.replace('%s', '?'))
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[rank]
+
+
+class RequestCollector:
+    """Costs accumulated while handling one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.fingerprints = Counter()
+        self.statements = Counter()
+        self._template_depth = 0
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def duplicates(self, threshold=None):
+        """Fingerprints run at least ``threshold`` times (likely N+1 loops)"""
+        threshold = threshold or settings.REQUEST_METRICS_DUPLICATE_THRESHOLD
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+    @property
+    def repeated_statements(self):
+        """Identical statements (same SQL and parameters) run more than once"""
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def _execute(execute, sql, params, many, context):
+    collector = _current.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    return collector.execute(execute, sql, params, many, context)
+
+
+def instrument(connection, **kwargs):
+    """Report the queries run on ``connection`` to the active collector (also a ``connection_created`` receiver)"""
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        collector = _current.get()
+        if collector is None:
+            return super().render(context, request)
+        collector._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            collector._template_depth -= 1
+            # Count nested renders once, as part of the outermost one
+            if not collector._template_depth:
+                collector.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend that reports render time to the active collector"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class Recorder:
+    """Sliding window of recent request samples, grouped by URL name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(self._window)
+        self._requests = Counter()
+        self._n_plus_one = defaultdict(Counter)
+
+    @staticmethod
+    def _window():
+        return deque(maxlen=settings.REQUEST_METRICS_WINDOW)
+
+    def add(self, route, collector, total):
+        duplicates = collector.duplicates()
+        with self._lock:
+            self._samples[route].append(
+                (total, collector.db_time, collector.template_time, collector.queries, len(duplicates))
+            )
+            self._requests[route] += 1
+            for sql, _ in duplicates:
+                self._n_plus_one[route][sql] += 1
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._requests.clear()
+            self._n_plus_one.clear()
+
+    def snapshot(self):
+        with self._lock:
+            samples = {route: list(window) for route, window in self._samples.items()}
+            requests = dict(self._requests)
+            n_plus_one = {route: counter.most_common(5) for route, counter in self._n_plus_one.items()}
+
+        routes = {}
+        for route, rows in sorted(samples.items()):
+            columns = list(zip(*rows))
+            routes[route] = {
+                'requests': requests[route],
+                'window': len(rows),
+                'latency_ms': _summary(columns[0], scale=1000),
+                'db_ms': _summary(columns[1], scale=1000),
+                'template_ms': _summary(columns[2], scale=1000),
+                'queries': _summary(columns[3]),
+                'requests_with_duplicates': sum(1 for count in columns[4] if count),
+                'n_plus_one': [{'sql': sql, 'requests': count} for sql, count in n_plus_one.get(route, [])],
+            }
+        return routes
+
+
+def _summary(values, scale=1):
+    values = sorted(value * scale for value in values)
+    summary = {f'p{pct}': round(percentile(values, pct), 2) for pct in PERCENTILES}
+    summary['max'] = round(values[-1], 2)
+    return summary
+
+
+recorder = Recorder()
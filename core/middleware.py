@@ -0,0 +1,69 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .metrics import RequestCollector, instrument, recorder
+
+logger = logging.getLogger('core.metrics')
+
+
+class RequestMetricsMiddleware:
+    """
+    Record query count, DB time, template time and latency of every request.
+
+    Enabled with REQUEST_METRICS_ENABLED; see core.metrics for the details.
+    Runs in the mode of the handler, so async views are not moved onto a
+    thread just because metrics are on.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(instrument, dispatch_uid='core.metrics.instrument')
+        # Connections that were already open
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with RequestCollector() as collector:
+            response = self.get_response(request)
+        return self.record(request, response, collector)
+
+    async def __acall__(self, request):
+        # The collector is a context variable, so the ORM and template work
+        # that async views hand to sync_to_async threads still reports to it
+        with RequestCollector() as collector:
+            response = await self.get_response(request)
+        return self.record(request, response, collector)
+
+    def record(self, request, response, collector):
+        total = collector.elapsed
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name if match else None) or 'unresolved'
+        recorder.add(route, collector, total)
+        response['Server-Timing'] = collector.server_timing(total)
+
+        slow_ms = settings.REQUEST_METRICS_SLOW_MS
+        if slow_ms and total * 1000 >= slow_ms:
+            self.log_slow_request(request, route, collector, total)
+        return response
+
+    def log_slow_request(self, request, route, collector, total):
+        top = '\n'.join(
+            f'  {count}x {sql[:300]}' for sql, count in collector.fingerprints.most_common(5)
+        )
+        logger.warning(
+            'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, %d repeated statements\n%s',
+            request.method, request.path, route, total * 1000, collector.queries,
+            collector.db_time * 1000, collector.repeated_statements, top,
+        )
@@ -0,0 +1,89 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 20
+
+
+def encode_cursor(value, pk):
+    """Encode a (timestamp, id) keyset position as an opaque URL-safe token"""
+    raw = f'{value.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token, returning (timestamp, id) or None if it is malformed"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        value, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(value), int(pk)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset"""
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def _keyset_queryset(queryset, cursor, field, page_size, descending, tiebreaker):
+    position = decode_cursor(cursor)
+    if position is not None:
+        value, pk = position
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'{tiebreaker}__{op}': pk})
+        )
+    prefix = '-' if descending else ''
+    return queryset.order_by(f'{prefix}{field}', f'{prefix}{tiebreaker}')[:page_size + 1]
+
+
+def _page(rows, page_size, field, tiebreaker):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), getattr(last, tiebreaker))
+    return KeysetPage(rows, next_cursor)
+
+
+def keyset_slice(queryset, cursor=None, field='timestamp', page_size=DEFAULT_PAGE_SIZE, descending=True, tiebreaker='id'):
+    """Return up to ``page_size + 1`` rows of ``queryset`` after ``cursor``, ordered by ``(field, tiebreaker)``"""
+    return list(_keyset_queryset(queryset, cursor, field, page_size, descending, tiebreaker))
+
+
+def paginate_keyset(queryset, cursor=None, field='timestamp', page_size=DEFAULT_PAGE_SIZE, descending=True, tiebreaker='id'):
+    """
+    Return a KeysetPage of ``queryset`` ordered by ``(field, tiebreaker)``.
+
+    Only ``page_size + 1`` rows are fetched, so the cost of a page does not
+    depend on how deep into the listing the cursor points.
+    """
+    rows = keyset_slice(queryset, cursor, field, page_size, descending, tiebreaker)
+    return _page(rows, page_size, field, tiebreaker)
+
+
+async def apaginate_keyset(queryset, cursor=None, field='timestamp', page_size=DEFAULT_PAGE_SIZE, descending=True, tiebreaker='id'):
+    """Async ``paginate_keyset``"""
+    rows = [row async for row in _keyset_queryset(queryset, cursor, field, page_size, descending, tiebreaker)]
+    return _page(rows, page_size, field, tiebreaker)
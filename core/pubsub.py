@@ -0,0 +1,148 @@
+"""
+Publish/subscribe for live updates.
+
+Publishers call ``get_broker().publish(channel, message)`` from ordinary
+(synchronous) code. Async consumers subscribe to a list of channels and
+read ``(channel, message)`` pairs::
+
+    async with get_broker().subscribe(['post:1', 'post:2']) as subscription:
+        item = await subscription.get(timeout=15)  # None on timeout
+
+Messages are JSON-serializable dicts. The broker is chosen by
+PUBSUB_BACKEND:
+
+* ``core.pubsub.InProcessBroker`` (default): subscribers in the same process
+  only. Enough for a single ASGI worker and for tests.
+* ``core.pubsub.RedisBroker``: Redis pub/sub (or any server that speaks it)
+  at PUBSUB_URL, so every worker process sees every message. Needs the
+  ``redis`` package.
+
+Delivery is best effort. A subscriber that falls PUBSUB_QUEUE_SIZE messages
+behind loses the oldest ones, so publishers should send current state
+rather than increments.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker configured by PUBSUB_BACKEND"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.PUBSUB_BACKEND)()
+    return _broker
+
+
+class Subscription:
+    """Bounded queue of messages for one in-process subscriber"""
+
+    def __init__(self, loop, size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=size)
+
+    def deliver(self, channel, message):
+        # Publishers may run in any thread; the queue belongs to the subscriber's loop
+        self.loop.call_soon_threadsafe(self._put, (channel, message))
+
+    def _put(self, item):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(item)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """Delivers messages to subscribers in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(channel, message)
+
+    def subscribed(self, channels):
+        """The given channels that currently have subscribers"""
+        with self._lock:
+            return {channel for channel in channels if self._subscribers.get(channel)}
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        subscription = Subscription(asyncio.get_running_loop(), settings.PUBSUB_QUEUE_SIZE)
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(subscription)
+                    if not self._subscribers[channel]:
+                        del self._subscribers[channel]
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def get(self, timeout=None):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None:
+            return None
+        return message['channel'].decode(), json.loads(message['data'])
+
+
+class RedisBroker:
+    """Delivers messages through Redis pub/sub, across processes"""
+
+    def __init__(self, url=None):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker needs the redis package (pip install redis)')
+        self.url = url or settings.PUBSUB_URL
+        self._client = redis.Redis.from_url(self.url)
+
+    def publish(self, channel, message):
+        self._client.publish(channel, json.dumps(message))
+
+    def subscribed(self, channels):
+        channels = list(channels)
+        if not channels:
+            return set()
+        return {channel.decode() for channel, count in self._client.pubsub_numsub(*channels) if count}
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        if channels:
+            await pubsub.subscribe(*channels)
+        try:
+            yield RedisSubscription(pubsub)
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
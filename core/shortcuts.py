@@ -0,0 +1,13 @@
+from asgiref.sync import sync_to_async
+from django.shortcuts import render
+
+# Templates may touch lazy objects that load from the database, so async
+# views render them in a thread
+arender = sync_to_async(render)
+
+
+async def auser(request):
+    """``request.auser()``, also stored as ``request.user`` so templates don't load the user again"""
+    user = await request.auser()
+    request.user = user
+    return user
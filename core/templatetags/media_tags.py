@@ -0,0 +1,29 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_img(field_file, renditions, sizes='100vw', alt='', css_class=''):
+    """
+    Render an ``<img>`` with a ``srcset`` of the processed renditions.
+
+    Until the image pipeline has run, the original upload is served as-is.
+    """
+    if not field_file:
+        return ''
+    storage = field_file.storage
+    renditions = sorted((renditions or {}).values(), key=lambda rendition: rendition['width'])
+    if not renditions:
+        return format_html('<img src="{}" class="{}" alt="{}" loading="lazy">', field_file.url, css_class, alt)
+    srcset = format_html_join(
+        ', ', '{} {}w', ((storage.url(rendition['name']), rendition['width']) for rendition in renditions)
+    )
+    # The dimensions are those of ``src`` (the largest); CSS such as
+    # img-fluid scales it down, keeping the aspect ratio all renditions share
+    largest = renditions[-1]
+    return format_html(
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" alt="{}" loading="lazy">',
+        storage.url(largest['name']), srcset, sizes, largest['width'], largest['height'], css_class, alt,
+    )
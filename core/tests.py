@@ -1,3 +1,270 @@
-from django.test import TestCase
+import asyncio
+import io
+import re
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.template import Context, Template
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from posts import visibility
+from posts.models import Comment, Like, Post, Report, TimelineEntry
+from users.models import Follow, OutboundEmail, Settings as UserSettings
+from . import images
+from .metrics import RequestCollector, fingerprint, instrument, recorder
+from .middleware import RequestMetricsMiddleware
+from .pubsub import InProcessBroker
+from .benchmarks import SCENARIOS, run_benchmarks, run_session_profiles
 
 # Create your tests here.
+
+class QueryBudgetTests(TestCase):
+    """Every benchmarked view stays within its query budget on seeded data"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_data', users=40, posts=400, likes=1500, comments=300, follows=400, stdout=StringIO(),
+        )
+
+    def test_views_stay_within_query_budgets(self):
+        results = run_benchmarks(iterations=2)
+        self.assertEqual(set(results), {scenario.name for scenario in SCENARIOS})
+        for name, result in results.items():
+            with self.subTest(name):
+                self.assertEqual(result['status'], 200)
+                self.assertLessEqual(result['queries'], result['budget'])
+
+    def test_only_the_db_session_profile_queries_sessions(self):
+        results = run_session_profiles(iterations=2)
+        for profile, profile_results in results.items():
+            for name, result in profile_results.items():
+                with self.subTest(profile=profile, scenario=name):
+                    self.assertEqual(result['status'], 200)
+                    self.assertEqual(result['session_queries'], 1 if profile == 'db' else 0)
+                    if profile != 'db':
+                        self.assertLess(result['queries'], results['db'][name]['queries'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+class QueryPlanTests(TestCase):
+    """The hot queries of the views are served by indexes, without full scans or sorts"""
+
+    FULL_SCAN = re.compile(r'^SCAN (\S+)$')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset):
+        plan = self.plan(queryset)
+        for step in plan:
+            self.assertIsNone(self.FULL_SCAN.match(step), plan)
+            self.assertNotIn('TEMP B-TREE', step, plan)
+
+    def test_hot_queries_use_indexes(self):
+        viewer = User.objects.create(username='viewer')
+        now = timezone.now()
+        recent = ('-timestamp', '-id')
+        queries = {
+            'home_feed': Post.objects.for_feed().visible_to(AnonymousUser()).order_by(*recent)[:21],
+            'home_feed_viewer': Post.objects.for_feed().visible_to(viewer).order_by(*recent)[:21],
+            'home_feed_deep_page': Post.objects.filter(
+                Q(timestamp__lt=now) | Q(timestamp=now, id__lt=100)
+            ).order_by(*recent)[:21],
+            'hot_feed': Post.objects.for_feed().visible_to(viewer).filter(ranking__rank__gt=20).order_by('ranking__rank')[:21],
+            'ranking_window': Post.objects.filter(timestamp__gte=now).values_list('id', 'like_count'),
+            'home_feed_category': Post.objects.filter(category_id=1).order_by(*recent)[:21],
+            'profile_posts': Post.objects.filter(user=viewer).order_by(*recent)[:21],
+            'root_comments': (
+                Comment.objects.filter(post_id=1).roots().with_reply_counts().order_by('timestamp', 'id')[:51]
+            ),
+            'liked_post_ids': Like.objects.filter(user=viewer, post_id__in=[1, 2, 3]).values_list('post_id'),
+            'followers': Follow.objects.filter(following=viewer).order_by('-created_at')[:20],
+            'following': Follow.objects.filter(follower=viewer).order_by('-created_at')[:20],
+            'followers_page': visibility.visible_users(
+                Follow.objects.filter(following=viewer).select_related('follower__profile'), viewer, field='follower',
+            ).order_by('-created_at', '-id')[:21],
+            'timeline': TimelineEntry.objects.filter(owner=viewer).order_by('-timestamp', '-post_id')[:21],
+            'open_reports': Report.objects.filter(is_resolved=False).order_by('-timestamp')[:50],
+            'due_emails': (
+                OutboundEmail.objects.filter(status='pending', send_after__lte=now).order_by('send_after', 'id')[:500]
+            ),
+        }
+        thread = Comment(id=1, post_id=1, path='0000000001/')
+        queries['comment_thread'] = Comment.objects.subtree(thread)
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                self.assertIndexed(queryset)
+
+
+def jpeg_upload(width, height, orientation=None):
+    image = Image.new('RGB', (width, height), 'red')
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(IMAGE_PIPELINE_MODE='sync')
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.author = User.objects.create(username='author')
+
+    def test_scheduled_upload_is_reencoded_with_renditions(self):
+        post = Post.objects.create(user=self.author, text='Photo', image=jpeg_upload(1600, 800))
+        received = []
+
+        def processed(sender, pk, **kwargs):
+            received.append(pk)
+
+        images.image_processed.connect(processed)
+        self.addCleanup(images.image_processed.disconnect, processed)
+        with self.captureOnCommitCallbacks(execute=True):
+            images.schedule(post, 'image', 'image_renditions', 'post')
+        post.refresh_from_db()
+        _, extension = images.output_format()
+        self.assertTrue(post.image.name.endswith(f'.{extension}'))
+        self.assertEqual(received, [post.pk])
+        self.assertEqual(
+            {name: (rendition['width'], rendition['height']) for name, rendition in post.image_renditions.items()},
+            {'thumb': (320, 160), 'card': (640, 320), 'detail': (1280, 640)},
+        )
+        for rendition in post.image_renditions.values():
+            self.assertTrue(post.image.storage.exists(rendition['name']))
+
+    def test_exif_orientation_is_applied_and_avatars_are_cropped(self):
+        post = Post.objects.create(user=self.author, text='Sideways', image=jpeg_upload(200, 100, orientation=6))
+        new_name, renditions = images.process_image(post.image, 'avatar')
+        with post.image.storage.open(new_name) as stored:
+            self.assertEqual(Image.open(stored).size, (100, 200))
+        self.assertEqual((renditions['md']['width'], renditions['md']['height']), (96, 96))
+
+    def test_upload_replaced_during_processing_keeps_the_newer_file(self):
+        post = Post.objects.create(user=self.author, text='Photo', image=jpeg_upload(400, 400))
+        process_image = images.process_image
+
+        def replaced_meanwhile(field_file, kind):
+            Post.objects.filter(pk=post.pk).update(image='posts/newer.jpg')
+            return process_image(field_file, kind)
+
+        with mock.patch.object(images, 'process_image', replaced_meanwhile):
+            images.process_instance('posts.Post', post.pk, 'image', 'image_renditions', 'post')
+        post.refresh_from_db()
+        self.assertEqual((post.image.name, post.image_renditions), ('posts/newer.jpg', {}))
+        self.assertEqual(post.image.storage.listdir('posts/renditions')[1], [])
+
+    def test_responsive_img_uses_the_largest_rendition_for_src_and_size(self):
+        post = Post.objects.create(user=self.author, text='Photo', image=jpeg_upload(1600, 800))
+        template = Template('{% load media_tags %}{% responsive_img post.image post.image_renditions css_class="img-fluid" %}')
+        self.assertIn(f'src="{post.image.url}"', template.render(Context({'post': post})))
+
+        images.process_instance('posts.Post', post.pk, 'image', 'image_renditions', 'post')
+        post.refresh_from_db()
+        html = template.render(Context({'post': post}))
+        detail = post.image.storage.url(post.image_renditions['detail']['name'])
+        self.assertIn(f'src="{detail}"', html)
+        self.assertIn('width="1280" height="640"', html)
+        self.assertEqual(html.count('w, ') + 1, 3)
+
+
+@override_settings(
+    REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_SLOW_MS=0,
+    MIDDLEWARE=['core.middleware.RequestMetricsMiddleware', *settings.MIDDLEWARE],
+)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        recorder.reset()
+        self.addCleanup(recorder.reset)
+        # The test connection was opened before metrics were enabled; the
+        # ones views open from now on are instrumented on connection_created
+        instrument(connection)
+        self.user = User.objects.create(username='viewer')
+        UserSettings.objects.create(user=self.user)
+
+    def test_middleware_follows_the_mode_of_the_handler(self):
+        async def async_view(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(RequestMetricsMiddleware(lambda request: HttpResponse())))
+
+    def test_server_timing_is_set_for_sync_and_async_views(self):
+        self.client.force_login(self.user)
+        sync_response = self.client.get(reverse('settings'))
+        self.assertRegex(sync_response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=')
+
+    async def test_async_views_report_their_queries(self):
+        response = await self.async_client.get(reverse('home_feed'))
+        self.assertEqual(response.status_code, 200)
+        queries = int(re.search(r'"(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertGreater(queries, 0)
+        self.assertEqual(recorder.snapshot()['home_feed']['queries']['max'], queries)
+
+    def test_repeated_statements_are_reported_as_duplicates(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x''y' AND n = 4"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? AND n = ?',
+        )
+        with RequestCollector() as collector:
+            for user_id in range(4):
+                list(User.objects.filter(id=user_id))
+            list(User.objects.filter(id=0))
+        self.assertEqual(collector.queries, 5)
+        self.assertEqual(len(collector.duplicates(threshold=3)), 1)
+        self.assertEqual(collector.duplicates(threshold=3)[0][1], 5)
+        self.assertEqual(collector.repeated_statements, 1)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('request_metrics')).status_code, 302)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.force_login(User.objects.get(pk=self.user.pk))
+        self.client.get(reverse('home_feed'))
+        data = self.client.get(reverse('request_metrics')).json()
+        self.assertEqual(data['routes']['home_feed']['requests'], 1)
+        with override_settings(REQUEST_METRICS_ENABLED=False):
+            self.assertEqual(self.client.get(reverse('request_metrics')).status_code, 404)
+
+
+class InProcessBrokerTests(TestCase):
+    async def test_subscribers_get_the_messages_of_their_channels(self):
+        broker = InProcessBroker()
+        async with broker.subscribe(['post:1']) as subscription:
+            self.assertEqual(broker.subscribed(['post:1', 'post:2']), {'post:1'})
+            # Publishers run in other threads
+            await asyncio.to_thread(broker.publish, 'post:2', {'n': 0})
+            await asyncio.to_thread(broker.publish, 'post:1', {'n': 1})
+            self.assertEqual(await subscription.get(timeout=1), ('post:1', {'n': 1}))
+            self.assertIsNone(await subscription.get(timeout=0.01))
+        self.assertEqual(broker.subscribed(['post:1']), set())
+
+    @override_settings(PUBSUB_QUEUE_SIZE=2)
+    async def test_slow_subscribers_lose_the_oldest_messages(self):
+        broker = InProcessBroker()
+        async with broker.subscribe(['post:1']) as subscription:
+            for n in range(3):
+                broker.publish('post:1', {'n': n})
+            await asyncio.sleep(0)
+            received = [await subscription.get(timeout=1), await subscription.get(timeout=1)]
+            self.assertEqual([message['n'] for _, message in received], [1, 2])
+            self.assertIsNone(await subscription.get(timeout=0.01))
@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('metrics/', views.request_metrics, name='request_metrics'),
 ]
\ No newline at end of file
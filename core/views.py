@@ -1,5 +1,10 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect
 
+from .metrics import PERCENTILES, recorder
+
 # Create your views here.
 
 def home(request):
@@ -10,3 +15,10 @@ def custom_404(request, exception):
 
 def custom_error(request):
     return render(request, 'error.html', status=500)
+
+# Request metrics (percentiles per URL name, see core.metrics)
+@staff_member_required
+def request_metrics(request):
+    if not settings.REQUEST_METRICS_ENABLED:
+        raise Http404('Request metrics are disabled')
+    return JsonResponse({'percentiles': list(PERCENTILES), 'routes': recorder.snapshot()})
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Post, Comment, Like, Category, Tag, Report, Block
+from .models import Post, Comment, Like, Category, Tag, Report, Block, ModerationCase
+from . import moderation
 
 # Register your models here.
 
@@ -8,5 +9,74 @@ admin.site.register(Comment)
 admin.site.register(Like)
 admin.site.register(Category)
 admin.site.register(Tag)
-admin.site.register(Report)
 admin.site.register(Block)
+
+
+class CaseStatusFilter(admin.SimpleListFilter):
+    """Open cases unless asked otherwise, so the queue stays on its partial index"""
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [('resolved', 'Resolved'), ('all', 'All')]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'Open',
+        }
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        if self.value() == 'all':
+            return queryset
+        return queryset.filter(is_resolved=self.value() == 'resolved')
+
+
+@admin.register(ModerationCase)
+class ModerationCaseAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'reported_user', 'open_reports', 'total_reports', 'last_reported_at', 'post_hidden')
+    list_filter = (CaseStatusFilter,)
+    list_select_related = ('reported_user', 'post')
+    ordering = ('-open_reports', '-last_reported_at')
+    raw_id_fields = ('reported_user', 'post', 'resolved_by')
+    readonly_fields = ('open_reports', 'total_reports', 'first_reported_at', 'last_reported_at', 'resolved_at')
+    # Counting the whole table is what makes large changelists slow
+    show_full_result_count = False
+    actions = ['hide_and_resolve', 'dismiss', 'resolve']
+
+    @admin.display(boolean=True, description='Hidden')
+    def post_hidden(self, case):
+        return case.post.is_hidden if case.post_id else None
+
+    @admin.action(description='Hide posts and resolve')
+    def hide_and_resolve(self, request, queryset):
+        self._resolve(request, queryset, hide=True)
+
+    @admin.action(description='Dismiss (show posts again) and resolve')
+    def dismiss(self, request, queryset):
+        self._resolve(request, queryset, hide=False)
+
+    @admin.action(description='Resolve')
+    def resolve(self, request, queryset):
+        self._resolve(request, queryset, hide=None)
+
+    def _resolve(self, request, queryset, hide):
+        count = moderation.resolve(queryset, moderator=request.user, hide=hide)
+        self.message_user(request, f'{count} case(s) resolved.')
+
+
+@admin.register(Report)
+class ReportAdmin(admin.ModelAdmin):
+    list_display = ('reporter', 'reported_user', 'post_id', 'reason', 'timestamp', 'is_resolved')
+    list_filter = ('is_resolved', 'reason')
+    list_select_related = ('reporter', 'reported_user')
+    raw_id_fields = ('reporter', 'reported_user', 'post', 'case')
+    ordering = ('-timestamp',)
+    show_full_result_count = False
@@ -0,0 +1,146 @@
+"""
+Cached rendering of post cards (posts/_post_card.html).
+
+Each card is cached under ``postcard:<post id>`` together with the version
+tokens, at render time, of the users it shows: its author, and for a share
+the original post's author. A whole page of cards and author tokens is read
+with a single ``get_many``. A card is served only if its stored tokens
+still match the current ones, so renaming a user or changing their avatar
+invalidates all their cards, and the shares of their posts, without
+touching them.
+Post-level changes (likes, comments, edits, tags) delete the card directly
+from the receivers in ``posts.signals``.
+
+Cards are rendered without a request and must not contain anything
+viewer-specific; the viewer's like state is applied client-side.
+
+Hit and miss counts are kept in the card cache too, so ``manage.py
+card_cache_stats`` only sees the site's traffic when that cache is shared
+between processes (Redis, Memcached). With the default per-process
+LocMemCache, a separate command process always reads zeros.
+"""
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Like
+
+HITS_KEY = 'postcard:stats:hits'
+MISSES_KEY = 'postcard:stats:misses'
+
+
+def card_cache():
+    return caches[settings.POST_CARD_CACHE]
+
+
+def card_key(post_id):
+    return f'postcard:{post_id}'
+
+
+def author_key(user_id):
+    return f'postcard:author:{user_id}'
+
+
+def _shown_user_ids(post):
+    """Users whose name or avatar the card of ``post`` shows"""
+    if post.shared_from_id:
+        return (post.user_id, post.shared_from.user_id)
+    return (post.user_id,)
+
+
+def attach_cards(posts):
+    """Set ``post.card_html`` on every post, rendering only the cache misses"""
+    posts = list(posts)
+    if not posts:
+        return posts
+    cache = card_cache()
+    author_ids = {user_id for post in posts for user_id in _shown_user_ids(post)}
+    cached = cache.get_many(
+        [card_key(post.id) for post in posts] + [author_key(user_id) for user_id in author_ids]
+    )
+
+    new_versions = {}
+    for user_id in author_ids:
+        if author_key(user_id) not in cached:
+            new_versions[author_key(user_id)] = uuid.uuid4().hex
+    versions = {**cached, **new_versions}
+
+    misses = {}
+    for post in posts:
+        version = tuple(versions[author_key(user_id)] for user_id in _shown_user_ids(post))
+        entry = cached.get(card_key(post.id))
+        if entry is not None and entry[0] == version:
+            post.card_html = mark_safe(entry[1])
+        else:
+            html = render_to_string('posts/_post_card.html', {'post': post})
+            post.card_html = mark_safe(html)
+            misses[card_key(post.id)] = (version, html)
+
+    if new_versions:
+        cache.set_many(new_versions, timeout=None)
+    if misses:
+        cache.set_many(misses, timeout=settings.POST_CARD_CACHE_TIMEOUT)
+    _count(cache, HITS_KEY, len(posts) - len(misses))
+    _count(cache, MISSES_KEY, len(misses))
+    return posts
+
+
+# Template rendering is synchronous
+aattach_cards = sync_to_async(attach_cards)
+
+
+def _count(cache, key, amount):
+    if amount:
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, amount, timeout=None)
+
+
+def _liked(user, posts):
+    return Like.objects.filter(user=user, post_id__in=[post.id for post in posts]).values_list('post_id', flat=True)
+
+
+def liked_post_ids(user, posts):
+    """Ids of the given posts that ``user`` has liked, in one query"""
+    if not user.is_authenticated:
+        return []
+    return list(_liked(user, posts))
+
+
+async def aliked_post_ids(user, posts):
+    if not user.is_authenticated:
+        return []
+    return [post_id async for post_id in _liked(user, posts)]
+
+
+def invalidate_posts(post_ids):
+    post_ids = list(post_ids)
+    if post_ids:
+        card_cache().delete_many([card_key(post_id) for post_id in post_ids])
+
+
+def invalidate_author(user_id):
+    """Invalidate every card by ``user_id`` by rotating their version token"""
+    card_cache().set(author_key(user_id), uuid.uuid4().hex, timeout=None)
+
+
+def stats_are_shared():
+    """Whether the card cache, and so its hit and miss counts, is shared between processes"""
+    return not isinstance(card_cache(), LocMemCache)
+
+
+def stats():
+    values = card_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = values.get(HITS_KEY, 0), values.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else None}
+
+
+def reset_stats():
+    card_cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -1,12 +1,13 @@
 from django import forms
-from .models import Post, Comment, Category, Tag
+from .models import Post, Comment
 
 class PostForm(forms.ModelForm):
     tags = forms.CharField(max_length=200, required=False, help_text='Enter tags separated by commas')
     
     class Meta:
         model = Post
-        fields = ['text', 'image', 'category', 'tags']
+        # ``tags`` is a plain text field resolved by the view, not the M2M
+        fields = ['text', 'image', 'category']
     
     def clean_tags(self):
         tags = self.cleaned_data.get('tags', '')
@@ -0,0 +1,72 @@
+"""
+Live updates for the posts on screen, streamed as Server-Sent Events.
+
+The receivers in ``posts.signals`` publish to ``core.pubsub`` after commit:
+
+* ``post:<id>``: the current like/comment/share counts of a post. Counts
+  are only read from the database when someone is subscribed to the post.
+* ``posts:new``: the id and author of every new post
+
+``event_stream`` subscribes one viewer to the posts they are looking at
+(and optionally to new posts) and turns the messages into SSE events.
+Each event carries absolute counts, so a dropped or repeated message
+cannot leave a counter wrong. New posts are only announced to viewers who
+may see them. Streams are long-lived, so serve them from the ASGI app.
+"""
+import asyncio
+import json
+
+from django.conf import settings
+
+from core.pubsub import get_broker
+from . import visibility
+from .models import Post
+
+NEW_POSTS_CHANNEL = 'posts:new'
+COUNT_FIELDS = ('like_count', 'comment_count', 'share_count')
+
+
+def post_channel(post_id):
+    return f'post:{post_id}'
+
+
+def publish_counts(post_ids):
+    """Publish the counts of the given posts that anyone is watching"""
+    broker = get_broker()
+    watched = broker.subscribed(post_channel(post_id) for post_id in set(post_ids))
+    if not watched:
+        return
+    watched_ids = [int(channel.split(':', 1)[1]) for channel in watched]
+    for post_id, *counts in Post.objects.filter(id__in=watched_ids).values_list('id', *COUNT_FIELDS):
+        broker.publish(post_channel(post_id), {'post_id': post_id, **dict(zip(COUNT_FIELDS, counts))})
+
+
+def publish_new_post(post_id, user_id):
+    get_broker().publish(NEW_POSTS_CHANNEL, {'post_id': post_id, 'user_id': user_id})
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def event_stream(viewer, post_ids, new_posts=False):
+    """Async iterator of SSE messages for ``viewer``, ending after LIVE_UPDATES_MAX_SECONDS"""
+    channels = [post_channel(post_id) for post_id in post_ids]
+    if new_posts:
+        channels.append(NEW_POSTS_CHANNEL)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.LIVE_UPDATES_MAX_SECONDS
+    async with get_broker().subscribe(channels) as subscription:
+        # Browsers reconnect on their own when the stream ends
+        yield f'retry: {settings.LIVE_UPDATES_RETRY_MS}\n\n'
+        while loop.time() < deadline:
+            item = await subscription.get(timeout=settings.LIVE_UPDATES_KEEPALIVE_SECONDS)
+            if item is None:
+                # Keeps proxies from timing the connection out
+                yield ': keepalive\n\n'
+                continue
+            channel, message = item
+            if channel != NEW_POSTS_CHANNEL:
+                yield sse('counts', message)
+            elif message['user_id'] != viewer.id and await visibility.acan_view_posts(viewer, message['user_id']):
+                yield sse('new_post', message)
@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts.timeline import rebuild_timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Rebuild materialized following timelines from the existing Follow graph"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild the timeline of this username')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users loaded per batch')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f"User '{options['user']}' does not exist")
+
+        rebuilt = 0
+        last_id = 0
+        while True:
+            batch = list(users.filter(id__gt=last_id).values_list('id', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            for user_id in batch:
+                with transaction.atomic():
+                    rebuild_timeline(user_id)
+                rebuilt += 1
+            last_id = batch[-1]
+            self.stdout.write(f'Rebuilt {rebuilt} timelines...')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} timelines.'))
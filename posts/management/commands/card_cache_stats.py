@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import cards
+
+
+class Command(BaseCommand):
+    help = (
+        "Report hit and miss counts of the rendered post card cache (needs a cache shared between processes, "
+        "not the default LocMemCache)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after reporting')
+
+    def handle(self, *args, **options):
+        if not cards.stats_are_shared():
+            self.stderr.write(self.style.WARNING(
+                'The post card cache is a per-process LocMemCache, so this process cannot see the counts '
+                'of the web workers. Set CACHE_BACKEND to a shared cache such as Redis or Memcached.'
+            ))
+        stats = cards.stats()
+        hit_rate = 'n/a' if stats['hit_rate'] is None else f"{stats['hit_rate']:.1%}"
+        self.stdout.write(f"hits: {stats['hits']}  misses: {stats['misses']}  hit rate: {hit_rate}")
+        if options['reset']:
+            cards.reset_stats()
+            self.stdout.write('Counters reset.')
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.ranking import compute_rankings
+
+
+class Command(BaseCommand):
+    help = "Rescore recent posts and rewrite the hot feed and trending tags"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep recomputing instead of exiting')
+        parser.add_argument('--interval', type=float, default=300, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            posts, tags = compute_rankings()
+            self.stdout.write(f'Ranked {posts} posts and {tags} trending tags.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
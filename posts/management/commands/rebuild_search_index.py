@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Repopulate the full-text search index for posts and users"
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('The FTS5 search index is only available on SQLite; run migrate first.')
+        with transaction.atomic():
+            search.rebuild()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
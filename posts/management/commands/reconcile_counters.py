@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.db.models.functions import Now
+
+from posts.models import Comment, Like, ModerationCase, Post, Report, Tag, count_subquery, counters_changed
+from users import context
+from users.models import Follow, Profile
+
+# model: (outer key, {counter field: (counted model, relation to the outer key)})
+COUNTERS = {
+    Post: ('pk', {
+        'like_count': (Like, 'post'),
+        'comment_count': (Comment, 'post'),
+        'share_count': (Post, 'shared_from'),
+    }),
+    Tag: ('pk', {
+        'usage_count': (Post.tags.through, 'tag'),
+    }),
+    ModerationCase: ('pk', {
+        'total_reports': (Report, 'case'),
+    }),
+    Profile: ('user_id', {
+        'post_count': (Post, 'user'),
+        'follower_count': (Follow, 'following'),
+        'following_count': (Follow, 'follower'),
+    }),
+}
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized post, tag, moderation case and profile counters and fix any that have drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted rows')
+
+    def handle(self, *args, **options):
+        for target, (outer, counters) in COUNTERS.items():
+            label = target._meta.verbose_name_plural
+            fixed_keys = set()
+            for field, (model, relation) in counters.items():
+                actual = count_subquery(model, relation, outer)
+                drifted = target.objects.annotate(actual=actual).exclude(**{field: F('actual')})
+                if options['dry_run']:
+                    self.stdout.write(f'{field}: {drifted.count()} drifted {label}')
+                    continue
+                rows = list(drifted.values_list('pk', outer))
+                changes = {field: actual}
+                if target in (Post, Profile):
+                    # Their updated_at versions the API ETags
+                    changes['updated_at'] = Now()
+                fixed = target.objects.filter(pk__in=[pk for pk, _ in rows]).update(**changes)
+                fixed_keys.update(key for _, key in rows)
+                self.stdout.write(f'{field}: {fixed} drifted {label}')
+            if fixed_keys:
+                self.changed(target, sorted(fixed_keys))
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Counters reconciled.'))
+
+    def changed(self, target, keys):
+        """Drop the cached copies of fixed rows, as the counters' own updates do"""
+        if target is Post:
+            # Invalidates the post cards and publishes the corrected counts
+            counters_changed.send(sender=Post, post_ids=keys)
+        elif target is Profile:
+            context.invalidate(*keys)
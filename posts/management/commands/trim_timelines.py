@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.timeline import trim_timelines
+
+
+class Command(BaseCommand):
+    help = "Trim following timelines down to TIMELINE_MAX_ENTRIES"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep trimming instead of exiting')
+        parser.add_argument('--interval', type=float, default=300, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        # The first run checks every timeline, later ones only those posted to since the previous run
+        since = None
+        while True:
+            started = timezone.now()
+            trimmed = trim_timelines(since)
+            self.stdout.write(f'Trimmed {trimmed} timelines.')
+            if not options['loop']:
+                break
+            since = started
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('posts', 'Post')
+    Tag = apps.get_model('posts', 'Tag')
+    User = apps.get_model('auth', 'User')
+    post_table = Post._meta.db_table
+    through = Post.tags.through._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts "
+            "USING fts5(text, username, tags, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS posts_user_fts "
+            "USING fts5(username, tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+        )
+        cursor.execute(f'INSERT INTO posts_user_fts (rowid, username) SELECT id, username FROM {User._meta.db_table}')
+        cursor.execute(
+            'INSERT INTO posts_post_fts (rowid, text, username, tags) '
+            f"SELECT p.id, p.text, u.username, COALESCE((SELECT group_concat(t.name, ' ') FROM {through} pt "
+            f"JOIN {Tag._meta.db_table} t ON t.id = pt.tag_id WHERE pt.post_id = p.id), '') "
+            f'FROM {post_table} p JOIN {User._meta.db_table} u ON u.id = p.user_id'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS posts_post_fts')
+        cursor.execute('DROP TABLE IF EXISTS posts_user_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_timelineentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
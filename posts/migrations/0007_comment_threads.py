@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def populate_paths(apps, schema_editor):
+    # Every existing comment is top-level
+    Comment = apps.get_model('posts', 'Comment')
+    Comment.objects.update(path=Concat(
+        LPad(Cast('id', models.CharField()), 10, models.Value('0')), models.Value('/'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=89),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_thread'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'parent', 'timestamp', 'id'], name='comment_post_replies'),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
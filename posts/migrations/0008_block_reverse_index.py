@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_comment_threads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='block',
+            index=models.Index(fields=['blocked_user', 'blocker'], name='block_reverse'),
+        ),
+    ]
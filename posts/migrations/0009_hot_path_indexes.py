@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_block_reverse_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', 'post'], name='like_user_post'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-timestamp', '-id'], name='post_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='post_user_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['category', '-timestamp', '-id'], name='post_category_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['-timestamp'], name='report_open_recent'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.text import slugify
+
+
+def populate_tags(apps, schema_editor):
+    Tag = apps.get_model('posts', 'Tag')
+    Post = apps.get_model('posts', 'Post')
+    Through = Post.tags.through
+
+    taken = set()
+    for tag in Tag.objects.order_by('id'):
+        slug = slugify(tag.name, allow_unicode=True)[:30] or 'tag'
+        # Names that only differ in punctuation or case keep separate rows
+        if slug in taken:
+            slug = f'{slug}-{tag.id}'
+        taken.add(slug)
+        tag.slug = slug
+        tag.save(update_fields=['slug'])
+
+    usage = (
+        Through.objects.filter(tag=OuterRef('pk'))
+        .order_by().values('tag').annotate(total=Count('pk')).values('total')
+    )
+    Tag.objects.update(usage_count=Coalesce(Subquery(usage, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, max_length=40, unique=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_tag_slug_usage_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankedPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(unique=True)),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ranking', to='posts.post')),
+            ],
+            options={
+                'ordering': ['rank'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(unique=True)),
+                ('score', models.FloatField()),
+                ('recent_posts', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trending', to='posts.tag')),
+            ],
+            options={
+                'ordering': ['rank'],
+            },
+        ),
+    ]
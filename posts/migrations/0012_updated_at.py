@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 22:40
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def populate_updated_at(apps, schema_editor):
+    for name in ('Post', 'Comment'):
+        apps.get_model('posts', name).objects.update(updated_at=F('timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_rankings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_updated_at, migrations.RunPython.noop),
+    ]
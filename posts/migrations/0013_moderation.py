@@ -0,0 +1,84 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Q, Subquery
+
+
+def group_reports(apps, schema_editor):
+    """Open a case per reported post or user with the counts of the existing reports"""
+    Report = apps.get_model('posts', 'Report')
+    ModerationCase = apps.get_model('posts', 'ModerationCase')
+    counts = dict(
+        total=Count('id'), open=Count('id', filter=Q(is_resolved=False)),
+        first=Min('timestamp'), last=Max('timestamp'),
+    )
+    user_groups = Report.objects.filter(post__isnull=True).values('reported_user').annotate(**counts)
+    post_groups = Report.objects.filter(post__isnull=False).values('post').annotate(author=Min('reported_user'), **counts)
+    first_reported_at = ModerationCase._meta.get_field('first_reported_at')
+    first_reported_at.auto_now_add = False
+    ModerationCase.objects.bulk_create([
+        ModerationCase(
+            reported_user_id=group.get('author', group.get('reported_user')), post_id=group.get('post'),
+            open_reports=group['open'], total_reports=group['total'],
+            first_reported_at=group['first'], last_reported_at=group['last'], is_resolved=not group['open'],
+        )
+        for group in [*user_groups, *post_groups]
+    ], batch_size=1000)
+    Report.objects.filter(post__isnull=True).update(case=Subquery(
+        ModerationCase.objects.filter(post__isnull=True, reported_user=OuterRef('reported_user')).values('pk')[:1]
+    ))
+    Report.objects.filter(post__isnull=False).update(case=Subquery(
+        ModerationCase.objects.filter(post=OuterRef('post')).values('pk')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='is_hidden',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ModerationCase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('open_reports', models.PositiveIntegerField(default=0)),
+                ('total_reports', models.PositiveIntegerField(default=0)),
+                ('first_reported_at', models.DateTimeField(auto_now_add=True)),
+                ('last_reported_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('is_resolved', models.BooleanField(default=False)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='moderation_cases', to='posts.post')),
+                ('reported_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='moderation_cases', to=settings.AUTH_USER_MODEL)),
+                ('resolved_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='case',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reports', to='posts.moderationcase'),
+        ),
+        migrations.AddIndex(
+            model_name='moderationcase',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['-open_reports', '-last_reported_at'], name='case_open_queue'),
+        ),
+        migrations.AddConstraint(
+            model_name='moderationcase',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', True)), fields=('reported_user',), name='case_unique_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='moderationcase',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', False)), fields=('post',), name='case_unique_post'),
+        ),
+        migrations.RunPython(group_reports, migrations.RunPython.noop),
+    ]
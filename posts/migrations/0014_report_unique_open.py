@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:08
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def resolve_duplicate_reports(apps, schema_editor):
+    """Keep the first open report of each reporter per case and recount the cases"""
+    Report = apps.get_model('posts', 'Report')
+    ModerationCase = apps.get_model('posts', 'ModerationCase')
+    duplicates = (
+        Report.objects.filter(is_resolved=False, case__isnull=False)
+        .values('case', 'reporter').annotate(reports=Count('id'), first=Min('id')).filter(reports__gt=1)
+    )
+    case_ids = set()
+    for duplicate in duplicates:
+        Report.objects.filter(
+            case=duplicate['case'], reporter=duplicate['reporter'], is_resolved=False,
+        ).exclude(id=duplicate['first']).update(is_resolved=True)
+        case_ids.add(duplicate['case'])
+    for case_id in case_ids:
+        ModerationCase.objects.filter(pk=case_id).update(
+            open_reports=Report.objects.filter(case=case_id, is_resolved=False).count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_moderation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_duplicate_reports, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='report',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_resolved', False)), fields=('case', 'reporter'), name='report_unique_open'),
+        ),
+    ]
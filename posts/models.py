@@ -1,8 +1,20 @@
-from django.db import models
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce, Concat, Greatest, LPad, Now
 from django.contrib.auth.models import User
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.text import slugify
 
 # Create your models here.
 
+# Sent with ``post_ids`` when counters change through a bulk UPDATE, which
+# bypasses post_save
+counters_changed = Signal()
+
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True)
@@ -10,40 +22,282 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def normalize_tag(name):
+    """Lowercase a tag name and collapse its whitespace"""
+    return ' '.join(name.lower().split())[:30]
+
+def slugify_tag(name):
+    return slugify(normalize_tag(name), allow_unicode=True)
+
+class TagQuerySet(models.QuerySet):
+    def resolve(self, names):
+        """
+        Return the tags for ``names``, creating missing ones, in at most three
+        queries. Names are matched by slug, so "Django", "django " and
+        "DJANGO!" are one tag. Concurrent creators do not collide: the insert
+        ignores slugs that appeared in the meantime and the re-fetch picks
+        them up.
+        """
+        wanted = {}
+        for name in names:
+            slug = slugify_tag(name)
+            if slug and slug not in wanted:
+                wanted[slug] = normalize_tag(name)
+        if not wanted:
+            return []
+        tags = {tag.slug: tag for tag in self.filter(slug__in=wanted)}
+        missing = [slug for slug in wanted if slug not in tags]
+        if missing:
+            self.bulk_create([Tag(name=wanted[slug], slug=slug) for slug in missing], ignore_conflicts=True)
+            tags.update((tag.slug, tag) for tag in self.filter(slug__in=missing))
+        return [tags[slug] for slug in wanted if slug in tags]
+
+    def bump(self, tag_ids, delta):
+        """Atomically adjust ``usage_count`` of several tags"""
+        return self.filter(pk__in=tag_ids).update(usage_count=Greatest(F('usage_count') + delta, 0))
+
 class Tag(models.Model):
     name = models.CharField(max_length=30, unique=True)
+    slug = models.SlugField(max_length=40, unique=True, allow_unicode=True)
+    # Number of posts carrying the tag, kept by posts.signals and the
+    # create_post view, repaired by `manage.py reconcile_counters`
+    usage_count = models.PositiveIntegerField(default=0)
+
+    objects = TagQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = slugify_tag(self.name)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+def count_subquery(model, field='post', outer='pk'):
+    """Correlated COUNT over ``model`` rows whose ``field`` matches the outer row's ``outer``"""
+    counts = (
+        model.objects.filter(**{field: OuterRef(outer)})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Load everything a post card renders in a constant number of queries"""
+        return (
+            self.select_related('user__profile', 'category', 'shared_from__user')
+            .prefetch_related('tags')
+        )
+
+    def visible_to(self, viewer, excluded=None):
+        """Posts ``viewer`` may see, per moderation, blocks and author privacy (see posts.visibility)"""
+        from .visibility import block_filter, hidden_filter, privacy_filter
+        return (
+            self.filter(hidden_filter(viewer, 'user'))
+            .filter(privacy_filter(viewer, 'user'))
+            .filter(block_filter(viewer, 'user', excluded))
+        )
+
+    def bump(self, post_id, **deltas):
+        """Atomically adjust counter columns, e.g. ``bump(post.id, like_count=1)``"""
+        updated = self.filter(pk=post_id).update(
+            **{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()}, updated_at=Now(),
+        )
+        counters_changed.send(sender=Post, post_ids=[post_id])
+        return updated
+
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # Filled in by core.images once the upload has been processed
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     tags = models.ManyToManyField(Tag, blank=True)
     shared_from = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='shares')
     is_shared = models.BooleanField(default=False)
+    # Denormalized counters, kept in step by the like/comment/share views
+    # and repaired by `manage.py reconcile_counters`
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    share_count = models.PositiveIntegerField(default=0)
+    # Set by posts.moderation once enough reports come in, or by a moderator;
+    # hidden posts are only shown to their author
+    is_hidden = models.BooleanField(default=False)
+    # Changes with anything the post's JSON shows, counters included (the
+    # API's ETag and Last-Modified)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the home feed, a profile and a category
+            models.Index(fields=['-timestamp', '-id'], name='post_recent'),
+            models.Index(fields=['user', '-timestamp', '-id'], name='post_user_recent'),
+            models.Index(fields=['category', '-timestamp', '-id'], name='post_category_recent'),
+        ]
 
     def __str__(self):
         return f"Post by {self.user.username} at {self.timestamp}"
 
+# Replies nested deeper than this are attached to the deepest allowed ancestor
+MAX_COMMENT_DEPTH = 8
+# Width of one zero-padded id segment in Comment.path
+PATH_SEGMENT_WIDTH = 10
+
+def path_segment(comment_id):
+    return f'{comment_id:0{PATH_SEGMENT_WIDTH}d}/'
+
+class CommentQuerySet(models.QuerySet):
+    def roots(self):
+        return self.filter(parent__isnull=True)
+
+    def visible_to(self, viewer, excluded=None):
+        """Comments not written by users blocked in either direction"""
+        from .visibility import block_filter
+        return self.filter(block_filter(viewer, 'user', excluded))
+
+    def subtree(self, comment, include_self=False):
+        """
+        ``comment`` and its descendants, in thread (pre-)order.
+
+        Paths only contain digits and '/', so the subtree is the range
+        ``[path, path with its trailing '/' replaced by '0')`` on the
+        ``(post, path)`` index.
+        """
+        queryset = self.filter(
+            post_id=comment.post_id,
+            path__gte=comment.path,
+            path__lt=comment.path[:-1] + '0',
+        )
+        if not include_self:
+            queryset = queryset.exclude(pk=comment.pk)
+        return queryset.order_by('path')
+
+    def fill_root_paths(self):
+        """Set the path of top-level comments created without save(), e.g. by bulk_create"""
+        return self.filter(parent__isnull=True, path='').update(path=Concat(
+            LPad(Cast('id', models.CharField()), PATH_SEGMENT_WIDTH, models.Value('0')), models.Value('/'),
+        ))
+
+    def with_reply_counts(self):
+        return self.annotate(reply_count=count_subquery(Comment, 'parent'))
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Materialized path: the zero-padded ids of all ancestors and the comment
+    # itself, e.g. "0000000012/0000000045/"
+    path = models.CharField(max_length=(PATH_SEGMENT_WIDTH + 1) * MAX_COMMENT_DEPTH + 1, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_thread'),
+            models.Index(fields=['post', 'parent', 'timestamp', 'id'], name='comment_post_replies'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.parent_id and self._state.adding:
+            while self.parent.depth + 1 >= MAX_COMMENT_DEPTH:
+                self.parent = self.parent.parent
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if not self.path:
+            self.path = (self.parent.path if self.parent_id else '') + path_segment(self.id)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.post.id}"
 
+LikeResult = namedtuple('LikeResult', ['changed', 'liked', 'like_count', 'author_id'])
+
+class LikeManager(models.Manager):
+    """
+    Idempotent like/unlike in two statements and without fetching the post.
+
+    ``like()`` is an INSERT ... SELECT ... ON CONFLICT DO NOTHING, so a
+    concurrent double-click can never hit the unique constraint, and the
+    counter is only touched when a row was really inserted or deleted. Both
+    return None when the post does not exist. Raw cursors and atomic blocks
+    have no async API, so ``alike()``/``aunlike()`` run them in a thread.
+    """
+
+    def like(self, post_id, user_id):
+        post_table = Post._meta.db_table
+        with transaction.atomic(using=self._write_db), connections[self._write_db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} (post_id, user_id) '
+                f'SELECT id, %s FROM {post_table} WHERE id = %s ON CONFLICT DO NOTHING',
+                [user_id, post_id],
+            )
+            changed = cursor.rowcount == 1
+            row = self._counter(cursor, post_id, 'like_count + 1' if changed else None)
+        if changed:
+            counters_changed.send(sender=Like, post_ids=[post_id])
+        return row and LikeResult(changed, True, *row)
+
+    def unlike(self, post_id, user_id):
+        with transaction.atomic(using=self._write_db), connections[self._write_db].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.model._meta.db_table} WHERE post_id = %s AND user_id = %s',
+                [post_id, user_id],
+            )
+            changed = cursor.rowcount > 0
+            decrement = 'CASE WHEN like_count > 0 THEN like_count - 1 ELSE 0 END'
+            row = self._counter(cursor, post_id, decrement if changed else None)
+        if changed:
+            counters_changed.send(sender=Like, post_ids=[post_id])
+        return row and LikeResult(changed, False, *row)
+
+    async def alike(self, post_id, user_id):
+        return await sync_to_async(self.like)(post_id, user_id)
+
+    async def aunlike(self, post_id, user_id):
+        return await sync_to_async(self.unlike)(post_id, user_id)
+
+    @property
+    def _write_db(self):
+        return router.db_for_write(self.model)
+
+    def _counter(self, cursor, post_id, expression):
+        """Apply ``expression`` to the like counter and return (like_count, author_id)"""
+        post_table = Post._meta.db_table
+        if expression is None:
+            cursor.execute(f'SELECT like_count, user_id FROM {post_table} WHERE id = %s', [post_id])
+            return cursor.fetchone()
+        connection = connections[self._write_db]
+        update = f'UPDATE {post_table} SET like_count = {expression}, updated_at = %s WHERE id = %s'
+        params = [connection.ops.adapt_datetimefield_value(timezone.now()), post_id]
+        if connection.features.can_return_columns_from_insert:
+            cursor.execute(f'{update} RETURNING like_count, user_id', params)
+            return cursor.fetchone()
+        cursor.execute(update, params)
+        return self._counter(cursor, post_id, None)
+
 class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    objects = LikeManager()
+
     class Meta:
         unique_together = ('post', 'user')
+        indexes = [
+            # "Which of these posts did I like" lookups for a page of cards
+            models.Index(fields=['user', 'post'], name='like_user_post'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} likes Post {self.post.id}"
@@ -63,10 +317,61 @@ class Report(models.Model):
     description = models.TextField(blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     is_resolved = models.BooleanField(default=False)
+    case = models.ForeignKey(
+        'ModerationCase', on_delete=models.SET_NULL, null=True, blank=True, related_name='reports',
+    )
+
+    class Meta:
+        constraints = [
+            # One open report per reporter and case (posts.moderation.file_report)
+            models.UniqueConstraint(
+                fields=['case', 'reporter'], condition=models.Q(is_resolved=False), name='report_unique_open',
+            ),
+        ]
+        indexes = [
+            # The open-reports queue; resolved reports are never listed by age
+            models.Index(
+                fields=['-timestamp'], condition=models.Q(is_resolved=False), name='report_open_recent',
+            ),
+        ]
 
     def __str__(self):
         return f"Report by {self.reporter.username} on {self.reported_user.username}"
 
+class ModerationCase(models.Model):
+    """The reports against one post, or against a user as a whole, counted as they arrive (posts.moderation)"""
+    reported_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='moderation_cases')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='moderation_cases')
+    # Reports since the case was last resolved, and ever
+    open_reports = models.PositiveIntegerField(default=0)
+    total_reports = models.PositiveIntegerField(default=0)
+    first_reported_at = models.DateTimeField(auto_now_add=True)
+    last_reported_at = models.DateTimeField(default=timezone.now)
+    is_resolved = models.BooleanField(default=False)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['reported_user'], condition=models.Q(post__isnull=True), name='case_unique_user',
+            ),
+            models.UniqueConstraint(fields=['post'], condition=models.Q(post__isnull=False), name='case_unique_post'),
+        ]
+        indexes = [
+            # The moderation queue: open cases, most reported first
+            models.Index(
+                fields=['-open_reports', '-last_reported_at'], condition=models.Q(is_resolved=False),
+                name='case_open_queue',
+            ),
+        ]
+
+    def __str__(self):
+        # Ids only, so that listing cases never loads their users or posts
+        if self.post_id:
+            return f"Post {self.post_id} (user {self.reported_user_id})"
+        return f"User {self.reported_user_id}"
+
 class Block(models.Model):
     blocker = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocks_made')
     blocked_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocks_received')
@@ -74,6 +379,53 @@ class Block(models.Model):
 
     class Meta:
         unique_together = ('blocker', 'blocked_user')
+        indexes = [
+            # unique_together covers (blocker, blocked_user); this serves the reverse anti-join
+            models.Index(fields=['blocked_user', 'blocker'], name='block_reverse'),
+        ]
 
     def __str__(self):
         return f"{self.blocker.username} blocked {self.blocked_user.username}"
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [
+            models.Index(fields=['owner', '-timestamp', '-post'], name='timeline_owner_recent'),
+            models.Index(fields=['owner', 'author'], name='timeline_owner_author'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in {self.owner_id}'s timeline"
+
+class RankedPost(models.Model):
+    """One row of the precomputed "hot" feed, rewritten by `manage.py compute_rankings`"""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='ranking')
+    rank = models.PositiveIntegerField(unique=True)
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['rank']
+
+    def __str__(self):
+        return f"#{self.rank}: post {self.post_id} ({self.score:.2f})"
+
+class TrendingTag(models.Model):
+    """One row of the precomputed trending-tags list"""
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, related_name='trending')
+    rank = models.PositiveIntegerField(unique=True)
+    score = models.FloatField()
+    recent_posts = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['rank']
+
+    def __str__(self):
+        return f"#{self.rank}: {self.tag_id} ({self.score:.2f})"
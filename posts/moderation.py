@@ -0,0 +1,79 @@
+"""
+Moderation queue.
+
+Reports are grouped into one ModerationCase per reported post, or per
+reported user for reports about a user as a whole. ``file_report`` counts
+each new report on its case with an UPDATE, so the queue is a walk over the
+``case_open_queue`` index (open cases, most reported first) instead of an
+aggregate over the Report table. One reporter counts once per open case,
+which the ``report_unique_open`` constraint enforces even when the same
+report is submitted twice at once.
+
+A post whose case reaches MODERATION_AUTO_HIDE_REPORTS open reports is
+hidden (``Post.is_hidden``) until a moderator dismisses the case; hidden
+posts drop out of every listing (``Post.objects.visible_to``). Reports
+about a user as a whole are only queued.
+
+``resolve`` closes any number of cases, hiding or restoring their posts,
+with one UPDATE per table. It backs the bulk actions in the admin.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F
+from django.utils import timezone
+
+from .models import ModerationCase, Post, Report
+
+
+def _case(reported_user_id, post_id):
+    case, _ = ModerationCase.objects.get_or_create(
+        reported_user_id=reported_user_id, post_id=post_id,
+    )
+    return case
+
+
+def file_report(reporter, reported_user_id, reason, description='', post_id=None):
+    """Record a report and count it on its case; None if ``reporter`` already has one open there"""
+    now = timezone.now()
+    with transaction.atomic():
+        case = _case(reported_user_id, post_id)
+        try:
+            with transaction.atomic():
+                report = Report.objects.create(
+                    reporter=reporter, reported_user_id=reported_user_id, post_id=post_id,
+                    reason=reason, description=description, case=case,
+                )
+        except IntegrityError:
+            return None
+        ModerationCase.objects.filter(pk=case.pk).update(
+            open_reports=F('open_reports') + 1, total_reports=F('total_reports') + 1,
+            last_reported_at=now, is_resolved=False, resolved_at=None, resolved_by=None,
+        )
+        threshold = settings.MODERATION_AUTO_HIDE_REPORTS
+        if post_id and threshold:
+            # Checked in the same statement, against the count the UPDATE above left
+            Post.objects.filter(pk=post_id, is_hidden=False).filter(
+                Exists(ModerationCase.objects.filter(pk=case.pk, open_reports__gte=threshold)),
+            ).update(is_hidden=True, updated_at=now)
+    return report
+
+
+def resolve(cases, moderator=None, hide=None):
+    """
+    Close ``cases`` (a ModerationCase queryset) and their open reports.
+
+    With ``hide=True`` their posts are hidden, with ``hide=False`` (dismiss)
+    shown again; None leaves them as they are. Returns the number of cases.
+    """
+    now = timezone.now()
+    case_ids = cases.values('pk')
+    with transaction.atomic():
+        # Posts and reports first: ``cases`` may itself filter on is_resolved
+        if hide is not None:
+            Post.objects.filter(pk__in=cases.filter(post__isnull=False).values('post')).exclude(
+                is_hidden=hide,
+            ).update(is_hidden=hide, updated_at=now)
+        Report.objects.filter(case__in=case_ids, is_resolved=False).update(is_resolved=True)
+        return ModerationCase.objects.filter(pk__in=case_ids).update(
+            is_resolved=True, open_reports=0, resolved_at=now, resolved_by=moderator,
+        )
@@ -0,0 +1,113 @@
+"""
+Precomputed "hot" feed and trending tags.
+
+``compute_rankings`` (run periodically with ``manage.py compute_rankings``)
+scores every post from the last RANKING_WINDOW_HOURS on its denormalized
+counters, decayed by age::
+
+    score = (likes + 2 * comments + 3 * shares) / (age_hours + 2) ** RANKING_GRAVITY
+
+and replaces the RankedPost and TrendingTag tables with the top entries.
+A tag's score is the sum of the scores of its recent posts. Reading the hot
+feed is then a walk over the unique ``rank`` index instead of an aggregate
+over likes and comments per request. Visibility still applies at read time,
+so one global ranking serves every viewer.
+"""
+import heapq
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.pagination import KeysetPage
+from .models import Post, RankedPost, TrendingTag
+
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+SHARE_WEIGHT = 3
+
+
+def hot_score(likes, comments, shares, age_hours, gravity=None):
+    gravity = settings.RANKING_GRAVITY if gravity is None else gravity
+    engagement = LIKE_WEIGHT * likes + COMMENT_WEIGHT * comments + SHARE_WEIGHT * shares
+    return engagement / (max(age_hours, 0) + 2) ** gravity
+
+
+def compute_rankings(now=None):
+    """Rescore recent posts and rewrite the hot feed and trending tags; returns their sizes"""
+    now = now or timezone.now()
+    since = now - timedelta(hours=settings.RANKING_WINDOW_HOURS)
+    rows = Post.objects.filter(timestamp__gte=since).values_list(
+        'id', 'timestamp', 'like_count', 'comment_count', 'share_count'
+    )
+    scores = {
+        post_id: hot_score(likes, comments, shares, (now - timestamp).total_seconds() / 3600)
+        for post_id, timestamp, likes, comments, shares in rows.iterator()
+    }
+    top_posts = heapq.nlargest(settings.RANKING_SIZE, (
+        (score, post_id) for post_id, score in scores.items() if score > 0
+    ))
+
+    tag_scores = defaultdict(float)
+    tag_posts = Counter()
+    Through = Post.tags.through
+    for tag_id, post_id in Through.objects.filter(post__timestamp__gte=since).values_list('tag_id', 'post_id').iterator():
+        if post_id in scores:
+            tag_scores[tag_id] += scores[post_id]
+            tag_posts[tag_id] += 1
+    top_tags = heapq.nlargest(settings.TRENDING_TAGS_SIZE, (
+        (score, tag_id) for tag_id, score in tag_scores.items() if score > 0
+    ))
+
+    with transaction.atomic():
+        RankedPost.objects.all().delete()
+        RankedPost.objects.bulk_create([
+            RankedPost(post_id=post_id, rank=rank, score=score, computed_at=now)
+            for rank, (score, post_id) in enumerate(top_posts, 1)
+        ])
+        TrendingTag.objects.all().delete()
+        TrendingTag.objects.bulk_create([
+            TrendingTag(tag_id=tag_id, rank=rank, score=score, recent_posts=tag_posts[tag_id], computed_at=now)
+            for rank, (score, tag_id) in enumerate(top_tags, 1)
+        ])
+    return len(top_posts), len(top_tags)
+
+
+def _hot_queryset(viewer, cursor, page_size, category_id, tag_slug, excluded):
+    try:
+        after = int(cursor or 0)
+    except ValueError:
+        after = 0
+    posts = Post.objects.for_feed().visible_to(viewer, excluded).filter(ranking__rank__gt=after)
+    if category_id:
+        posts = posts.filter(category_id=category_id)
+    if tag_slug:
+        posts = posts.filter(tags__slug=tag_slug)
+    return posts.annotate(rank=F('ranking__rank')).order_by('rank')[:page_size + 1]
+
+
+def _hot_page(rows, page_size):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = str(rows[-1].rank)
+    return KeysetPage(rows, next_cursor)
+
+
+async def ahot_posts(viewer, cursor=None, page_size=None, category_id=None, tag_slug=None, excluded=None):
+    """A KeysetPage of ranked posts ``viewer`` may see; the cursor is the last rank shown"""
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    rows = [post async for post in _hot_queryset(viewer, cursor, page_size, category_id, tag_slug, excluded)]
+    return _hot_page(rows, page_size)
+
+
+def trending_tags():
+    """The current trending tags, best first"""
+    return TrendingTag.objects.select_related('tag')[:settings.TRENDING_TAGS_SIZE]
+
+
+async def atrending_tags():
+    return [trending async for trending in trending_tags()]
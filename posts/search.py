@@ -0,0 +1,225 @@
+"""
+Full-text search over posts and users.
+
+On SQLite the search runs against two FTS5 virtual tables, created by
+migration 0004 and kept in sync by the receivers in ``posts.signals``:
+
+* ``posts_post_fts`` (rowid = post id): post text, author username and tag names
+* ``posts_user_fts`` (rowid = user id): usernames, with prefix indexes for
+  as-you-type lookups
+
+Results are ranked with BM25. On other databases, or when FTS5 is missing,
+the functions fall back to the old ``icontains`` scans. The queries are raw
+SQL, so the async views call them through ``asearch_posts``/``asearch_users``,
+which run them in a thread.
+"""
+import re
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
+
+from .models import Post, Tag
+
+User = get_user_model()
+
+POST_INDEX = 'posts_post_fts'
+USER_INDEX = 'posts_user_fts'
+
+# Column weights for bm25(): text, username, tags
+POST_WEIGHTS = (1.0, 4.0, 2.0)
+
+_available = None
+
+
+def is_available():
+    """Whether the FTS5 index tables exist on the default database"""
+    global _available
+    if _available is None:
+        if connection.vendor != 'sqlite':
+            _available = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [POST_INDEX])
+                if cursor.fetchone():
+                    _available = True
+    return bool(_available)
+
+
+def match_expression(query, prefix='last'):
+    """
+    Turn free text into a safe FTS5 MATCH expression.
+
+    Every word is quoted so user input can never inject FTS syntax. ``prefix``
+    is ``'last'`` to prefix-match only the word being typed, or ``'all'``.
+    """
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    parts = [f'"{term}"' for term in terms]
+    if prefix == 'all':
+        parts = [f'{part}*' for part in parts]
+    elif prefix == 'last':
+        parts[-1] += '*'
+    return ' '.join(parts)
+
+
+def _fetch_ids(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_posts(query, category_id=None, tag_slug=None, offset=0, limit=20):
+    """Return ``(post_ids, has_next)`` for one page of ranked post matches"""
+    if not is_available():
+        return _fallback_posts(query, category_id, tag_slug, offset, limit)
+    expression = match_expression(query)
+    if expression is None:
+        return [], False
+
+    post_table = Post._meta.db_table
+    sql = [
+        f'SELECT {POST_INDEX}.rowid FROM {POST_INDEX}',
+        f'JOIN {post_table} p ON p.id = {POST_INDEX}.rowid',
+        f'WHERE {POST_INDEX} MATCH %s',
+    ]
+    params = [expression]
+    if category_id:
+        sql.append('AND p.category_id = %s')
+        params.append(category_id)
+    if tag_slug:
+        through = Post.tags.through._meta.db_table
+        sql.append(
+            f'AND EXISTS (SELECT 1 FROM {through} pt JOIN {Tag._meta.db_table} t ON t.id = pt.tag_id '
+            'WHERE pt.post_id = p.id AND t.slug = %s)'
+        )
+        params.append(tag_slug)
+    weights = ', '.join(str(weight) for weight in POST_WEIGHTS)
+    sql.append(f'ORDER BY bm25({POST_INDEX}, {weights}) LIMIT %s OFFSET %s')
+    params += [limit + 1, offset]
+
+    ids = _fetch_ids(' '.join(sql), params)
+    return ids[:limit], len(ids) > limit
+
+
+def search_users(query, exclude_id=None, offset=0, limit=20):
+    """Return ``(user_ids, has_next)`` for usernames matching ``query`` as a prefix"""
+    if not is_available():
+        return _fallback_users(query, exclude_id, offset, limit)
+    expression = match_expression(query, prefix='all')
+    if expression is None:
+        return [], False
+
+    sql = f'SELECT rowid FROM {USER_INDEX} WHERE {USER_INDEX} MATCH %s'
+    params = [expression]
+    if exclude_id is not None:
+        sql += ' AND rowid != %s'
+        params.append(exclude_id)
+    sql += f' ORDER BY bm25({USER_INDEX}), length(username) LIMIT %s OFFSET %s'
+    params += [limit + 1, offset]
+
+    ids = _fetch_ids(sql, params)
+    return ids[:limit], len(ids) > limit
+
+
+asearch_posts = sync_to_async(search_posts)
+asearch_users = sync_to_async(search_users)
+
+
+def _fallback_posts(query, category_id, tag_slug, offset, limit):
+    posts = Post.objects.filter(
+        Q(text__icontains=query) |
+        Q(user__username__icontains=query) |
+        Q(tags__name__icontains=query)
+    ).distinct()
+    if category_id:
+        posts = posts.filter(category_id=category_id)
+    if tag_slug:
+        posts = posts.filter(tags__slug=tag_slug)
+    ids = list(posts.order_by('-timestamp', '-id').values_list('id', flat=True)[offset:offset + limit + 1])
+    return ids[:limit], len(ids) > limit
+
+
+def _fallback_users(query, exclude_id, offset, limit):
+    users = User.objects.filter(username__icontains=query)
+    if exclude_id is not None:
+        users = users.exclude(id=exclude_id)
+    ids = list(users.order_by('username').values_list('id', flat=True)[offset:offset + limit + 1])
+    return ids[:limit], len(ids) > limit
+
+
+# Index maintenance
+
+def _reindex_posts(where, params):
+    post_table = Post._meta.db_table
+    through = Post.tags.through._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {POST_INDEX} WHERE rowid IN (SELECT p.id FROM {post_table} p WHERE {where})',
+            params,
+        )
+        cursor.execute(
+            f'INSERT INTO {POST_INDEX} (rowid, text, username, tags) '
+            f'SELECT p.id, p.text, u.username, COALESCE(('
+            f'SELECT group_concat(t.name, \' \') FROM {through} pt '
+            f'JOIN {Tag._meta.db_table} t ON t.id = pt.tag_id WHERE pt.post_id = p.id'
+            f"), '') FROM {post_table} p JOIN {User._meta.db_table} u ON u.id = p.user_id WHERE {where}",
+            params,
+        )
+
+
+def index_posts(post_ids):
+    post_ids = list(post_ids)
+    if post_ids and is_available():
+        placeholders = ', '.join(['%s'] * len(post_ids))
+        _reindex_posts(f'p.id IN ({placeholders})', post_ids)
+
+
+def index_posts_by_user(user_id):
+    if is_available():
+        _reindex_posts('p.user_id = %s', [user_id])
+
+
+def index_posts_by_tag(tag_id):
+    if is_available():
+        through = Post.tags.through._meta.db_table
+        _reindex_posts(f'p.id IN (SELECT post_id FROM {through} WHERE tag_id = %s)', [tag_id])
+
+
+def remove_post(post_id):
+    if is_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {POST_INDEX} WHERE rowid = %s', [post_id])
+
+
+def index_user(user):
+    """Index a user's username, returning True if it changed"""
+    if not is_available():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT username FROM {USER_INDEX} WHERE rowid = %s', [user.id])
+        row = cursor.fetchone()
+        if row and row[0] == user.username:
+            return False
+        cursor.execute(f'DELETE FROM {USER_INDEX} WHERE rowid = %s', [user.id])
+        cursor.execute(f'INSERT INTO {USER_INDEX} (rowid, username) VALUES (%s, %s)', [user.id, user.username])
+    return row is not None
+
+
+def remove_user(user_id):
+    if is_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {USER_INDEX} WHERE rowid = %s', [user_id])
+
+
+def rebuild():
+    """Repopulate both indexes from the source tables"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {POST_INDEX}')
+        cursor.execute(f'DELETE FROM {USER_INDEX}')
+        cursor.execute(
+            f'INSERT INTO {USER_INDEX} (rowid, username) SELECT id, username FROM {User._meta.db_table}'
+        )
+    _reindex_posts('1 = 1', [])
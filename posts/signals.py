@@ -0,0 +1,173 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.functions import Now
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.images import image_processed
+from users import context as user_context
+from users.models import Profile, Settings
+from . import cards, live, search, visibility
+from .models import Block, Category, Comment, Like, Post, Tag, counters_changed
+
+User = get_user_model()
+
+
+def _invalidate_cards(post_ids):
+    post_ids = list(post_ids)
+    transaction.on_commit(lambda: cards.invalidate_posts(post_ids))
+
+
+def _touch_posts(post_ids):
+    """Mark posts as changed when something they show changes elsewhere (tags, category)"""
+    Post.objects.filter(id__in=list(post_ids)).update(updated_at=Now())
+
+
+# Posts
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        search.index_posts([instance.id])
+        _invalidate_cards([instance.id])
+        if created:
+            Profile.objects.bump(instance.user_id, post_count=1)
+            transaction.on_commit(lambda: live.publish_new_post(instance.id, instance.user_id))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    search.remove_post(instance.id)
+    _invalidate_cards([instance.id])
+    Profile.objects.bump(instance.user_id, post_count=-1)
+    Tag.objects.bump(getattr(instance, '_tag_ids', []), -1)
+
+
+@receiver(counters_changed)
+def post_counters_changed(sender, post_ids, **kwargs):
+    _invalidate_cards(post_ids)
+    post_ids = list(post_ids)
+    transaction.on_commit(lambda: live.publish_counts(post_ids))
+
+
+@receiver(image_processed, sender=Post)
+def post_image_processed(sender, pk, **kwargs):
+    cards.invalidate_posts([pk])
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def engagement_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidate_cards([instance.post_id])
+
+
+# Tags
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Remember what is about to be unlinked
+        related = instance.post_set if reverse else instance.tags
+        instance._cleared_ids = list(related.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    related_ids = list(getattr(instance, '_cleared_ids', []) if action == 'post_clear' else pk_set or [])
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        post_ids = related_ids
+        Tag.objects.bump([instance.id], delta * len(related_ids))
+    else:
+        post_ids = [instance.id]
+        Tag.objects.bump(related_ids, delta)
+    search.index_posts(post_ids)
+    _touch_posts(post_ids)
+    _invalidate_cards(post_ids)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_tags(sender, instance, **kwargs):
+    # The cascade deletes the through rows without m2m_changed
+    instance._tag_ids = list(Post.tags.through.objects.filter(post=instance.id).values_list('tag_id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_posts(sender, instance, **kwargs):
+    instance._tagged_post_ids = list(instance.post_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def tag_renamed(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_posts_by_tag(instance.id)
+        post_ids = list(Post.tags.through.objects.filter(tag=instance).values_list('post_id', flat=True))
+        _touch_posts(post_ids)
+        _invalidate_cards(post_ids)
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    post_ids = getattr(instance, '_tagged_post_ids', [])
+    search.index_posts(post_ids)
+    _touch_posts(post_ids)
+    _invalidate_cards(post_ids)
+
+
+# Categories
+
+@receiver(post_save, sender=Category)
+def category_renamed(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        post_ids = list(Post.objects.filter(category=instance).values_list('id', flat=True))
+        _touch_posts(post_ids)
+        _invalidate_cards(post_ids)
+
+
+# Authors
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'username' not in update_fields):
+        return
+    if search.index_user(instance):
+        search.index_posts_by_user(instance.id)
+    cards.invalidate_author(instance.id)
+    Profile.objects.filter(user=instance.id).update(updated_at=Now())
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    search.remove_user(instance.id)
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cards.invalidate_author(instance.user_id)
+
+
+@receiver(image_processed, sender=Profile)
+def avatar_processed(sender, pk, **kwargs):
+    user_id = Profile.objects.filter(pk=pk).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        cards.invalidate_author(user_id)
+        Profile.objects.filter(pk=pk).update(updated_at=Now())
+        user_context.invalidate_changed(user_id)
+
+
+# Visibility
+
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+def block_changed(sender, instance, **kwargs):
+    user_ids = (instance.blocker_id, instance.blocked_user_id)
+    transaction.on_commit(lambda: visibility.invalidate_blocks(*user_ids))
+
+
+@receiver(post_save, sender=Settings)
+def settings_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: visibility.invalidate_audience(instance.user_id))
@@ -1,3 +1,662 @@
-from django.test import TestCase
+import threading
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.pubsub import get_broker
+from users import context
+from users.models import Follow, Profile, Settings
+from . import cards, live, moderation, ranking, search, timeline, visibility
+from .models import (
+    MAX_COMMENT_DEPTH, Block, Comment, Like, ModerationCase, Post, RankedPost, Report, Tag, TimelineEntry,
+    TrendingTag, path_segment,
+)
 
 # Create your tests here.
+
+class LikeEndpointTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        self.fan = User.objects.create(username='fan')
+        self.post = Post.objects.create(user=self.author, text='Hello')
+        self.client.force_login(self.fan)
+
+    def test_like_and_unlike_are_idempotent(self):
+        self.assertEqual(self.client.post(f'/posts/like/{self.post.id}/').json(), {'liked': True, 'like_count': 1})
+        self.assertEqual(self.client.post(f'/posts/like/{self.post.id}/').json(), {'liked': True, 'like_count': 1})
+        self.assertEqual(self.client.post(f'/posts/unlike/{self.post.id}/').json(), {'liked': False, 'like_count': 0})
+        self.assertEqual(self.client.post(f'/posts/unlike/{self.post.id}/').json(), {'liked': False, 'like_count': 0})
+        self.assertFalse(Like.objects.exists())
+
+    def test_like_costs_two_statements_without_fetching_the_post(self):
+        for verb in ('like', 'unlike'):
+            with CaptureQueriesContext(connection) as ctx:
+                getattr(Like.objects, verb)(self.post.id, self.fan.id)
+            statements = [q['sql'] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+            self.assertEqual(len(statements), 2, statements)
+
+    def test_missing_post_is_404(self):
+        self.assertEqual(self.client.post('/posts/like/999/').status_code, 404)
+        self.assertEqual(self.client.post('/posts/unlike/999/').status_code, 404)
+
+    def test_like_requires_post(self):
+        self.assertEqual(self.client.get(f'/posts/like/{self.post.id}/').status_code, 405)
+
+
+@override_settings(MODERATION_AUTO_HIDE_REPORTS=3)
+class ModerationTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        self.post = Post.objects.create(user=self.author, text='Hello')
+        self.reporters = [User.objects.create(username=f'reporter{i}') for i in range(3)]
+
+    def report_post(self, reporter):
+        return moderation.file_report(reporter, self.author.id, 'spam', post_id=self.post.id)
+
+    def test_reports_are_counted_once_per_reporter_and_hide_the_post(self):
+        anonymous = AnonymousUser()
+        self.report_post(self.reporters[0])
+        self.assertIsNone(self.report_post(self.reporters[0]))
+        self.report_post(self.reporters[1])
+        self.assertTrue(Post.objects.visible_to(anonymous).filter(pk=self.post.pk).exists())
+
+        self.report_post(self.reporters[2])
+        case = ModerationCase.objects.get()
+        self.assertEqual((case.open_reports, case.total_reports), (3, 3))
+        self.assertFalse(Post.objects.visible_to(anonymous).filter(pk=self.post.pk).exists())
+        self.assertTrue(Post.objects.visible_to(self.author).filter(pk=self.post.pk).exists())
+
+    def test_dismissing_cases_resolves_reports_and_shows_posts_in_three_updates(self):
+        for reporter in self.reporters:
+            self.report_post(reporter)
+        moderation.file_report(self.reporters[0], self.author.id, 'harassment')
+
+        with self.assertNumQueries(3 + 2):  # savepoint and release around three UPDATEs
+            self.assertEqual(moderation.resolve(ModerationCase.objects.filter(is_resolved=False), hide=False), 2)
+        self.assertFalse(Post.objects.get().is_hidden)
+        self.assertFalse(Report.objects.filter(is_resolved=False).exists())
+        self.assertEqual(ModerationCase.objects.filter(open_reports=0, is_resolved=True).count(), 2)
+
+    def test_a_failed_resolve_leaves_cases_reports_and_posts_as_they_were(self):
+        for reporter in self.reporters:
+            self.report_post(reporter)
+        with mock.patch.object(ModerationCase.objects, 'filter', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                moderation.resolve(ModerationCase.objects.all(), hide=False)
+        self.assertTrue(Post.objects.get().is_hidden)
+        self.assertEqual(Report.objects.filter(is_resolved=False).count(), 3)
+
+    def test_one_open_report_per_reporter_is_enforced_by_the_database(self):
+        report = self.report_post(self.reporters[0])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Report.objects.create(
+                reporter=self.reporters[0], reported_user=self.author, post=self.post, reason='spam', case=report.case,
+            )
+        # Once the case is resolved the reporter may report again
+        moderation.resolve(ModerationCase.objects.all())
+        self.assertIsNotNone(self.report_post(self.reporters[0]))
+        self.assertEqual(ModerationCase.objects.values_list('open_reports', 'total_reports').get(), (1, 2))
+
+
+class TagTests(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create(username='author')
+        Profile.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def create_post(self, tags):
+        return self.client.post(reverse('create_post'), {'text': 'Hello', 'tags': tags})
+
+    def test_resolve_matches_names_by_slug_and_creates_missing_tags(self):
+        existing = Tag.objects.create(name='django')
+        with self.assertNumQueries(3):
+            tags = Tag.objects.resolve(['Django', 'django!', '  Web   Dev ', 'WEB dev', '!!!'])
+        self.assertEqual([(tag.name, tag.slug) for tag in tags], [('django', 'django'), ('web dev', 'web-dev')])
+        self.assertEqual(tags[0].pk, existing.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(Tag.objects.resolve(['web dev', 'DJANGO']), tags[::-1])
+        with self.assertNumQueries(0):
+            self.assertEqual(Tag.objects.resolve(['?']), [])
+
+    def test_bump_adjusts_usage_counts_without_going_negative(self):
+        tags = Tag.objects.resolve(['a', 'b'])
+        Tag.objects.bump([tag.id for tag in tags], 2)
+        Tag.objects.bump([tags[0].id], -3)
+        self.assertEqual(list(Tag.objects.order_by('name').values_list('usage_count', flat=True)), [0, 2])
+
+    def test_create_post_links_deduplicated_tags_and_counts_their_use(self):
+        Tag.objects.create(name='django')
+        response = self.create_post('Django, django!, Python')
+        self.assertRedirects(response, reverse('home_feed'), fetch_redirect_response=False)
+        post = Post.objects.get()
+        self.assertEqual(sorted(post.tags.values_list('slug', flat=True)), ['django', 'python'])
+        self.assertEqual(dict(Tag.objects.values_list('slug', 'usage_count')), {'django': 1, 'python': 1})
+        self.assertEqual(search.search_posts('python'), ([post.id], False))
+
+    def test_create_post_queries_do_not_grow_with_the_number_of_tags(self):
+        # The first post caches the ids of high-fanout authors
+        self.create_post('')
+        for tags in ('one', 'two, three, four, five, six'):
+            with self.assertNumQueries(16):
+                self.create_post(tags)
+
+
+class CardCacheTests(TestCase):
+    def setUp(self):
+        self.addCleanup(cards.card_cache().clear)
+        self.author = User.objects.create(username='author')
+        self.sharer = User.objects.create(username='sharer')
+        self.post = Post.objects.create(user=self.author, text='Original')
+        self.share = Post.objects.create(
+            user=self.sharer, text='Look', shared_from=self.post, is_shared=True,
+        )
+        cards.reset_stats()
+
+    def render(self):
+        return {post.id: post.card_html for post in cards.attach_cards(Post.objects.for_feed().order_by('id'))}
+
+    def test_cards_are_served_from_the_cache_until_a_counter_changes(self):
+        self.render()
+        with self.assertNumQueries(2):  # posts and their tags; no template rendering queries
+            self.render()
+        self.assertEqual(cards.stats()['hits'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.bump(self.post.id, share_count=1)
+        html = self.render()
+        self.assertIn('class="share-count">1<', html[self.post.id])
+        self.assertEqual((cards.stats()['hits'], cards.stats()['misses']), (3, 3))
+
+    def test_renaming_the_original_author_rerenders_shares(self):
+        self.assertIn("Shared from author's post", self.render()[self.share.id])
+        self.author.username = 'renamed'
+        self.author.save()
+        self.assertIn("Shared from renamed's post", self.render()[self.share.id])
+
+    def test_stats_command_warns_that_a_per_process_cache_has_no_shared_counts(self):
+        self.render()
+        out, err = StringIO(), StringIO()
+        call_command('card_cache_stats', stdout=out, stderr=err)
+        self.assertIn('hits: 0  misses: 2', out.getvalue())
+        self.assertIn('per-process LocMemCache', err.getvalue())
+        with mock.patch.object(cards, 'stats_are_shared', return_value=True):
+            err = StringIO()
+            call_command('card_cache_stats', stdout=StringIO(), stderr=err)
+        self.assertEqual(err.getvalue(), '')
+
+
+class LiveUpdateTests(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.viewer, self.author, self.private = [
+            User.objects.create(username=name) for name in ('viewer', 'author', 'private')
+        ]
+        Settings.objects.create(user=self.private, privacy='private')
+        self.post = Post.objects.create(user=self.author, text='Hello', like_count=3)
+
+    def test_counts_are_not_read_when_nobody_watches(self):
+        with self.assertNumQueries(0):
+            live.publish_counts([self.post.id])
+
+    async def test_counts_are_published_to_watchers(self):
+        async with get_broker().subscribe([live.post_channel(self.post.id)]) as subscription:
+            await sync_to_async(live.publish_counts)([self.post.id])
+            channel, message = await subscription.get(timeout=1)
+        self.assertEqual(
+            message, {'post_id': self.post.id, 'like_count': 3, 'comment_count': 0, 'share_count': 0},
+        )
+
+    @override_settings(LIVE_UPDATES_KEEPALIVE_SECONDS=1)
+    async def test_new_posts_are_only_announced_to_viewers_who_may_see_them(self):
+        stream = live.event_stream(self.viewer, [], new_posts=True)
+        self.assertTrue((await anext(stream)).startswith('retry:'))
+        live.publish_new_post(101, self.private.id)
+        live.publish_new_post(102, self.viewer.id)
+        live.publish_new_post(103, self.author.id)
+        event = await anext(stream)
+        await stream.aclose()
+        self.assertEqual(event, live.sse('new_post', {'post_id': 103, 'user_id': self.author.id}))
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        # Fan-out limits and visibility are cached by user id, which the next test reuses
+        self.addCleanup(cache.clear)
+        self.author, self.reader, self.other = [
+            User.objects.create(username=name) for name in ('author', 'reader', 'other')
+        ]
+        Profile.objects.create(user=self.author)
+        Follow.objects.create(follower=self.reader, following=self.author)
+        Follow.objects.create(follower=self.other, following=self.author)
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def post(self, minutes, user=None, fan_out=True):
+        post = Post.objects.create(user=user or self.author, text=f'Post {minutes}')
+        Post.objects.filter(pk=post.pk).update(timestamp=self.start + timedelta(minutes=minutes))
+        post.refresh_from_db()
+        if fan_out:
+            timeline.fan_out_post(post)
+        return post
+
+    def owners(self, post):
+        return set(TimelineEntry.objects.filter(post=post).values_list('owner__username', flat=True))
+
+    def test_posts_are_fanned_out_to_the_author_and_followers(self):
+        post = self.post(1)
+        self.assertEqual(self.owners(post), {'author', 'reader', 'other'})
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_high_fanout_authors_are_merged_at_read_time(self):
+        cache.delete(timeline.HIGH_FANOUT_CACHE_KEY)
+        post = self.post(1)
+        self.assertEqual(self.owners(post), {'author'})
+        self.assertEqual(list(timeline.following_timeline(self.reader)), [post])
+
+    @override_settings(TIMELINE_BACKFILL_POSTS=2)
+    def test_follow_backfills_recent_posts_and_unfollow_removes_them(self):
+        writer = User.objects.create(username='writer')
+        posts = [self.post(minutes, user=writer, fan_out=False) for minutes in (1, 2, 3)]
+        timeline.add_follow(self.reader, writer)
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(owner=self.reader).values_list('post_id', flat=True)),
+            {posts[1].id, posts[2].id},
+        )
+        timeline.remove_follow(self.reader, writer)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader, author=writer).exists())
+
+    def test_timeline_is_newest_first_and_paginated(self):
+        posts = [self.post(minutes) for minutes in (3, 1, 2)]
+        first = timeline.following_timeline(self.reader, page_size=2)
+        self.assertEqual(list(first), [posts[0], posts[2]])
+        second = timeline.following_timeline(self.reader, first.next_cursor, page_size=2)
+        self.assertEqual((list(second), second.next_cursor), ([posts[1]], None))
+
+    def test_timeline_hides_posts_the_reader_may_no_longer_see(self):
+        public, hidden = self.post(1), self.post(2)
+        Post.objects.filter(pk=hidden.pk).update(is_hidden=True)
+        self.assertEqual(list(timeline.following_timeline(self.reader)), [public])
+        author_settings = Settings.objects.create(user=self.author, privacy='private')
+        self.assertEqual(list(timeline.following_timeline(self.reader)), [])
+        author_settings.privacy = 'public'
+        author_settings.save()
+        # The reader's cached exclusion set is dropped when the block commits
+        with self.captureOnCommitCallbacks(execute=True):
+            Block.objects.create(blocker=self.author, blocked_user=self.reader)
+        self.assertEqual(list(timeline.following_timeline(self.reader)), [])
+
+    def test_trim_keeps_the_newest_entries_of_timelines_posted_to(self):
+        posts = [self.post(minutes) for minutes in range(1, 6)]
+        quiet = User.objects.create(username='quiet')
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(owner=quiet, post=post, author=self.author, timestamp=post.timestamp) for post in posts
+        )
+        self.assertEqual(timeline.trim_timelines(since=self.start, max_entries=3), 3)
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(owner=self.reader).order_by('-timestamp').values_list('post_id', flat=True)),
+            [post.id for post in reversed(posts[2:])],
+        )
+        # Not followed or posted since: only a full sweep reaches it
+        self.assertEqual(TimelineEntry.objects.filter(owner=quiet).count(), 5)
+        self.assertEqual(timeline.trim_timelines(max_entries=3), 1)
+        self.assertEqual(TimelineEntry.objects.filter(owner=quiet).count(), 3)
+
+
+class VisibilityTests(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.viewer, self.friend, self.public, self.private, self.blocker = [
+            User.objects.create(username=name) for name in ('viewer', 'friend', 'public', 'private', 'blocker')
+        ]
+        Settings.objects.create(user=self.friend, privacy='friends')
+        Settings.objects.create(user=self.private, privacy='private', profile_visible=False)
+        Follow.objects.create(follower=self.viewer, following=self.friend)
+        for user in (self.viewer, self.friend, self.public, self.private, self.blocker):
+            Post.objects.create(user=user, text=user.username)
+
+    def authors(self, viewer):
+        return set(Post.objects.visible_to(viewer).values_list('text', flat=True))
+
+    def test_posts_follow_author_privacy(self):
+        self.assertEqual(self.authors(self.viewer), {'viewer', 'friend', 'public', 'blocker'})
+        self.assertEqual(self.authors(self.public), {'public', 'viewer', 'blocker'})
+        self.assertEqual(self.authors(self.private), {'private', 'viewer', 'public', 'blocker'})
+        self.assertEqual(self.authors(AnonymousUser()), {'viewer', 'public', 'blocker'})
+
+    def test_blocks_hide_posts_comments_and_users_both_ways(self):
+        post = Post.objects.get(user=self.public)
+        Comment.objects.create(post=post, user=self.blocker, text='blocker')
+        with self.captureOnCommitCallbacks(execute=True):
+            Block.objects.create(blocker=self.blocker, blocked_user=self.viewer)
+        self.assertEqual(visibility.excluded_user_ids(self.viewer), {self.blocker.id})
+        self.assertEqual(visibility.excluded_user_ids(self.blocker), {self.viewer.id})
+        self.assertNotIn('blocker', self.authors(self.viewer))
+        self.assertNotIn('viewer', self.authors(self.blocker))
+        self.assertFalse(Comment.objects.visible_to(self.viewer).exists())
+        self.assertTrue(Comment.objects.visible_to(self.public).exists())
+        self.assertEqual(
+            set(visibility.visible_users(User.objects.all(), self.viewer).values_list('username', flat=True)),
+            {'viewer', 'friend', 'public'},
+        )
+        self.assertFalse(visibility.can_view_profile(self.viewer, self.blocker.id))
+        self.assertFalse(visibility.can_view_posts(self.blocker, self.viewer.id))
+
+    def test_exclusion_sets_are_invalidated_when_blocks_change(self):
+        self.assertEqual(visibility.excluded_user_ids(self.viewer), frozenset())
+        with self.assertNumQueries(0):
+            visibility.excluded_user_ids(self.viewer)
+        with self.captureOnCommitCallbacks(execute=True):
+            block = Block.objects.create(blocker=self.viewer, blocked_user=self.public)
+        self.assertEqual(visibility.excluded_user_ids(self.viewer), {self.public.id})
+        self.assertFalse(visibility.can_view_posts(self.public, self.viewer.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            block.delete()
+        self.assertEqual(visibility.excluded_user_ids(self.viewer), frozenset())
+        self.assertTrue(visibility.can_view_posts(self.public, self.viewer.id))
+
+    def test_audience_is_invalidated_when_settings_are_saved(self):
+        self.assertTrue(visibility.can_view_posts(self.viewer, self.public.id))
+        self.assertFalse(visibility.can_view_profile(self.viewer, self.private.id))
+        with self.assertNumQueries(0):
+            visibility.audience(self.public.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Settings.objects.create(user=self.public, privacy='private')
+        self.assertFalse(visibility.can_view_posts(self.viewer, self.public.id))
+        private_settings = Settings.objects.get(user=self.private)
+        private_settings.profile_visible = True
+        with self.captureOnCommitCallbacks(execute=True):
+            private_settings.save()
+        self.assertTrue(visibility.can_view_profile(self.viewer, self.private.id))
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create(username='author')
+        self.post = Post.objects.create(user=self.user, text='Hello')
+
+    def comment(self, text, parent=None):
+        return Comment.objects.create(post=self.post, user=self.user, text=text, parent=parent)
+
+    def texts(self, comments):
+        return [comment.text for comment in comments]
+
+    def texts_json(self, page):
+        return [comment['text'] for comment in page['comments']]
+
+    def test_subtree_is_in_thread_order(self):
+        first = self.comment('first')
+        second = self.comment('second')
+        reply = self.comment('reply', first)
+        self.comment('other reply', second)
+        nested = self.comment('nested', reply)
+        self.comment('later reply', first)
+
+        self.assertEqual(nested.path, first.path + path_segment(reply.id) + path_segment(nested.id))
+        self.assertEqual(self.texts(Comment.objects.subtree(first)), ['reply', 'nested', 'later reply'])
+        self.assertEqual(self.texts(Comment.objects.subtree(reply, include_self=True)), ['reply', 'nested'])
+
+    def test_replies_past_the_maximum_depth_attach_to_the_deepest_ancestor(self):
+        parent = self.comment('0')
+        for depth in range(1, MAX_COMMENT_DEPTH + 2):
+            parent = self.comment(str(depth), parent)
+        self.assertEqual(parent.depth, MAX_COMMENT_DEPTH - 1)
+        self.assertEqual(parent.parent.depth, MAX_COMMENT_DEPTH - 2)
+
+    def test_fill_root_paths_gives_bulk_created_comments_a_thread(self):
+        Comment.objects.bulk_create([Comment(post=self.post, user=self.user, text=text) for text in 'ab'])
+        self.assertEqual(Comment.objects.fill_root_paths(), 2)
+        for root in Comment.objects.all():
+            self.assertEqual(root.path, path_segment(root.id))
+        root = Comment.objects.get(text='a')
+        self.comment('reply', root)
+        self.assertEqual(self.texts(Comment.objects.subtree(root)), ['reply'])
+
+    @override_settings(COMMENT_PAGE_SIZE=2, COMMENT_THREAD_LIMIT=2)
+    def test_comments_endpoint_pages_roots_and_truncates_threads(self):
+        first = self.comment('first')
+        for text in ['second', 'third']:
+            self.comment(text)
+        for text in ['a', 'b', 'c']:
+            self.comment(text, first)
+        self.client.force_login(self.user)
+        url = reverse('post_comments', args=[self.post.id])
+
+        page = self.client.get(url).json()
+        self.assertEqual(self.texts_json(page), ['first', 'second'])
+        self.assertEqual(page['comments'][0]['reply_count'], 3)
+        page = self.client.get(url, {'cursor': page['next_cursor']}).json()
+        self.assertEqual((self.texts_json(page), page['next_cursor']), (['third'], None))
+
+        thread = self.client.get(url, {'thread': first.id}).json()
+        self.assertEqual((self.texts_json(thread), thread['truncated']), (['a', 'b'], True))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.gardener, self.cook = User.objects.create(username='gardener'), User.objects.create(username='cook')
+
+    def test_match_expression_quotes_every_word(self):
+        self.assertEqual(search.match_expression('tom* OR "pot'), '"tom" "OR" "pot"*')
+        self.assertEqual(search.match_expression('tom pot', prefix='all'), '"tom"* "pot"*')
+        self.assertEqual(search.match_expression('tom pot', prefix='none'), '"tom" "pot"')
+        self.assertIsNone(search.match_expression('*"()'))
+
+    def test_posts_match_text_prefixes_usernames_and_tags(self):
+        self.assertTrue(search.is_available())
+        tomatoes = Post.objects.create(user=self.gardener, text='Tomatoes are ripe')
+        soup = Post.objects.create(user=self.cook, text='Soup of the day')
+        soup.tags.add(Tag.objects.create(name='recipes'))
+
+        self.assertEqual(search.search_posts('ripe tomat'), ([tomatoes.id], False))
+        self.assertEqual(search.search_posts('gardener'), ([tomatoes.id], False))
+        self.assertEqual(search.search_posts('recipes'), ([soup.id], False))
+        self.assertEqual(search.search_posts('recipes', tag_slug='recipes'), ([soup.id], False))
+        self.assertEqual(search.search_posts('soup', tag_slug='other'), ([], False))
+        self.assertEqual(search.search_posts('"('), ([], False))
+
+    def test_index_follows_edits_renames_and_deletes(self):
+        post = Post.objects.create(user=self.cook, text='Soup of the day')
+        post.text = 'Bread of the day'
+        post.save()
+        self.assertEqual(search.search_posts('soup'), ([], False))
+        self.assertEqual(search.search_posts('bread'), ([post.id], False))
+
+        self.cook.username = 'baker'
+        self.cook.save()
+        self.assertEqual(search.search_posts('baker'), ([post.id], False))
+        self.assertEqual(search.search_users('baker'), ([self.cook.id], False))
+
+        post.delete()
+        self.assertEqual(search.search_posts('bread'), ([], False))
+
+    def test_posts_are_ranked_by_weighted_relevance_and_paged(self):
+        in_text = Post.objects.create(user=self.cook, text='A gardener told me how to grow better beans this year')
+        by_author = Post.objects.create(user=self.gardener, text='Beans')
+        self.assertEqual(search.search_posts('gardener'), ([by_author.id, in_text.id], False))
+        self.assertEqual(search.search_posts('gardener', limit=1), ([by_author.id], True))
+        self.assertEqual(search.search_posts('gardener', offset=1, limit=1), ([in_text.id], False))
+
+    def test_users_match_by_prefix_shortest_first(self):
+        garden = User.objects.create(username='garden')
+        self.assertEqual(search.search_users('gard'), ([garden.id, self.gardener.id], False))
+        self.assertEqual(search.search_users('gard', exclude_id=garden.id), ([self.gardener.id], False))
+        self.assertEqual(search.search_users('gard', limit=1), ([garden.id], True))
+
+
+@override_settings(RANKING_WINDOW_HOURS=72, RANKING_GRAVITY=1.8)
+class RankingTests(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.addCleanup(cards.card_cache().clear)
+        self.now = timezone.now()
+        self.author = User.objects.create(username='author')
+
+    def post(self, hours, user=None, **counters):
+        post = Post.objects.create(user=user or self.author, text=f'{hours} hours old')
+        Post.objects.filter(pk=post.pk).update(timestamp=self.now - timedelta(hours=hours), **counters)
+        return post
+
+    def test_hot_score_weighs_engagement_and_decays_with_age(self):
+        self.assertEqual(ranking.hot_score(1, 1, 1, 0, gravity=1), 3)
+        self.assertEqual(ranking.hot_score(1, 0, 0, 8, gravity=1), 0.1)
+        self.assertGreater(ranking.hot_score(0, 1, 0, 5), ranking.hot_score(1, 0, 0, 5))
+
+    def test_rankings_keep_recent_engaged_posts_best_first(self):
+        liked = self.post(1, like_count=5)
+        commented = self.post(1, comment_count=3)
+        old = self.post(48, like_count=50)
+        self.post(100, like_count=100)
+        self.post(1)
+        liked.tags.add(Tag.objects.create(name='garden'))
+        commented.tags.add(Tag.objects.get(name='garden'))
+        old.tags.add(Tag.objects.create(name='history'))
+
+        self.assertEqual(ranking.compute_rankings(self.now), (3, 2))
+        self.assertEqual(
+            list(RankedPost.objects.values_list('post_id', 'rank')),
+            [(commented.id, 1), (liked.id, 2), (old.id, 3)],
+        )
+        self.assertEqual(
+            list(TrendingTag.objects.values_list('tag__name', 'recent_posts')), [('garden', 2), ('history', 1)],
+        )
+
+        with override_settings(RANKING_SIZE=1):
+            ranking.compute_rankings(self.now)
+        self.assertEqual(list(RankedPost.objects.values_list('post_id', 'rank')), [(commented.id, 1)])
+
+    @override_settings(FEED_PAGE_SIZE=2)
+    def test_hot_feed_pages_by_rank_and_skips_posts_the_viewer_may_not_see(self):
+        private = User.objects.create(username='private')
+        Settings.objects.create(user=private, privacy='private')
+        first = self.post(1, like_count=40)
+        self.post(1, user=private, like_count=30)
+        third, fourth = self.post(1, like_count=20), self.post(1, like_count=10)
+        ranking.compute_rankings(self.now)
+        url = reverse('home_feed')
+
+        response = self.client.get(url, {'sort': 'hot'})
+        self.assertEqual([post.id for post in response.context['posts']], [first.id, third.id])
+        self.assertEqual(response.context['next_cursor'], '3')
+        response = self.client.get(url, {'sort': 'hot', 'cursor': '3'})
+        self.assertEqual([post.id for post in response.context['posts']], [fourth.id])
+        self.assertIsNone(response.context['next_cursor'])
+        response = self.client.get(url, {'sort': 'hot', 'cursor': 'junk'})
+        self.assertEqual([post.id for post in response.context['posts']], [first.id, third.id])
+
+    def test_malformed_category_ids_are_ignored(self):
+        post = self.post(1, like_count=1)
+        ranking.compute_rankings(self.now)
+        for sort in ('hot', 'latest'):
+            response = self.client.get(reverse('home_feed'), {'sort': sort, 'category': 'abc'})
+            self.assertEqual([card.id for card in response.context['posts']], [post.id])
+            self.assertEqual(response.context['selected_category'], '')
+
+
+class ReconcileCountersTests(TestCase):
+    def setUp(self):
+        self.author, self.fan = User.objects.create(username='author'), User.objects.create(username='fan')
+        Profile.objects.create(user=self.author)
+        self.post = Post.objects.create(user=self.author, text='Hello')
+        Like.objects.create(user=self.fan, post=self.post)
+        Post.objects.create(user=self.fan, text='Shared', shared_from=self.post, is_shared=True)
+        Follow.objects.create(follower=self.fan, following=self.author)
+        self.tag = Tag.objects.create(name='news')
+        self.post.tags.add(self.tag)
+
+    def counters(self):
+        post = Post.objects.get(pk=self.post.pk)
+        profile = Profile.objects.get(user=self.author)
+        return (
+            post.like_count, post.share_count, Tag.objects.get(pk=self.tag.pk).usage_count,
+            profile.post_count, profile.follower_count,
+        )
+
+    def test_drifted_counters_are_recomputed(self):
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, share_count=0)
+        Tag.objects.filter(pk=self.tag.pk).update(usage_count=0)
+        Profile.objects.filter(user=self.author).update(post_count=5, follower_count=0)
+
+        out = StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertIn('like_count: 1 drifted posts', out.getvalue())
+        self.assertEqual(self.counters(), (7, 0, 0, 5, 0))
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('follower_count: 1 drifted profiles', out.getvalue())
+        self.assertEqual(self.counters(), (1, 1, 1, 1, 1))
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('like_count: 0 drifted posts', out.getvalue())
+
+    def test_fixed_rows_get_a_new_version_and_lose_their_cached_copies(self):
+        self.addCleanup(cache.clear)
+        self.addCleanup(cards.card_cache().clear)
+        long_ago = timezone.now() - timedelta(days=1)
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, updated_at=long_ago)
+        Profile.objects.filter(user=self.author).update(follower_count=0, updated_at=long_ago)
+        cards.card_cache().set(cards.card_key(self.post.id), 'stale card')
+        context.load(self.author.id)
+
+        with mock.patch.object(live, 'publish_counts') as publish_counts:
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('reconcile_counters', stdout=StringIO())
+        publish_counts.assert_called_once_with([self.post.id])
+        self.assertGreater(Post.objects.get(pk=self.post.pk).updated_at, long_ago)
+        self.assertGreater(Profile.objects.get(user=self.author).updated_at, long_ago)
+        self.assertIsNone(cards.card_cache().get(cards.card_key(self.post.id)))
+        self.assertIsNone(cache.get(context.context_key(self.author.id)))
+
+
+class ConcurrentLikeTests(TransactionTestCase):
+    """Fire like/unlike calls from parallel threads at the same post"""
+
+    workers = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('shared-cache in-memory SQLite rejects concurrent writers')
+        self.author = User.objects.create(username='author')
+        self.post = Post.objects.create(user=self.author, text='Hello')
+        self.fans = [User.objects.create(username=f'fan{i}') for i in range(self.workers)]
+
+    def _run(self, calls):
+        barrier = threading.Barrier(len(calls))
+
+        def call(verb_and_user):
+            verb, user_id = verb_and_user
+            barrier.wait()
+            try:
+                return getattr(Like.objects, verb)(self.post.id, user_id)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            return list(pool.map(call, calls))
+
+    def test_parallel_double_clicks_do_not_error(self):
+        fan = self.fans[0]
+        results = self._run([('like', fan.id)] * self.workers)
+        self.assertEqual(sum(result.changed for result in results), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+    def test_parallel_toggles_keep_counter_exact(self):
+        self._run([('like', fan.id) for fan in self.fans])
+        self._run([('unlike', fan.id) for fan in self.fans[::2]] + [('like', fan.id) for fan in self.fans[1::2]])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, Like.objects.filter(post=self.post).count())
+        self.assertEqual(self.post.like_count, len(self.fans[1::2]))
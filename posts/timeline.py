@@ -0,0 +1,162 @@
+"""
+Materialized "following" timelines.
+
+Posts are pushed into their followers' TimelineEntry rows when they are
+created (fan-out-on-write), so reading a timeline is a range scan over the
+``(owner, -timestamp, -post)`` index. Authors with more than
+TIMELINE_FANOUT_LIMIT followers are not fanned out; their posts are pulled
+at read time and merged into the page instead (fan-out-on-read).
+
+Timelines are capped at TIMELINE_MAX_ENTRIES. Finding the oldest entries
+of every follower is too slow for the request that creates a post, so
+``trim_timelines`` (``manage.py trim_timelines --loop``) trims the
+timelines that posts were fanned out to since its previous run. Between
+runs a timeline can exceed the cap by the posts made in the meantime.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+
+from core.pagination import KeysetPage, encode_cursor, keyset_slice
+from users.models import Follow, Profile
+from .models import Post, TimelineEntry
+
+HIGH_FANOUT_CACHE_KEY = 'timeline:high-fanout-authors'
+
+
+def high_fanout_author_ids():
+    """Ids of authors whose posts are merged at read time instead of fanned out"""
+    author_ids = cache.get(HIGH_FANOUT_CACHE_KEY)
+    if author_ids is None:
+        author_ids = frozenset(
+            Profile.objects.filter(follower_count__gt=settings.TIMELINE_FANOUT_LIMIT).values_list('user_id', flat=True)
+        )
+        cache.set(HIGH_FANOUT_CACHE_KEY, author_ids, settings.TIMELINE_HIGH_FANOUT_CACHE_SECONDS)
+    return author_ids
+
+
+def fan_out_post(post):
+    """Push a freshly created post into its author's and followers' timelines"""
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=post.user_id, post=post, author_id=post.user_id, timestamp=post.timestamp)],
+        ignore_conflicts=True,
+    )
+    if post.user_id in high_fanout_author_ids():
+        return
+    # A single INSERT ... SELECT so followers never round-trip through Python
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TimelineEntry._meta.db_table} (owner_id, post_id, author_id, timestamp) '
+            f'SELECT follower_id, %s, %s, %s FROM {Follow._meta.db_table} WHERE following_id = %s '
+            'ON CONFLICT DO NOTHING',
+            [post.id, post.user_id, connection.ops.adapt_datetimefield_value(post.timestamp), post.user_id],
+        )
+
+
+def add_follow(follower, following):
+    """Backfill a new followee's recent posts into the follower's timeline"""
+    if following.id in high_fanout_author_ids():
+        return
+    recent = (
+        Post.objects.filter(user=following)
+        .order_by('-timestamp', '-id')
+        .values_list('id', 'timestamp')[:settings.TIMELINE_BACKFILL_POSTS]
+    )
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=follower.id, post_id=post_id, author_id=following.id, timestamp=timestamp)
+            for post_id, timestamp in recent
+        ],
+        ignore_conflicts=True,
+    )
+    trim_timeline(follower.id)
+
+
+def remove_follow(follower, following):
+    """Drop an unfollowed author's posts from the follower's timeline"""
+    TimelineEntry.objects.filter(owner=follower, author=following).delete()
+
+
+def trim_timeline(owner_id, max_entries=None):
+    """Keep only the newest ``max_entries`` rows of a timeline"""
+    max_entries = max_entries or settings.TIMELINE_MAX_ENTRIES
+    entries = TimelineEntry.objects.filter(owner_id=owner_id)
+    boundary = (
+        entries.order_by('-timestamp', '-post_id')
+        .values_list('timestamp', 'post_id')[max_entries:max_entries + 1]
+    )
+    for timestamp, post_id in boundary:
+        entries.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, post_id__gt=post_id).delete()
+
+
+def trim_timelines(since=None, max_entries=None):
+    """
+    Trim every timeline over ``max_entries`` and return how many were.
+
+    With ``since``, only timelines that may have grown since then are
+    checked: those of the authors of newer posts and of their followers.
+    """
+    max_entries = max_entries or settings.TIMELINE_MAX_ENTRIES
+    entries = TimelineEntry.objects.all()
+    if since is not None:
+        authors = Post.objects.filter(timestamp__gte=since).values('user_id')
+        entries = entries.filter(
+            Q(owner_id__in=authors)
+            | Q(owner_id__in=Follow.objects.filter(following_id__in=authors).values('follower_id'))
+        )
+    over = list(
+        entries.values('owner_id').annotate(size=Count('*')).filter(size__gt=max_entries).values_list('owner_id', flat=True)
+    )
+    for owner_id in over:
+        trim_timeline(owner_id, max_entries)
+    return len(over)
+
+
+def rebuild_timeline(owner_id):
+    """Rebuild a timeline from scratch from the follow graph"""
+    followee_ids = set(Follow.objects.filter(follower_id=owner_id).values_list('following_id', flat=True))
+    followee_ids -= high_fanout_author_ids()
+    followee_ids.add(owner_id)
+    recent = (
+        Post.objects.filter(user_id__in=followee_ids)
+        .order_by('-timestamp', '-id')
+        .values_list('id', 'user_id', 'timestamp')[:settings.TIMELINE_MAX_ENTRIES]
+    )
+    TimelineEntry.objects.filter(owner_id=owner_id).delete()
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=owner_id, post_id=post_id, author_id=author_id, timestamp=timestamp)
+            for post_id, author_id, timestamp in recent
+        ],
+        batch_size=500,
+    )
+
+
+def following_timeline(user, cursor=None, page_size=None):
+    """Return a KeysetPage of feed-ready posts from the accounts ``user`` follows"""
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    entries = TimelineEntry.objects.filter(owner=user).only('post_id', 'timestamp')
+    keys = {
+        entry.post_id: entry.timestamp
+        for entry in keyset_slice(entries, cursor, page_size=page_size, tiebreaker='post_id')
+    }
+
+    high_fanout = high_fanout_author_ids()
+    if high_fanout:
+        pulled = list(
+            Follow.objects.filter(follower=user, following_id__in=high_fanout).values_list('following_id', flat=True)
+        )
+        if pulled:
+            pulled_posts = Post.objects.filter(user_id__in=pulled).only('id', 'timestamp')
+            for post in keyset_slice(pulled_posts, cursor, page_size=page_size):
+                keys[post.id] = post.timestamp
+
+    ordered = sorted(((timestamp, post_id) for post_id, timestamp in keys.items()), reverse=True)
+    next_cursor = None
+    if len(ordered) > page_size:
+        ordered = ordered[:page_size]
+        next_cursor = encode_cursor(*ordered[-1])
+    # Entries outlive privacy changes, so visibility is checked on the way out
+    posts = Post.objects.for_feed().visible_to(user).in_bulk([post_id for _, post_id in ordered])
+    return KeysetPage([posts[post_id] for _, post_id in ordered if post_id in posts], next_cursor)
@@ -3,10 +3,14 @@ from . import views
 
 urlpatterns = [
     path('', views.home_feed, name='home_feed'),
+    path('following/', views.following_feed, name='following_feed'),
     path('post/<int:post_id>/', views.post_detail, name='post_detail'),
+    path('post/<int:post_id>/comments/', views.post_comments, name='post_comments'),
+    path('stream/', views.post_stream, name='post_stream'),
     path('create/', views.create_post, name='create_post'),
     path('share/<int:post_id>/', views.share_post, name='share_post'),
     path('like/<int:post_id>/', views.like_post, name='like_post'),
+    path('unlike/<int:post_id>/', views.unlike_post, name='unlike_post'),
     path('comment/add/<int:post_id>/', views.add_comment, name='add_comment'),
     path('comment/edit/<int:comment_id>/', views.edit_comment, name='edit_comment'),
     path('comment/delete/<int:comment_id>/', views.delete_comment, name='delete_comment'),
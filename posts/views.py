@@ -1,59 +1,233 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from .models import Post, Comment, Like
 from .forms import PostForm, CommentForm
-from django.db.models import Q
-from .models import Category, Tag, Report, Block
+from .models import Category, Tag, Report, Block, slugify_tag
 from users.models import Follow
+from users.relationships import arelationships
 from users.views import send_like_notification, send_comment_notification, send_follow_notification
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_GET, require_POST
 from django.contrib import messages
 from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from core import images
+from core.pagination import KeysetPage, apaginate_keyset, paginate_keyset
+from core.shortcuts import arender, auser
+from . import cards, live, moderation, ranking, search, timeline, visibility
 
 User = get_user_model()
 
 # Create your views here.
 
+def _page_number(request):
+    try:
+        return max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
 # Home feed view with search and filtering
+# Async: the page of posts, the categories and the trending tags are
+# independent, so they are fetched concurrently
+
+async def _search_page(viewer, excluded, query, category_id, tag_slug, page_number):
+    """One page of ranked search results; its next_cursor is the next page number"""
+    post_ids, has_next = await search.asearch_posts(
+        query, category_id, tag_slug,
+        offset=(page_number - 1) * settings.FEED_PAGE_SIZE,
+        limit=settings.FEED_PAGE_SIZE,
+    )
+    posts_by_id = await Post.objects.for_feed().visible_to(viewer, excluded).ain_bulk(post_ids)
+    posts = [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+    return KeysetPage(posts, page_number + 1 if has_next else None)
 
-def home_feed(request):
+async def _categories():
+    return [category async for category in Category.objects.all()]
+
+async def home_feed(request):
+    user = await auser(request)
     query = request.GET.get('q', '')
     category_id = request.GET.get('category', '')
+    if not category_id.isdigit():
+        # Ignore malformed ids instead of failing the query
+        category_id = ''
     tag_name = request.GET.get('tag', '')
-    
-    posts = Post.objects.all()
+    tag_slug = slugify_tag(tag_name)
+    sort = 'hot' if request.GET.get('sort') == 'hot' and not query else 'latest'
+    cursor = request.GET.get('cursor')
+    excluded = await visibility.aexcluded_user_ids(user)
     
     if query:
-        posts = posts.filter(
-            Q(text__icontains=query) | 
-            Q(user__username__icontains=query) |
-            Q(tags__name__icontains=query)
-        ).distinct()
-    
-    if category_id:
-        posts = posts.filter(category_id=category_id)
-    
-    if tag_name:
-        posts = posts.filter(tags__name=tag_name)
-    
-    posts = posts.order_by('-timestamp')
-    categories = Category.objects.all()
+        # Ranked full-text search, paginated by page number
+        page = _search_page(user, excluded, query, category_id, tag_slug, _page_number(request))
+    elif sort == 'hot':
+        # Precomputed ranking, refreshed by `manage.py compute_rankings`
+        page = ranking.ahot_posts(user, cursor, category_id=category_id, tag_slug=tag_slug, excluded=excluded)
+    else:
+        posts = Post.objects.for_feed().visible_to(user, excluded)
+        if category_id:
+            posts = posts.filter(category_id=category_id)
+        if tag_slug:
+            posts = posts.filter(tags__slug=tag_slug)
+        page = apaginate_keyset(posts, cursor, page_size=settings.FEED_PAGE_SIZE)
+    posts, categories, trending_tags = await asyncio.gather(
+        page,
+        _categories(),
+        ranking.atrending_tags(),
+    )
+    cards_html, liked_post_ids = await asyncio.gather(
+        cards.aattach_cards(posts),
+        cards.aliked_post_ids(user, posts),
+    )
     
-    return render(request, 'posts/feed.html', {
-        'posts': posts, 
+    return await arender(request, 'posts/feed.html', {
+        'posts': cards_html,
+        'liked_post_ids': liked_post_ids,
+        'next_cursor': None if query else posts.next_cursor,
+        'next_page': posts.next_cursor if query else None,
         'categories': categories,
         'query': query,
         'selected_category': category_id,
-        'selected_tag': tag_name
+        'selected_tag': tag_name,
+        'sort': sort,
+        'trending_tags': trending_tags,
+        'feed_mode': 'all',
+    })
+
+# Following timeline view
+@login_required
+def following_feed(request):
+    page = timeline.following_timeline(request.user, request.GET.get('cursor'))
+    return render(request, 'posts/feed.html', {
+        'posts': cards.attach_cards(page),
+        'liked_post_ids': cards.liked_post_ids(request.user, page),
+        'next_cursor': page.next_cursor,
+        'categories': Category.objects.all(),
+        'feed_mode': 'following',
     })
 
 # Post detail view
 
-def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all().order_by('timestamp')
+def _root_comments_queryset(post_id, viewer, excluded=None):
+    """Top-level comments ``viewer`` may see"""
+    return (
+        Comment.objects.filter(post_id=post_id).roots().visible_to(viewer, excluded)
+        .select_related('user').with_reply_counts()
+    )
+
+def _root_comments(post_id, cursor, viewer):
+    """A KeysetPage of top-level comments ``viewer`` may see, oldest first"""
+    comments = _root_comments_queryset(post_id, viewer)
+    return paginate_keyset(comments, cursor, page_size=settings.COMMENT_PAGE_SIZE, descending=False)
+
+def _comment_json(comment, user):
+    return {
+        'id': comment.id,
+        'parent_id': comment.parent_id,
+        'depth': comment.depth,
+        'username': comment.user.username,
+        'profile_url': reverse('profile', args=[comment.user.username]),
+        'text': comment.text,
+        'timestamp': comment.timestamp.isoformat(),
+        'reply_count': comment.reply_count,
+        'edit_url': reverse('edit_comment', args=[comment.id]) if comment.user_id == user.id else None,
+        'delete_url': reverse('delete_comment', args=[comment.id]) if comment.user_id == user.id else None,
+    }
+
+async def post_detail(request, post_id):
+    user = await auser(request)
+    post = await aget_object_or_404(Post.objects.for_feed(), id=post_id)
+    if not await visibility.acan_view_post(user, post.user_id, post.is_hidden):
+        raise Http404('No Post matches the given query.')
+    excluded = await visibility.aexcluded_user_ids(user)
+    comments, liked_post_ids = await asyncio.gather(
+        apaginate_keyset(
+            _root_comments_queryset(post.id, user, excluded), request.GET.get('cursor'),
+            page_size=settings.COMMENT_PAGE_SIZE, descending=False,
+        ),
+        cards.aliked_post_ids(user, [post]),
+    )
     comment_form = CommentForm()
-    return render(request, 'posts/post_detail.html', {'post': post, 'comments': comments, 'comment_form': comment_form})
+    return await arender(request, 'posts/post_detail.html', {
+        'post': post,
+        'comments': comments,
+        'next_cursor': comments.next_cursor,
+        'comment_form': comment_form,
+        'liked_post_ids': liked_post_ids,
+    })
+
+# Live like/comment counts and new-post notices as Server-Sent Events, for
+# the posts on screen (?posts=1,2,3; &new=1 for new-post notices)
+@require_GET
+async def post_stream(request):
+    user = await auser(request)
+    requested = [int(part) for part in request.GET.get('posts', '').split(',') if part.isdigit()]
+    excluded = await visibility.aexcluded_user_ids(user)
+    post_ids = [
+        post_id async for post_id in Post.objects.filter(id__in=requested[:settings.LIVE_UPDATES_MAX_POSTS])
+        .visible_to(user, excluded).values_list('id', flat=True)
+    ]
+    response = StreamingHttpResponse(
+        live.event_stream(user, post_ids, new_posts=request.GET.get('new') == '1'),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Comments as JSON: the next page of top-level comments, or a whole reply
+# thread (?thread=<comment id>) in one range query on the materialized path
+@require_GET
+def post_comments(request, post_id):
+    thread_id = request.GET.get('thread', '')
+    if thread_id:
+        if not thread_id.isdigit():
+            raise Http404('No Comment matches the given query.')
+        parent = get_object_or_404(
+            Comment.objects.select_related('post').only('id', 'post_id', 'path', 'post__user_id', 'post__is_hidden'),
+            id=thread_id, post_id=post_id,
+        )
+        if not visibility.can_view_post(request.user, parent.post.user_id, parent.post.is_hidden):
+            raise Http404('No Post matches the given query.')
+        limit = settings.COMMENT_THREAD_LIMIT
+        replies = list(
+            Comment.objects.subtree(parent).visible_to(request.user)
+            .select_related('user').with_reply_counts()[:limit + 1]
+        )
+        return JsonResponse({
+            'comments': [_comment_json(comment, request.user) for comment in replies[:limit]],
+            'truncated': len(replies) > limit,
+        })
+    row = Post.objects.filter(id=post_id).values_list('user_id', 'is_hidden').first()
+    if row is None or not visibility.can_view_post(request.user, *row):
+        raise Http404('No Post matches the given query.')
+    comments = _root_comments(post_id, request.GET.get('cursor'), request.user)
+    return JsonResponse({
+        'comments': [_comment_json(comment, request.user) for comment in comments],
+        'next_cursor': comments.next_cursor,
+    })
+
+def _attach_tags(post, names):
+    """Link a new post to its tags in a constant number of queries"""
+    tags = Tag.objects.resolve(names)
+    if not tags:
+        return
+    Through = Post.tags.through
+    Through.objects.bulk_create([Through(post_id=post.id, tag_id=tag.id) for tag in tags], ignore_conflicts=True)
+    Tag.objects.bump([tag.id for tag in tags], 1)
+    # A bulk insert into the through table bypasses m2m_changed, so do what
+    # its receiver would have done
+    search.index_posts([post.id])
+    cards.invalidate_posts([post.id])
 
 # Create post view
 @login_required
@@ -61,17 +235,14 @@ def create_post(request):
     if request.method == 'POST':
         form = PostForm(request.POST, request.FILES)
         if form.is_valid():
-            post = form.save(commit=False)
-            post.user = request.user
-            post.save()
-            
-            # Handle tags
-            tag_names = form.cleaned_data.get('tags', [])
-            for tag_name in tag_names:
-                tag, created = Tag.objects.get_or_create(name=tag_name.lower())
-                post.tags.add(tag)
-            
-            form.save_m2m()
+            with transaction.atomic():
+                post = form.save(commit=False)
+                post.user = request.user
+                post.save()
+                _attach_tags(post, form.cleaned_data.get('tags', []))
+            if post.image:
+                images.schedule(post, 'image', 'image_renditions', 'post')
+            timeline.fan_out_post(post)
             return redirect('home_feed')
     else:
         form = PostForm()
@@ -89,54 +260,86 @@ def share_post(request, post_id):
             shared_from=original_post,
             is_shared=True
         )
+        Post.objects.bump(original_post.id, share_count=1)
+        timeline.fan_out_post(shared_post)
         return redirect('home_feed')
     
     return render(request, 'posts/share_post.html', {'original_post': original_post})
 
 # Search users view
-def search_users(request):
+async def search_users(request):
+    user = await auser(request)
     query = request.GET.get('q', '')
     users = []
+    next_page = None
     
     if query:
-        users = User.objects.filter(username__icontains=query).exclude(id=request.user.id)
+        page_number = _page_number(request)
+        user_ids, has_next = await search.asearch_users(
+            query,
+            exclude_id=user.id,
+            offset=(page_number - 1) * settings.FEED_PAGE_SIZE,
+            limit=settings.FEED_PAGE_SIZE,
+        )
+        excluded = await visibility.aexcluded_user_ids(user)
+        users_by_id = await visibility.visible_users(User.objects.select_related('profile'), user, excluded).ain_bulk(user_ids)
+        users = [users_by_id[user_id] for user_id in user_ids if user_id in users_by_id]
+        if has_next:
+            next_page = page_number + 1
     
-    return render(request, 'users/search_users.html', {'users': users, 'query': query})
+    return await arender(request, 'users/search_users.html', {
+        'users': users,
+        'relationships': await arelationships(user, users),
+        'query': query,
+        'next_page': next_page,
+    })
 
 # Follow user view
 @login_required
 def follow_user(request, user_id):
     user_to_follow = get_object_or_404(User, id=user_id)
     
-    if request.user != user_to_follow:
+    if request.user != user_to_follow and user_to_follow.id not in visibility.excluded_user_ids(request.user):
         follow, created = Follow.objects.get_or_create(
             follower=request.user,
             following=user_to_follow
         )
         if created:
+            timeline.add_follow(request.user, user_to_follow)
             # Send follow notification email
             send_follow_notification(request.user, user_to_follow)
         else:
             follow.delete()
+            timeline.remove_follow(request.user, user_to_follow)
     
+    next_url = request.GET.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
     return redirect('search_users')
 
 # Report user/post view
 @login_required
 def report_user(request, user_id):
     reported_user = get_object_or_404(User, id=user_id)
+    # Reporting one of the user's posts (?post=<id>) rather than the user
+    post_id = request.POST.get('post') or request.GET.get('post')
+    post = get_object_or_404(Post, id=post_id, user=reported_user) if post_id and post_id.isdigit() else None
     
     if request.method == 'POST':
-        Report.objects.create(
-            reporter=request.user,
-            reported_user=reported_user,
-            reason=request.POST.get('reason'),
-            description=request.POST.get('description', '')
-        )
-        messages.success(request, 'Report submitted successfully.')
-        return redirect('search_users')
+        reason = request.POST.get('reason')
+        if reason not in dict(Report.REPORT_CHOICES):
+            messages.error(request, 'Please select a reason.')
+        else:
+            report = moderation.file_report(
+                request.user, reported_user.id, reason, request.POST.get('description', ''), post_id=post and post.id,
+            )
+            if report:
+                messages.success(request, 'Report submitted successfully.')
+            else:
+                messages.info(request, 'You have already reported this.')
+            return redirect('search_users')
     
-    return render(request, 'users/report_user.html', {'reported_user': reported_user})
+    return render(request, 'users/report_user.html', {'reported_user': reported_user, 'post': post})
 
 # Block user view
 @login_required
@@ -148,25 +351,41 @@ def block_user(request, user_id):
             blocker=request.user,
             blocked_user=user_to_block
         )
-        if not created:
+        if created:
+            # A block also ends any follow between the two users
+            for follow in Follow.objects.filter(
+                Q(follower=request.user, following=user_to_block) | Q(follower=user_to_block, following=request.user)
+            ):
+                follow.delete()
+                timeline.remove_follow(follow.follower, follow.following)
+        else:
             block.delete()
     
     return redirect('search_users')
 
 # Like/unlike post (AJAX)
+# Both verbs are idempotent: liking twice or unliking a post you never liked
+# just reports the current state.
 @login_required
-def like_post(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    liked = False
-    like_obj = Like.objects.filter(post=post, user=request.user)
-    if like_obj.exists():
-        like_obj.delete()
-    else:
-        Like.objects.create(post=post, user=request.user)
-        liked = True
+@require_POST
+async def like_post(request, post_id):
+    user = await auser(request)
+    result = await Like.objects.alike(post_id, user.id)
+    if result is None:
+        raise Http404('No Post matches the given query.')
+    if result.changed:
         # Send like notification email
-        send_like_notification(post, request.user)
-    return JsonResponse({'liked': liked, 'like_count': post.likes.count()})
+        await sync_to_async(send_like_notification)(Post(id=post_id, user_id=result.author_id), user)
+    return JsonResponse({'liked': result.liked, 'like_count': result.like_count})
+
+@login_required
+@require_POST
+async def unlike_post(request, post_id):
+    user = await auser(request)
+    result = await Like.objects.aunlike(post_id, user.id)
+    if result is None:
+        raise Http404('No Post matches the given query.')
+    return JsonResponse({'liked': result.liked, 'like_count': result.like_count})
 
 # Add comment
 @login_required
@@ -178,9 +397,13 @@ def add_comment(request, post_id):
             comment = form.save(commit=False)
             comment.user = request.user
             comment.post = post
+            parent_id = request.POST.get('parent', '')
+            if parent_id.isdigit():
+                comment.parent = Comment.objects.filter(id=parent_id, post=post).first()
             comment.save()
+            Post.objects.bump(post.id, comment_count=1)
             # Send comment notification email
-            send_comment_notification(post, request.user)
+            send_comment_notification(post, request.user, comment)
     return redirect('post_detail', post_id=post_id)
 
 # Edit comment
@@ -200,6 +423,8 @@ def edit_comment(request, comment_id):
 @login_required
 def delete_comment(request, comment_id):
     comment = get_object_or_404(Comment, id=comment_id, user=request.user)
-    post_id = comment.post.id
-    comment.delete()
+    post_id = comment.post_id
+    # Replies are deleted along with the comment
+    _, deleted = comment.delete()
+    Post.objects.bump(post_id, comment_count=-deleted.get(Comment._meta.label, 1))
     return redirect('post_detail', post_id=post_id)
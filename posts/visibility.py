@@ -0,0 +1,194 @@
+"""
+Who may see whose content.
+
+A viewer never sees users they blocked or who blocked them. Authors can
+limit their posts with ``Settings.privacy``:
+
+* ``public``: everyone
+* ``friends``: their followers
+* ``private``: only themselves
+
+With ``Settings.profile_visible`` off, the profile is hidden from search
+and from other users. Posts hidden by moderation (``Post.is_hidden``, see
+posts.moderation) are only shown to their author.
+
+Listings apply these rules in SQL (``Post.objects.visible_to(viewer)``,
+``Comment.objects.visible_to(viewer)``, ``visible_users()``). Blocks become
+NOT EXISTS anti-joins on the two Block indexes. Each one is a single index
+probe per row, whether the viewer has no blocks or ten thousand. The
+viewer's exclusion set (users blocked in either direction) is computed once
+and cached. Listings use it only to skip the anti-joins when it is empty,
+which is the common case. Single-object checks test membership in it
+directly. Receivers in ``posts.signals`` invalidate the cache on Block and
+Settings changes.
+
+The ``a``-prefixed functions are the async versions used by the async views
+(async ORM and cache API). Those views look the exclusion set up once and
+pass it as ``excluded`` to the filters, so building a queryset never runs a
+synchronous query.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+from users.models import Follow, Settings
+from .models import Block
+
+
+def blocks_key(user_id):
+    return f'visibility:blocks:{user_id}'
+
+
+def audience_key(user_id):
+    return f'visibility:audience:{user_id}'
+
+
+def _blocked_either_way(user_id):
+    return Block.objects.filter(blocker=user_id).values_list('blocked_user', flat=True).union(
+        Block.objects.filter(blocked_user=user_id).values_list('blocker', flat=True)
+    )
+
+
+def excluded_user_ids(viewer):
+    """Ids of the users ``viewer`` blocked or was blocked by (cached)"""
+    if not viewer.is_authenticated:
+        return frozenset()
+    excluded = cache.get(blocks_key(viewer.id))
+    if excluded is None:
+        excluded = frozenset(_blocked_either_way(viewer.id))
+        cache.set(blocks_key(viewer.id), excluded, settings.VISIBILITY_CACHE_SECONDS)
+    return excluded
+
+
+async def aexcluded_user_ids(viewer):
+    if not viewer.is_authenticated:
+        return frozenset()
+    excluded = await cache.aget(blocks_key(viewer.id))
+    if excluded is None:
+        excluded = frozenset([user_id async for user_id in _blocked_either_way(viewer.id)])
+        await cache.aset(blocks_key(viewer.id), excluded, settings.VISIBILITY_CACHE_SECONDS)
+    return excluded
+
+
+def _audience_query(user_id):
+    return Settings.objects.filter(user=user_id).values_list('privacy', 'profile_visible')
+
+
+def audience(user_id):
+    """``(privacy, profile_visible)`` of a user (cached)"""
+    value = cache.get(audience_key(user_id))
+    if value is None:
+        value = _audience_query(user_id).first() or ('public', True)
+        cache.set(audience_key(user_id), value, settings.VISIBILITY_CACHE_SECONDS)
+    return value
+
+
+async def aaudience(user_id):
+    value = await cache.aget(audience_key(user_id))
+    if value is None:
+        value = await _audience_query(user_id).afirst() or ('public', True)
+        await cache.aset(audience_key(user_id), value, settings.VISIBILITY_CACHE_SECONDS)
+    return value
+
+
+def invalidate_blocks(*user_ids):
+    cache.delete_many([blocks_key(user_id) for user_id in user_ids])
+
+
+def invalidate_audience(user_id):
+    cache.delete(audience_key(user_id))
+
+
+def block_filter(viewer, field, excluded=None):
+    """Q excluding rows whose ``field`` user is blocked in either direction"""
+    if excluded is None:
+        excluded = excluded_user_ids(viewer)
+    if not excluded:
+        return Q()
+    return ~Exists(Block.objects.filter(blocker=viewer.id, blocked_user=OuterRef(field))) & ~Exists(
+        Block.objects.filter(blocker=OuterRef(field), blocked_user=viewer.id)
+    )
+
+
+def hidden_filter(viewer, field):
+    """Q dropping posts hidden by moderation, except for ``viewer``'s own (``field`` is the author)"""
+    shown = Q(is_hidden=False)
+    if viewer.is_authenticated:
+        shown |= Q(**{field: viewer.id})
+    return shown
+
+
+def privacy_filter(viewer, field):
+    """Q keeping rows whose ``field`` user shares their posts with ``viewer``"""
+    public = Q(**{f'{field}__settings__privacy': 'public'}) | Q(**{f'{field}__settings__isnull': True})
+    if not viewer.is_authenticated:
+        return public
+    followers_only = Q(**{f'{field}__settings__privacy': 'friends'}) & Exists(
+        Follow.objects.filter(follower=viewer.id, following=OuterRef(field))
+    )
+    return public | followers_only | Q(**{field: viewer.id})
+
+
+def visible_users(queryset, viewer, excluded=None, field='id'):
+    """
+    Rows whose ``field`` user ``viewer`` may find: not blocked and with a
+    visible profile. ``queryset`` is of users by default, or e.g. of Follow
+    rows with ``field='follower'``.
+    """
+    prefix = '' if field == 'id' else f'{field}__'
+    shown = Q(**{f'{prefix}settings__profile_visible': True}) | Q(**{f'{prefix}settings__isnull': True})
+    if viewer.is_authenticated:
+        shown |= Q(**{field: viewer.id})
+    return queryset.filter(shown).filter(block_filter(viewer, field, excluded))
+
+
+def can_view_profile(viewer, user_id):
+    if viewer.is_authenticated and viewer.id == user_id:
+        return True
+    return user_id not in excluded_user_ids(viewer) and audience(user_id)[1]
+
+
+async def acan_view_profile(viewer, user_id):
+    if viewer.is_authenticated and viewer.id == user_id:
+        return True
+    return user_id not in await aexcluded_user_ids(viewer) and (await aaudience(user_id))[1]
+
+
+def can_view_posts(viewer, user_id):
+    """Whether ``viewer`` may see posts by ``user_id``"""
+    if viewer.is_authenticated and viewer.id == user_id:
+        return True
+    if user_id in excluded_user_ids(viewer):
+        return False
+    privacy = audience(user_id)[0]
+    if privacy == 'public':
+        return True
+    if privacy == 'friends' and viewer.is_authenticated:
+        return Follow.objects.filter(follower=viewer.id, following=user_id).exists()
+    return False
+
+
+async def acan_view_posts(viewer, user_id):
+    if viewer.is_authenticated and viewer.id == user_id:
+        return True
+    if user_id in await aexcluded_user_ids(viewer):
+        return False
+    privacy = (await aaudience(user_id))[0]
+    if privacy == 'public':
+        return True
+    if privacy == 'friends' and viewer.is_authenticated:
+        return await Follow.objects.filter(follower=viewer.id, following=user_id).aexists()
+    return False
+
+
+def can_view_post(viewer, author_id, is_hidden):
+    """Whether ``viewer`` may see one post, hidden by moderation or not"""
+    if is_hidden and not (viewer.is_authenticated and viewer.id == author_id):
+        return False
+    return can_view_posts(viewer, author_id)
+
+
+async def acan_view_post(viewer, author_id, is_hidden):
+    if is_hidden and not (viewer.is_authenticated and viewer.id == author_id):
+        return False
+    return await acan_view_posts(viewer, author_id)
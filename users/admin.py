@@ -1,8 +1,15 @@
 from django.contrib import admin
-from .models import Profile, Settings, Follow
+from .models import Profile, Settings, Follow, OutboundEmail
 
 # Register your models here.
 
 admin.site.register(Profile)
 admin.site.register(Settings)
 admin.site.register(Follow)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'recipient', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status', 'kind')
+    list_select_related = ('recipient',)
+    raw_id_fields = ('recipient', 'actor', 'post')
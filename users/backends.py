@@ -0,0 +1,15 @@
+from django.contrib.auth.backends import ModelBackend
+
+from . import context
+
+
+class UserContextBackend(ModelBackend):
+    """ModelBackend that loads the signed-in user from the user context cache (with Profile and Settings)"""
+
+    def get_user(self, user_id):
+        ctx = context.load(user_id)
+        return ctx.user if ctx and self.user_can_authenticate(ctx.user) else None
+
+    async def aget_user(self, user_id):
+        ctx = await context.aload(user_id)
+        return ctx.user if ctx and self.user_can_authenticate(ctx.user) else None
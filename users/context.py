@@ -0,0 +1,160 @@
+"""
+Users together with their Profile and Settings ("user contexts").
+
+A context is loaded with one ``select_related`` query and cached under
+``usercontext:<user id>`` for USER_CONTEXT_CACHE_SECONDS. It is shared by
+every request the cache backend is shared by. Receivers in
+``users.signals`` drop a user's entry whenever their User, Profile or
+Settings row is saved or deleted, and ``Profile.objects.bump`` does so on
+counter changes. The TTL only bounds staleness between processes when the
+cache is per process (the default LocMemCache).
+
+The signed-in user comes from the same cache (``users.backends``), so
+``request.user.profile`` and ``request.user.settings`` cost no query.
+Other users are looked up through the request's loader, which remembers
+every context it returned, so repeated lookups of one user within a
+request hit neither the database nor the cache::
+
+    author = user_contexts(request).get_by_username(username)
+
+Listings that render many users already join their Profile in the listing
+query; ``load_many`` covers the remaining batch lookups.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+UserContext = namedtuple('UserContext', ['user', 'profile', 'settings'])
+
+
+def context_key(user_id):
+    return f'usercontext:{user_id}'
+
+
+def username_key(username):
+    return f'usercontext:name:{username}'
+
+
+def _context(user):
+    return UserContext(user, getattr(user, 'profile', None), getattr(user, 'settings', None))
+
+
+def _users():
+    return User.objects.select_related('profile', 'settings')
+
+
+def _store(contexts):
+    entries = {context_key(ctx.user.id): ctx for ctx in contexts}
+    entries.update({username_key(ctx.user.username): ctx.user.id for ctx in contexts})
+    cache.set_many(entries, settings.USER_CONTEXT_CACHE_SECONDS)
+
+
+async def _astore(contexts):
+    entries = {context_key(ctx.user.id): ctx for ctx in contexts}
+    entries.update({username_key(ctx.user.username): ctx.user.id for ctx in contexts})
+    await cache.aset_many(entries, settings.USER_CONTEXT_CACHE_SECONDS)
+
+
+def load_many(user_ids):
+    """``{user id: UserContext}`` for the users that exist; one query for the cache misses"""
+    user_ids = set(user_ids)
+    cached = cache.get_many([context_key(user_id) for user_id in user_ids])
+    contexts = {ctx.user.id: ctx for ctx in cached.values()}
+    missing = user_ids - contexts.keys()
+    if missing:
+        loaded = [_context(user) for user in _users().filter(id__in=missing)]
+        _store(loaded)
+        contexts.update((ctx.user.id, ctx) for ctx in loaded)
+    return contexts
+
+
+async def aload_many(user_ids):
+    user_ids = set(user_ids)
+    cached = await cache.aget_many([context_key(user_id) for user_id in user_ids])
+    contexts = {ctx.user.id: ctx for ctx in cached.values()}
+    missing = user_ids - contexts.keys()
+    if missing:
+        loaded = [_context(user) async for user in _users().filter(id__in=missing)]
+        await _astore(loaded)
+        contexts.update((ctx.user.id, ctx) for ctx in loaded)
+    return contexts
+
+
+def load(user_id):
+    """The UserContext of ``user_id``, or None"""
+    return load_many([user_id]).get(user_id)
+
+
+async def aload(user_id):
+    return (await aload_many([user_id])).get(user_id)
+
+
+def invalidate(*user_ids):
+    cache.delete_many([context_key(user_id) for user_id in user_ids])
+
+
+def invalidate_changed(user_id):
+    """Drop a context whose rows are being written: now, so the writer reads its own writes, and again on commit"""
+    invalidate(user_id)
+    transaction.on_commit(lambda: invalidate(user_id))
+
+
+class UserContextLoader:
+    """The user contexts one request has asked for"""
+
+    def __init__(self):
+        self._contexts = {}
+
+    def get(self, user_id):
+        """The UserContext of ``user_id``, or None"""
+        if user_id not in self._contexts:
+            self._contexts[user_id] = load(user_id)
+        return self._contexts[user_id]
+
+    async def aget(self, user_id):
+        if user_id not in self._contexts:
+            self._contexts[user_id] = await aload(user_id)
+        return self._contexts[user_id]
+
+    def _remember(self, ctx):
+        self._contexts[ctx.user.id] = ctx
+        return ctx
+
+    def get_by_username(self, username):
+        """The UserContext of the user called ``username``, or None"""
+        user_id = cache.get(username_key(username))
+        if user_id is not None:
+            ctx = self.get(user_id)
+            # The alias outlives a rename until its TTL
+            if ctx is not None and ctx.user.username == username:
+                return ctx
+        user = _users().filter(username=username).first()
+        if user is None:
+            return None
+        ctx = _context(user)
+        _store([ctx])
+        return self._remember(ctx)
+
+    async def aget_by_username(self, username):
+        user_id = await cache.aget(username_key(username))
+        if user_id is not None:
+            ctx = await self.aget(user_id)
+            if ctx is not None and ctx.user.username == username:
+                return ctx
+        user = await _users().filter(username=username).afirst()
+        if user is None:
+            return None
+        ctx = _context(user)
+        await _astore([ctx])
+        return self._remember(ctx)
+
+
+def user_contexts(request):
+    """The request's UserContextLoader"""
+    loader = getattr(request, '_user_contexts', None)
+    if loader is None:
+        loader = request._user_contexts = UserContextLoader()
+    return loader
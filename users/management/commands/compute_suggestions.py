@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.suggestions import compute_suggestions, scipy_available
+
+
+class Command(BaseCommand):
+    help = "Rescore \"people you may know\" follow suggestions for every user"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep recomputing instead of exiting')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between runs with --loop')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users scored and written per batch')
+        parser.add_argument(
+            '--engine', choices=['auto', 'scipy', 'python'], default='auto',
+            help='Sparse matrices (needs numpy and scipy) or plain Python; auto picks scipy when installed',
+        )
+
+    def handle(self, *args, **options):
+        if options['engine'] == 'scipy' and not scipy_available():
+            raise CommandError('The scipy engine needs numpy and scipy (pip install numpy scipy)')
+        use_scipy = None if options['engine'] == 'auto' else options['engine'] == 'scipy'
+        while True:
+            started = time.perf_counter()
+            users, suggestions, engine = compute_suggestions(batch_size=options['batch_size'], use_scipy=use_scipy)
+            self.stdout.write(
+                f'Wrote {suggestions} suggestions for {users} users in {time.perf_counter() - started:.1f}s ({engine}).'
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
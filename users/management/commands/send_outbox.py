@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued notification emails, coalescing bursts and retrying failures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between polls with --loop')
+        parser.add_argument('--batch-size', type=int, default=500, help='Maximum due emails per batch')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = process_outbox(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} emails, {failed} failed.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:18
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    Follow = apps.get_model('users', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+
+    def count(model, field):
+        rows = (
+            model.objects.filter(**{field: OuterRef('user_id')})
+            .order_by().values(field).annotate(total=Count('pk')).values('total')
+        )
+        return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+    Profile.objects.update(
+        post_count=count(Post, 'user'),
+        follower_count=count(Follow, 'following'),
+        following_count=count(Follow, 'follower'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_image_renditions'),
+        ('users', '0005_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
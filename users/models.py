@@ -1,12 +1,37 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest, Now
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import context
 
 # Create your models here.
 
+class ProfileQuerySet(models.QuerySet):
+    def bump(self, user_id, **deltas):
+        """Atomically adjust counter columns, e.g. ``bump(user.id, follower_count=1)``"""
+        updated = self.filter(user_id=user_id).update(
+            **{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()}, updated_at=Now(),
+        )
+        context.invalidate_changed(user_id)
+        return updated
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(blank=True)
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    # Filled in by core.images once the upload has been processed
+    avatar_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Header stats, kept up to date by signals (see reconcile_counters)
+    post_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Changes with anything the profile's JSON shows (the API's ETag and
+    # Last-Modified), including the username and avatar
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProfileQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.username} Profile"
@@ -18,6 +43,11 @@ class Follow(models.Model):
     
     class Meta:
         unique_together = ('follower', 'following')
+        indexes = [
+            # Follower and following lists, newest first (keyset pages on created_at, id)
+            models.Index(fields=['following', '-created_at', '-id'], name='follow_followers_recent'),
+            models.Index(fields=['follower', '-created_at', '-id'], name='follow_following_recent'),
+        ]
     
     def __str__(self):
         return f"{self.follower.username} follows {self.following.username}"
@@ -36,3 +66,57 @@ class Settings(models.Model):
 
     def __str__(self):
         return f"{self.user.username} Settings"
+
+NOTIFICATION_KINDS = [
+    ('welcome', 'Welcome'),
+    ('like', 'Like'),
+    ('comment', 'Comment'),
+    ('follow', 'Follow'),
+]
+
+OUTBOX_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('sending', 'Sending'),
+    ('sent', 'Sent'),
+    ('skipped', 'Skipped'),
+    ('failed', 'Failed'),
+]
+
+class OutboundEmail(models.Model):
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='outbound_emails')
+    kind = models.CharField(max_length=10, choices=NOTIFICATION_KINDS)
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    post = models.ForeignKey('posts.Post', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    excerpt = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=OUTBOX_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    # Token of the send_outbox run that is sending the row (status 'sending')
+    claim = models.CharField(max_length=32, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='outbox_due'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} email to {self.recipient_id} ({self.status})"
+
+class FollowSuggestion(models.Model):
+    """One "people you may know" entry, rewritten by `manage.py compute_suggestions`"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follow_suggestions')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    # Accounts the user follows that follow ``suggested``
+    mutual_count = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'rank')
+
+    def __str__(self):
+        return f"Suggest {self.suggested_id} to {self.user_id} (#{self.rank})"
@@ -0,0 +1,244 @@
+"""
+Database-backed outbox for notification emails.
+
+Views only insert OutboundEmail rows; the ``send_outbox`` management command
+drains them. Notifications of the same kind about the same thing (likes on
+one post, new followers of one user...) that pile up before the worker runs
+are coalesced into a single email, and every batch goes out over one SMTP
+connection. Failed sends are retried with exponential backoff.
+
+Several workers can drain the outbox at once: each claims the rows it is
+about to send (status 'sending' plus its own ``claim`` token) with a
+conditional UPDATE, and only sends the rows it got. Claims expire after
+OUTBOX_CLAIM_SECONDS, so the rows of a worker that died are sent again.
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+# Notifications of these kinds are held back so bursts can be merged
+COALESCED_KINDS = ('like', 'comment', 'follow')
+
+
+def enqueue(kind, recipient_id, actor=None, post_id=None, excerpt=''):
+    """Queue a notification email; this is a single INSERT"""
+    delay = settings.OUTBOX_COALESCE_SECONDS if kind in COALESCED_KINDS else 0
+    return OutboundEmail.objects.create(
+        kind=kind,
+        recipient_id=recipient_id,
+        actor=actor,
+        post_id=post_id,
+        excerpt=excerpt,
+        send_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def group_key(email):
+    if email.kind in COALESCED_KINDS:
+        return (email.recipient_id, email.kind, email.post_id)
+    return ('single', email.id)
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retry number ``attempts``"""
+    return min(settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX_SECONDS)
+
+
+def _actor_summary(actors):
+    names = []
+    for actor in actors:
+        if actor.username not in names:
+            names.append(actor.username)
+    if len(names) <= 1:
+        return ''.join(names), len(names)
+    if len(names) == 2:
+        return f'{names[0]} and {names[1]}', 2
+    return f'{names[0]}, {names[1]} and {len(names) - 2} others', len(names)
+
+
+def _post_snippet(post):
+    return f"{post.text[:50]}{'...' if len(post.text) > 50 else ''}"
+
+
+def build_message(emails):
+    """Render one EmailMessage for a group of queued notifications"""
+    first = emails[0]
+    recipient = first.recipient
+    site_url = settings.SITE_URL
+    actors, count = _actor_summary([email.actor for email in emails if email.actor])
+
+    if first.kind == 'welcome':
+        subject = 'Welcome to SocialHub!'
+        body = f"""
+            Welcome to SocialHub, {recipient.username}!
+
+            Thank you for joining our community. Here's what you can do:
+            - Create and share posts with images
+            - Follow other users
+            - Like and comment on posts
+            - Search for users and content
+            - Customize your profile and privacy settings
+
+            Get started by creating your first post!
+
+            Best regards,
+            The SocialHub Team
+            """
+    elif first.kind == 'like':
+        subject = f'{actors} liked your post' if count == 1 else f'{count} people liked your post'
+        body = f"""
+        Hi {recipient.username},
+
+        {actors} just liked your post: "{_post_snippet(first.post)}"
+
+        View your post: {site_url}/posts/post/{first.post_id}/
+
+        Best regards,
+        SocialHub Team
+        """
+    elif first.kind == 'comment':
+        subject = (
+            f'{actors} commented on your post' if len(emails) == 1
+            else f'{len(emails)} new comments on your post'
+        )
+        comments = '\n        '.join(
+            f'{email.actor.username}: "{email.excerpt}"' for email in emails if email.actor
+        )
+        body = f"""
+        Hi {recipient.username},
+
+        {actors} just commented on your post: "{_post_snippet(first.post)}"
+
+        {comments}
+
+        View your post: {site_url}/posts/post/{first.post_id}/
+
+        Best regards,
+        SocialHub Team
+        """
+    else:
+        subject = f'{actors} started following you' if count == 1 else f'{count} people started following you'
+        profile_link = (
+            f'View their profile: {site_url}/users/profile/{emails[0].actor.username}/' if count == 1
+            else f'View your profile: {site_url}/users/profile/{recipient.username}/'
+        )
+        body = f"""
+        Hi {recipient.username},
+
+        {actors} just started following you on SocialHub!
+
+        {profile_link}
+
+        Best regards,
+        SocialHub Team
+        """
+    return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient.email])
+
+
+def _wants_email(email):
+    if email.kind == 'welcome':
+        return bool(email.recipient.email)
+    user_settings = getattr(email.recipient, 'settings', None)
+    return bool(email.recipient.email) and (user_settings is None or user_settings.email_notifications)
+
+
+def _record_failure(emails, error, now):
+    # Rows that joined the burst later have fewer attempts; the group retries together
+    attempts = max(email.attempts for email in emails) + 1
+    OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+        attempts=F('attempts') + 1,
+        status=Case(
+            When(attempts__gte=settings.OUTBOX_MAX_ATTEMPTS - 1, then=Value('failed')), default=Value('pending'),
+        ),
+        send_after=now + timedelta(seconds=backoff_delay(attempts)),
+        last_error=str(error)[:1000],
+    )
+
+
+def _claim(token, email_ids, now):
+    """Claim the pending rows among ``email_ids`` for this run; returns the ids it holds"""
+    OutboundEmail.objects.filter(id__in=email_ids, status='pending').update(
+        status='sending', claim=token, send_after=now + timedelta(seconds=settings.OUTBOX_CLAIM_SECONDS),
+    )
+    return set(OutboundEmail.objects.filter(id__in=email_ids, claim=token).values_list('id', flat=True))
+
+
+def process_outbox(batch_size=500, connection=None):
+    """
+    Send every due notification, returning ``(sent, failed)`` email counts.
+
+    All messages go out over ``connection`` (or one fresh connection from
+    ``get_connection()``), opened once for the whole batch.
+    """
+    now = timezone.now()
+    # Claims of workers that stopped before finishing
+    OutboundEmail.objects.filter(status='sending', send_after__lte=now).update(status='pending')
+    due = list(
+        OutboundEmail.objects.filter(status='pending', send_after__lte=now)
+        .order_by('send_after', 'id')
+        .values_list('id', 'recipient_id')[:batch_size]
+    )
+    if not due:
+        return 0, 0
+    token = uuid.uuid4().hex
+    claimed = _claim(token, [email_id for email_id, _ in due], now)
+    if not claimed:
+        return 0, 0
+
+    # Sweep up not-yet-due rows that belong to the same bursts as the due ones
+    pending = (
+        OutboundEmail.objects.filter(
+            Q(status='pending') | Q(claim=token), recipient_id__in={recipient for _, recipient in due},
+        )
+        .select_related('recipient__settings', 'actor', 'post')
+        .order_by('created_at', 'id')
+    )
+    groups = defaultdict(list)
+    for email in pending:
+        groups[group_key(email)].append(email)
+    groups = [emails for emails in groups.values() if any(email.id in claimed for email in emails)]
+    swept = [email.id for emails in groups for email in emails if email.id not in claimed]
+    if swept:
+        claimed |= _claim(token, swept, now)
+    groups = [[email for email in emails if email.id in claimed] for emails in groups]
+
+    skipped = []
+    outgoing = []
+    for emails in groups:
+        if _wants_email(emails[0]):
+            outgoing.append(emails)
+        else:
+            skipped += [email.id for email in emails]
+    if skipped:
+        OutboundEmail.objects.filter(id__in=skipped).update(status='skipped')
+
+    sent = failed = 0
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        for emails in outgoing:
+            _record_failure(emails, error, now)
+        return 0, len(outgoing)
+    try:
+        for emails in outgoing:
+            try:
+                connection.send_messages([build_message(emails)])
+            except Exception as error:
+                _record_failure(emails, error, now)
+                failed += 1
+            else:
+                OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+                    status='sent', sent_at=timezone.now(), attempts=F('attempts') + 1,
+                )
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
@@ -0,0 +1,51 @@
+"""
+The viewer's follow relationships to a page of listed users.
+
+Lists of users (search results, followers, following) show per row whether
+the viewer follows that user and whether the user follows the viewer. Both
+come from one UNION query over the two Follow indexes for the whole page,
+rather than a query per row. Blocked users never appear in these lists
+(posts.visibility filters them out), so there is no block state to show.
+"""
+from collections import namedtuple
+
+from django.db.models import Value
+
+from .models import Follow
+
+Relationships = namedtuple('Relationships', ['following', 'followers'])
+
+NONE = Relationships(frozenset(), frozenset())
+
+
+def _query(viewer, user_ids):
+    return (
+        Follow.objects.filter(follower=viewer.id, following__in=user_ids)
+        .annotate(kind=Value('following')).values_list('following_id', 'kind')
+        .union(
+            Follow.objects.filter(following=viewer.id, follower__in=user_ids)
+            .annotate(kind=Value('follower')).values_list('follower_id', 'kind'),
+            all=True,
+        )
+    )
+
+
+def _collect(rows):
+    following = frozenset(user_id for user_id, kind in rows if kind == 'following')
+    followers = frozenset(user_id for user_id, kind in rows if kind == 'follower')
+    return Relationships(following, followers)
+
+
+def relationships(viewer, users):
+    """Relationships of ``viewer`` to ``users``: the ids they follow and the ids following them"""
+    user_ids = [user.id for user in users]
+    if not viewer.is_authenticated or not user_ids:
+        return NONE
+    return _collect(list(_query(viewer, user_ids)))
+
+
+async def arelationships(viewer, users):
+    user_ids = [user.id for user in users]
+    if not viewer.is_authenticated or not user_ids:
+        return NONE
+    return _collect([row async for row in _query(viewer, user_ids)])
@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import context
+from .models import Follow, Profile, Settings
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.objects.bump(instance.follower_id, following_count=1)
+        Profile.objects.bump(instance.following_id, follower_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    Profile.objects.bump(instance.follower_id, following_count=-1)
+    Profile.objects.bump(instance.following_id, follower_count=-1)
+
+
+# User contexts
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    context.invalidate_changed(instance.id)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_save, sender=Settings)
+@receiver(post_delete, sender=Settings)
+def user_context_changed(sender, instance, **kwargs):
+    context.invalidate_changed(instance.user_id)
@@ -0,0 +1,242 @@
+"""
+"People you may know": follow suggestions computed offline.
+
+``compute_suggestions`` (run periodically with ``manage.py
+compute_suggestions``) loads the Follow graph and the likes each user gave
+to each author into flat integer arrays. It scores candidate accounts for
+every active user and rewrites their FollowSuggestion rows with the
+SUGGESTIONS_PER_USER best ones. A candidate C scores for user A::
+
+    sum over the accounts B that A follows and that follow C of 1 / log(2 + following(B))
+    + LIKE_WEIGHT * log(1 + likes A gave to C's posts)
+
+Accounts following more than SUGGESTIONS_MAX_FOLLOWING others say little
+about any one of them, so they are skipped as the middle account B. That
+also bounds the work per user. Inactive accounts are left out of the graph
+altogether, so they are neither suggested nor used as B. A never gets
+suggested accounts that:
+
+* are A itself or already followed by A
+* are blocked in either direction
+* have a hidden profile
+
+When NumPy and SciPy are installed, the scores are sparse matrix products
+over CSR arrays, computed a block of users at a time. Otherwise the same
+arrays are walked in pure Python, which is fine for small sites and tests.
+The graph is read once, either way. Each block of users gets its rows
+replaced in its own short transaction, so the table stays readable
+throughout the run.
+
+``suggestions_for`` serves the profile sidebar in one query. It re-checks
+follows and blocks made since the last run.
+"""
+import heapq
+import math
+from array import array
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from posts import visibility
+from posts.models import Block, Like
+from .models import Follow, FollowSuggestion, Settings
+
+LIKE_WEIGHT = 0.5
+# Scores are compared at this precision and ties go to the lowest id. The
+# engines add the same terms in different orders, so they only agree up to
+# float rounding.
+SCORE_DIGITS = 9
+
+# Active user ids (sorted), parallel id arrays of the follow, like (liker,
+# author) and block pairs, and the ids of users with hidden profiles
+Graph = namedtuple('Graph', ['user_ids', 'follows', 'likes', 'blocks', 'hidden'])
+
+
+def _pairs(queryset, *fields):
+    """Two parallel int64 arrays of ``fields``, read without building model instances"""
+    left, right = array('q'), array('q')
+    for a, b in queryset.values_list(*fields).iterator(chunk_size=10000):
+        left.append(a)
+        right.append(b)
+    return left, right
+
+
+def load_graph():
+    """The graph between active users only, so both engines score the same edges"""
+    return Graph(
+        user_ids=array('q', User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True).iterator()),
+        follows=_pairs(
+            Follow.objects.filter(follower__is_active=True, following__is_active=True), 'follower_id', 'following_id',
+        ),
+        likes=_pairs(Like.objects.filter(user__is_active=True, post__user__is_active=True), 'user_id', 'post__user_id'),
+        blocks=_pairs(Block.objects.all(), 'blocker_id', 'blocked_user_id'),
+        hidden=set(Settings.objects.filter(profile_visible=False).values_list('user_id', flat=True)),
+    )
+
+
+def scipy_available():
+    try:
+        import numpy  # noqa: F401
+        import scipy.sparse  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _score_python(graph, per_user, max_following, block_size):
+    """Yield ``(user id, [(suggested id, score, mutual count), ...])`` for every active user"""
+    following = defaultdict(set)
+    for follower, followed in zip(*graph.follows):
+        following[follower].add(followed)
+    liked = defaultdict(Counter)
+    for liker, author in zip(*graph.likes):
+        liked[liker][author] += 1
+    blocked = defaultdict(set)
+    for blocker, blocked_user in zip(*graph.blocks):
+        blocked[blocker].add(blocked_user)
+        blocked[blocked_user].add(blocker)
+    weights = {
+        middle: 1 / math.log(2 + len(followed))
+        for middle, followed in following.items() if len(followed) <= max_following
+    }
+    allowed = set(graph.user_ids) - graph.hidden
+
+    for user_id in graph.user_ids:
+        scores = defaultdict(float)
+        mutual = Counter()
+        for middle in following.get(user_id, ()):
+            weight = weights.get(middle)
+            if weight is None:
+                continue
+            for candidate in following[middle]:
+                scores[candidate] += weight
+                mutual[candidate] += 1
+        for author, likes in liked.get(user_id, {}).items():
+            scores[author] += LIKE_WEIGHT * math.log1p(likes)
+        excluded = following.get(user_id, set()) | blocked.get(user_id, set()) | {user_id}
+        best = heapq.nsmallest(per_user, (
+            (-round(score, SCORE_DIGITS), candidate, score) for candidate, score in scores.items()
+            if candidate in allowed and candidate not in excluded
+        ))
+        yield user_id, [(candidate, score, mutual[candidate]) for _, candidate, score in best]
+
+
+def _score_scipy(graph, per_user, max_following, block_size):
+    """``_score_python`` as sparse matrix products, ``block_size`` users at a time"""
+    import numpy as np
+    from scipy import sparse
+
+    ids = np.asarray(graph.user_ids, dtype=np.int64)
+    n = len(ids)
+    if not n:
+        return
+
+    def matrix(pairs):
+        """n x n CSR matrix counting the pairs between active users"""
+        rows, cols = (np.asarray(side, dtype=np.int64) for side in pairs)
+        row_index = np.searchsorted(ids, rows).clip(max=n - 1)
+        col_index = np.searchsorted(ids, cols).clip(max=n - 1)
+        keep = (ids[row_index] == rows) & (ids[col_index] == cols)
+        ones = np.ones(int(keep.sum()), dtype=np.float64)
+        # Duplicate pairs are summed
+        return sparse.csr_matrix((ones, (row_index[keep], col_index[keep])), shape=(n, n))
+
+    follows = matrix(graph.follows)
+    following_counts = np.diff(follows.indptr)
+    is_middle = following_counts <= max_following
+    weighted = sparse.diags(np.where(is_middle, 1 / np.log(2 + following_counts), 0.0)) @ follows
+    counted = sparse.diags(is_middle.astype(np.float64)) @ follows
+    likes = matrix(graph.likes)
+    likes.data = LIKE_WEIGHT * np.log1p(likes.data)
+    blocks = matrix(graph.blocks)
+    excluded = (follows + blocks + blocks.T + sparse.identity(n, format='csr')).tocsr()
+    hidden = np.fromiter(graph.hidden, dtype=np.int64, count=len(graph.hidden))
+    allowed = sparse.diags((~np.isin(ids, hidden)).astype(np.float64))
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        rows = follows[start:stop]
+        scores = ((rows @ weighted + likes[start:stop]) @ allowed).tocsr()
+        scores = (scores - scores.multiply(excluded[start:stop] > 0)).tocsr()
+        scores.eliminate_zeros()
+        mutual = (rows @ counted).tocsr()
+        mutual.sort_indices()
+        for offset in range(stop - start):
+            lo, hi = scores.indptr[offset], scores.indptr[offset + 1]
+            cols, values = scores.indices[lo:hi], scores.data[lo:hi]
+            # Columns are sorted user ids, so lexsort breaks ties by id
+            order = np.lexsort((cols, -np.round(values, SCORE_DIGITS)))[:per_user]
+            cols, values = cols[order], values[order]
+            mutual_cols = mutual.indices[mutual.indptr[offset]:mutual.indptr[offset + 1]]
+            mutual_counts = mutual.data[mutual.indptr[offset]:mutual.indptr[offset + 1]]
+            found = np.searchsorted(mutual_cols, cols).clip(max=max(len(mutual_cols) - 1, 0))
+            shared = [
+                int(mutual_counts[i]) if len(mutual_cols) and mutual_cols[i] == col else 0
+                for i, col in zip(found, cols)
+            ]
+            yield int(ids[start + offset]), [
+                (int(ids[col]), float(value), count) for col, value, count in zip(cols, values, shared)
+            ]
+
+
+def _write(batch, now):
+    """Replace the suggestions of a batch of users"""
+    rows = [
+        FollowSuggestion(
+            user_id=user_id, suggested_id=suggested_id, rank=rank, score=score, mutual_count=mutual, computed_at=now,
+        )
+        for user_id, best in batch
+        for rank, (suggested_id, score, mutual) in enumerate(best, 1)
+    ]
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id__in=[user_id for user_id, _ in batch]).delete()
+        FollowSuggestion.objects.bulk_create(rows, batch_size=5000)
+    return len(rows)
+
+
+def compute_suggestions(now=None, batch_size=1000, use_scipy=None):
+    """Rescore every active user's suggestions; returns ``(users, suggestions, engine)``"""
+    now = now or timezone.now()
+    use_scipy = scipy_available() if use_scipy is None else use_scipy
+    score = _score_scipy if use_scipy else _score_python
+    graph = load_graph()
+    written = 0
+    batch = []
+    for entry in score(graph, settings.SUGGESTIONS_PER_USER, settings.SUGGESTIONS_MAX_FOLLOWING, batch_size):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            written += _write(batch, now)
+            batch = []
+    if batch:
+        written += _write(batch, now)
+    # Rows of users who are gone or no longer active
+    FollowSuggestion.objects.filter(computed_at__lt=now).delete()
+    return len(graph.user_ids), written, 'scipy' if use_scipy else 'python'
+
+
+def _suggestions_queryset(viewer, limit, excluded):
+    suggestions = (
+        FollowSuggestion.objects.filter(user=viewer.id)
+        # Followed since the last run
+        .filter(~Exists(Follow.objects.filter(follower=viewer.id, following=OuterRef('suggested'))))
+        .select_related('suggested__profile')
+        .order_by('rank')
+    )
+    return visibility.visible_users(suggestions, viewer, excluded, field='suggested')[:limit or settings.SUGGESTIONS_SHOWN]
+
+
+def suggestions_for(viewer, limit=None, excluded=None):
+    """The best current FollowSuggestion rows for ``viewer``, with ``suggested.profile`` loaded"""
+    if not viewer.is_authenticated:
+        return []
+    return list(_suggestions_queryset(viewer, limit, excluded))
+
+
+async def asuggestions_for(viewer, limit=None, excluded=None):
+    if not viewer.is_authenticated:
+        return []
+    return [suggestion async for suggestion in _suggestions_queryset(viewer, limit, excluded)]
@@ -1,3 +1,275 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Block, Like, Post
+from . import context, suggestions
+from .models import Follow, FollowSuggestion, OutboundEmail, Profile, Settings
+from . import outbox
+from .outbox import enqueue, process_outbox
 
 # Create your tests here.
+
+class FailingBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP unavailable')
+
+
+class CountingBackend(EmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+        return super().open()
+
+
+@override_settings(OUTBOX_COALESCE_SECONDS=0)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='author@example.com')
+        Settings.objects.create(user=self.author)
+        self.post = Post.objects.create(user=self.author, text='Hello world')
+        self.fans = [User.objects.create(username=f'fan{i}', email=f'fan{i}@example.com') for i in range(12)]
+
+    def test_like_burst_is_coalesced_into_one_email(self):
+        for fan in self.fans:
+            enqueue('like', self.author.id, actor=fan, post_id=self.post.id)
+
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, '12 people liked your post')
+        self.assertEqual(OutboundEmail.objects.filter(status='sent').count(), 12)
+
+    def test_pending_rows_of_a_due_burst_are_swept_up(self):
+        enqueue('follow', self.author.id, actor=self.fans[0])
+        later = enqueue('follow', self.author.id, actor=self.fans[1])
+        OutboundEmail.objects.filter(id=later.id).update(send_after=timezone.now() + timedelta(minutes=5))
+
+        process_outbox()
+        self.assertEqual(mail.outbox[0].subject, '2 people started following you')
+
+    def test_batch_uses_a_single_connection(self):
+        enqueue('welcome', self.fans[0].id)
+        enqueue('welcome', self.fans[1].id)
+        enqueue('like', self.author.id, actor=self.fans[2], post_id=self.post.id)
+        CountingBackend.opened = 0
+
+        process_outbox(connection=CountingBackend())
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_disabled_notifications_are_skipped(self):
+        Settings.objects.filter(user=self.author).update(email_notifications=False)
+        enqueue('like', self.author.id, actor=self.fans[0], post_id=self.post.id)
+
+        self.assertEqual(process_outbox(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().status, 'skipped')
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_BASE_SECONDS=30)
+    def test_failures_are_retried_with_backoff(self):
+        email = enqueue('welcome', self.fans[0].id)
+
+        self.assertEqual(process_outbox(connection=FailingBackend()), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.send_after, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(process_outbox(), (0, 0))
+
+        OutboundEmail.objects.filter(id=email.id).update(send_after=timezone.now())
+        process_outbox(connection=FailingBackend())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+
+    def test_rows_claimed_by_another_worker_are_not_sent_twice(self):
+        for fan in self.fans[:3]:
+            enqueue('like', self.author.id, actor=fan, post_id=self.post.id)
+        claim = outbox._claim
+
+        def other_worker_first(token, email_ids, now):
+            claim('other', email_ids, now)
+            return claim(token, email_ids, now)
+
+        with mock.patch.object(outbox, '_claim', other_worker_first):
+            self.assertEqual(process_outbox(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(set(OutboundEmail.objects.values_list('status', 'claim')), {('sending', 'other')})
+
+    def test_expired_claims_are_sent_again(self):
+        email = enqueue('welcome', self.fans[0].id)
+        OutboundEmail.objects.filter(id=email.id).update(
+            status='sending', claim='crashed', send_after=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertEqual(process_outbox(), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+
+    def test_attempts_are_counted_per_row(self):
+        first = enqueue('like', self.author.id, actor=self.fans[0], post_id=self.post.id)
+        OutboundEmail.objects.filter(id=first.id).update(attempts=2)
+        second = enqueue('like', self.author.id, actor=self.fans[1], post_id=self.post.id)
+
+        self.assertEqual(process_outbox(connection=FailingBackend()), (0, 1))
+        self.assertEqual(
+            list(OutboundEmail.objects.order_by('id').values_list('attempts', flat=True)), [3, 1],
+        )
+        OutboundEmail.objects.update(send_after=timezone.now())
+        self.assertEqual(process_outbox(), (1, 0))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.attempts, second.attempts), (4, 2))
+
+
+class UserContextTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        for user in self.users:
+            Profile.objects.create(user=user)
+            Settings.objects.create(user=user)
+
+    def test_contexts_load_in_one_query_and_are_remembered(self):
+        self.addCleanup(cache.clear)
+        with self.assertNumQueries(1):
+            contexts = context.load_many([user.id for user in self.users])
+            self.assertEqual(contexts[self.users[0].id].settings.privacy, 'public')
+            self.assertEqual(contexts[self.users[2].id].profile.user.username, 'user2')
+        loader = context.UserContextLoader()
+        with self.assertNumQueries(0):
+            self.assertEqual(loader.get_by_username('user1').user, self.users[1])
+        with mock.patch.object(context, 'cache') as shared:
+            self.assertEqual(loader.get(self.users[1].id).user, self.users[1])
+        shared.get_many.assert_not_called()
+
+    def test_saving_settings_invalidates_the_cached_context(self):
+        user = self.users[0]
+        context.load(user.id)
+        settings_obj = Settings.objects.get(user=user)
+        settings_obj.privacy = 'private'
+        settings_obj.save()
+        self.assertEqual(context.load(user.id).settings.privacy, 'private')
+
+    def test_settings_page_reads_the_signed_in_users_settings(self):
+        self.client.force_login(self.users[0])
+        self.client.get(reverse('settings'))
+        with self.assertNumQueries(0):  # session and user both come from the cache
+            response = self.client.get(reverse('settings'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_sessions_of_the_previous_backend_stay_signed_in(self):
+        self.client.force_login(self.users[0], backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('settings'))
+        self.assertEqual((response.status_code, response.context['user']), (200, self.users[0]))
+
+    def test_profile_edit_keeps_counters_changed_since_the_load(self):
+        user = self.users[0]
+        self.client.force_login(user)
+        # Another process still has the context from before the follow cached
+        stale = context.load(user.id)
+        Follow.objects.create(follower=self.users[1], following=user)
+        cache.set(context.context_key(user.id), stale)
+        response = self.client.post(reverse('profile', args=[user.username]), {'bio': 'Hello'})
+        self.assertEqual(response.status_code, 302)
+        profile = Profile.objects.get(user=user)
+        self.assertEqual((profile.bio, profile.follower_count), ('Hello', 1))
+
+
+class SuggestionTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol, self.dave, self.erin, self.frank = [
+            User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave', 'erin', 'frank')
+        ]
+        Settings.objects.create(user=self.frank, profile_visible=False)
+        for follower, following in [
+            (self.alice, self.bob), (self.bob, self.carol), (self.bob, self.dave),
+            (self.bob, self.erin), (self.bob, self.frank), (self.alice, self.erin),
+        ]:
+            Follow.objects.create(follower=follower, following=following)
+        Block.objects.create(blocker=self.dave, blocked_user=self.alice)
+        Like.objects.create(user=self.alice, post=Post.objects.create(user=self.carol, text='Hi'))
+
+    def test_friends_of_friends_and_liked_authors_are_suggested(self):
+        suggestions.compute_suggestions(use_scipy=False)
+        # dave blocked alice, erin is already followed and frank's profile is hidden
+        self.assertEqual(
+            list(FollowSuggestion.objects.filter(user=self.alice).values_list('suggested__username', 'rank', 'mutual_count')),
+            [('carol', 1, 1)],
+        )
+
+    def test_inactive_accounts_are_neither_suggested_nor_middle_accounts(self):
+        User.objects.filter(pk=self.bob.pk).update(is_active=False)
+        Follow.objects.create(follower=self.erin, following=self.dave)
+        suggestions.compute_suggestions(use_scipy=False)
+        self.assertEqual(
+            list(FollowSuggestion.objects.filter(user=self.alice).values_list('suggested__username', 'mutual_count')),
+            [('carol', 0)],
+        )
+        self.assertFalse(FollowSuggestion.objects.filter(user=self.bob).exists())
+        self.assertFalse(FollowSuggestion.objects.filter(suggested=self.bob).exists())
+
+    @skipUnless(suggestions.scipy_available(), 'requires numpy and scipy')
+    @override_settings(SUGGESTIONS_PER_USER=4, SUGGESTIONS_MAX_FOLLOWING=6)
+    def test_python_and_scipy_engines_agree(self):
+        users = [User.objects.create(username=f'user{i}', is_active=i % 7 != 0) for i in range(40)]
+        users += [self.alice, self.bob, self.carol, self.dave, self.erin, self.frank]
+        for i, user in enumerate(users):
+            for step in (1, 3, 8, 13) if i % 5 else (2, 5, 9, 11, 17, 19, 23, 29):
+                Follow.objects.get_or_create(follower=user, following=users[(i + step) % len(users)])
+            if i % 3 == 0:
+                Like.objects.create(user=user, post=Post.objects.create(user=users[(i * 11 + 4) % len(users)], text='Hi'))
+
+        def run(use_scipy):
+            suggestions.compute_suggestions(now=timezone.now(), use_scipy=use_scipy)
+            return list(FollowSuggestion.objects.order_by('user', 'rank').values_list(
+                'user', 'suggested', 'rank', 'mutual_count', 'score',
+            ))
+
+        python, scipy = run(False), run(True)
+        self.assertEqual([row[:4] for row in python], [row[:4] for row in scipy])
+        for python_row, scipy_row in zip(python, scipy):
+            self.assertAlmostEqual(python_row[4], scipy_row[4])
+
+    def test_suggestions_followed_since_the_last_run_are_skipped_in_one_query(self):
+        suggestions.compute_suggestions(use_scipy=False)
+        Follow.objects.create(follower=self.alice, following=self.carol)
+        with self.assertNumQueries(1):
+            self.assertEqual(suggestions.suggestions_for(self.alice, excluded=frozenset()), [])
+
+
+class FollowListTests(TestCase):
+    def setUp(self):
+        self.star = User.objects.create(username='star')
+        self.viewer = User.objects.create(username='viewer')
+        self.fans = [User.objects.create(username=f'fan{i}') for i in range(5)]
+        for fan in self.fans:
+            Follow.objects.create(follower=fan, following=self.star)
+        Follow.objects.create(follower=self.viewer, following=self.fans[0])
+        Follow.objects.create(follower=self.fans[1], following=self.viewer)
+        self.client.force_login(self.viewer)
+
+    @override_settings(FEED_PAGE_SIZE=3)
+    def test_followers_are_paged_newest_first_with_relationships(self):
+        url = reverse('followers', args=['star'])
+        first = self.client.get(url)
+        self.assertEqual([user.username for user in first.context['users']], ['fan4', 'fan3', 'fan2'])
+        second = self.client.get(url, {'cursor': first.context['next_cursor']})
+        self.assertEqual([user.username for user in second.context['users']], ['fan1', 'fan0'])
+        self.assertIsNone(second.context['next_cursor'])
+        relationships = second.context['relationships']
+        self.assertEqual((relationships.following, relationships.followers), ({self.fans[0].id}, {self.fans[1].id}))
+        self.assertContains(second, 'Follows you', count=1)
+        self.assertContains(second, 'Unfollow', count=1)
+
+    def test_anonymous_users_are_sent_to_the_login_page(self):
+        self.client.logout()
+        for name in ('followers', 'following'):
+            url = reverse(name, args=['star'])
+            response = self.client.get(url)
+            self.assertRedirects(response, f'{settings.LOGIN_URL}?next={url}', fetch_redirect_response=False)
@@ -7,6 +7,8 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('profile/<str:username>/', views.profile_view, name='profile'),
+    path('profile/<str:username>/followers/', views.followers_view, name='followers'),
+    path('profile/<str:username>/following/', views.following_view, name='following'),
     path('settings/', views.settings_view, name='settings'),
     path('password-reset/', views.password_reset_view, name='password_reset'),
     path('password-reset/done/', auth_views.PasswordResetDoneView.as_view(template_name='users/password_reset_done.html'), name='password_reset_done'),
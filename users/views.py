@@ -1,15 +1,22 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordResetForm
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect
+from django.contrib.auth import login, logout
+from django.contrib.auth.forms import AuthenticationForm, PasswordResetForm
 from django.contrib.auth.decorators import login_required
-from .models import Profile, Settings
-from django.core.mail import send_mail
-from django.conf import settings
+from .context import user_contexts
+from .models import Follow, Profile, Settings
 from .forms import UserRegisterForm, ProfileForm, SettingsForm
-from django.contrib.auth.models import User
+from . import outbox, relationships, suggestions
+from core import images
+from core.pagination import apaginate_keyset
+from core.shortcuts import arender, auser
+from posts import cards, visibility
+from posts.models import Post
+from django.conf import settings
+from django.http import Http404
 from django.contrib import messages
-from django.urls import reverse
-from django.template.loader import render_to_string
 
 # Create your views here.
 
@@ -24,29 +31,8 @@ def register_view(request):
             user.save()
             Profile.objects.create(user=user)
             Settings.objects.create(user=user)
-            # Send welcome email
-            welcome_message = f"""
-            Welcome to SocialHub, {user.username}!
-            
-            Thank you for joining our community. Here's what you can do:
-            - Create and share posts with images
-            - Follow other users
-            - Like and comment on posts
-            - Search for users and content
-            - Customize your profile and privacy settings
-            
-            Get started by creating your first post!
-            
-            Best regards,
-            The SocialHub Team
-            """
-            send_mail(
-                'Welcome to SocialHub!',
-                welcome_message,
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=True,
-            )
+            # Queue welcome email
+            outbox.enqueue('welcome', user.id)
             messages.success(request, 'Registration successful! Please log in.')
             return redirect('login')
     else:
@@ -73,29 +59,100 @@ def logout_view(request):
     return redirect('login')
 
 # Profile view
+# Async read path; the owner's form is validated and saved in a thread
+
+def _save_profile(form, profile):
+    """Validate and save the owner's profile form; returns whether it was valid"""
+    if not form.is_valid():
+        return False
+    fields = [*form.changed_data, 'updated_at']
+    if 'avatar' in form.changed_data:
+        images.discard_renditions(profile, 'avatar', 'avatar_renditions')
+        fields.append('avatar_renditions')
+    # Only the edited columns: the counters on ``profile`` may be stale
+    # (it can come from the user context cache) and are kept by bump()
+    form.save(commit=False)
+    profile.save(update_fields=fields)
+    if profile.avatar and 'avatar' in form.changed_data:
+        images.schedule(profile, 'avatar', 'avatar_renditions', 'avatar')
+    return True
+
 @login_required
-def profile_view(request, username):
-    user = get_object_or_404(User, username=username)
-    profile = Profile.objects.get(user=user)
-    posts = user.post_set.all()
-    is_owner = request.user == user
+async def profile_view(request, username):
+    viewer = await auser(request)
+    ctx = await user_contexts(request).aget_by_username(username)
+    if ctx is None or ctx.profile is None or not await visibility.acan_view_profile(viewer, ctx.user.id):
+        raise Http404('No Profile matches the given query.')
+    profile, user = ctx.profile, ctx.user
+    is_owner = viewer == user
     if is_owner:
         if request.method == 'POST':
             form = ProfileForm(request.POST, request.FILES, instance=profile)
-            if form.is_valid():
-                form.save()
+            if await sync_to_async(_save_profile)(form, profile):
                 messages.success(request, 'Profile updated!')
                 return redirect('profile', username=user.username)
         else:
             form = ProfileForm(instance=profile)
     else:
         form = None
-    return render(request, 'users/profile.html', {'profile': profile, 'posts': posts, 'is_owner': is_owner, 'form': form})
+    excluded = await visibility.aexcluded_user_ids(viewer)
+    posts = await apaginate_keyset(
+        Post.objects.for_feed().filter(user=user).visible_to(viewer, excluded), request.GET.get('cursor'), page_size=settings.FEED_PAGE_SIZE,
+    )
+    cards_html, liked_post_ids = await asyncio.gather(
+        cards.aattach_cards(posts),
+        cards.aliked_post_ids(viewer, posts),
+    )
+    # "People you may know" on your own profile
+    follow_suggestions = await suggestions.asuggestions_for(viewer, excluded=excluded) if is_owner else []
+    return await arender(request, 'users/profile.html', {
+        'profile': profile,
+        'posts': cards_html,
+        'next_cursor': posts.next_cursor,
+        'liked_post_ids': liked_post_ids,
+        'is_owner': is_owner,
+        'form': form,
+        'follow_suggestions': follow_suggestions,
+    })
+
+# Followers/following lists, newest first, with the viewer's relationship
+# to each listed user
+
+async def _follow_list(request, username, user_field, other_field, title):
+    viewer = await auser(request)
+    ctx = await user_contexts(request).aget_by_username(username)
+    if ctx is None or not await visibility.acan_view_profile(viewer, ctx.user.id):
+        raise Http404('No Profile matches the given query.')
+    excluded = await visibility.aexcluded_user_ids(viewer)
+    follows = visibility.visible_users(
+        Follow.objects.filter(**{user_field: ctx.user.id}).select_related(f'{other_field}__profile'),
+        viewer, excluded, field=other_field,
+    )
+    page = await apaginate_keyset(
+        follows, request.GET.get('cursor'), field='created_at', page_size=settings.FEED_PAGE_SIZE,
+    )
+    users = [getattr(follow, other_field) for follow in page]
+    return await arender(request, 'users/follow_list.html', {
+        'profile_user': ctx.user,
+        'title': title,
+        'users': users,
+        'relationships': await relationships.arelationships(viewer, users),
+        'next_cursor': page.next_cursor,
+    })
+
+@login_required
+async def followers_view(request, username):
+    return await _follow_list(request, username, 'following', 'follower', 'Followers')
+
+@login_required
+async def following_view(request, username):
+    return await _follow_list(request, username, 'follower', 'following', 'Following')
 
 # Settings view
 @login_required
 def settings_view(request):
-    settings_obj = Settings.objects.get(user=request.user)
+    # Loaded along with the signed-in user (users.context)
+    settings_obj = request.user.settings
     if request.method == 'POST':
         form = SettingsForm(request.POST, instance=settings_obj)
         if form.is_valid():
@@ -125,70 +182,18 @@ def password_reset_view(request):
     return render(request, 'users/password_reset.html', {'form': form})
 
 # Email notification functions
+# These only queue an OutboundEmail row; the send_outbox worker renders,
+# coalesces and delivers them outside the request.
 def send_like_notification(post, liker):
-    """Send email notification when someone likes your post"""
-    if post.user != liker and post.user.settings.email_notifications:
-        subject = f'{liker.username} liked your post'
-        message = f"""
-        Hi {post.user.username},
-        
-        {liker.username} just liked your post: "{post.text[:50]}{'...' if len(post.text) > 50 else ''}"
-        
-        View your post: http://127.0.0.1:8000/posts/post/{post.id}/
-        
-        Best regards,
-        SocialHub Team
-        """
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [post.user.email],
-            fail_silently=True,
-        )
-
-def send_comment_notification(post, commenter):
-    """Send email notification when someone comments on your post"""
-    if post.user != commenter and post.user.settings.email_notifications:
-        subject = f'{commenter.username} commented on your post'
-        message = f"""
-        Hi {post.user.username},
-        
-        {commenter.username} just commented on your post: "{post.text[:50]}{'...' if len(post.text) > 50 else ''}"
-        
-        Comment: "{commenter.comment_set.last().text}"
-        
-        View your post: http://127.0.0.1:8000/posts/post/{post.id}/
-        
-        Best regards,
-        SocialHub Team
-        """
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [post.user.email],
-            fail_silently=True,
-        )
+    """Queue an email notification when someone likes your post"""
+    if post.user_id != liker.id:
+        outbox.enqueue('like', post.user_id, actor=liker, post_id=post.id)
+
+def send_comment_notification(post, commenter, comment):
+    """Queue an email notification when someone comments on your post"""
+    if post.user_id != commenter.id:
+        outbox.enqueue('comment', post.user_id, actor=commenter, post_id=post.id, excerpt=comment.text[:200])
 
 def send_follow_notification(follower, following):
-    """Send email notification when someone follows you"""
-    if following.settings.email_notifications:
-        subject = f'{follower.username} started following you'
-        message = f"""
-        Hi {following.username},
-        
-        {follower.username} just started following you on SocialHub!
-        
-        View their profile: http://127.0.0.1:8000/users/profile/{follower.username}/
-        
-        Best regards,
-        SocialHub Team
-        """
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [following.email],
-            fail_silently=True,
-        )
+    """Queue an email notification when someone follows you"""
+    outbox.enqueue('follow', following.id, actor=follower)